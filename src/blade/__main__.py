@@ -11,8 +11,14 @@ command line in this way: python blade.zip
 
 
 import sys
-from blade_main import main
+from blade_server import run_in_server
 
 
 if __name__ == '__main__':
+    # Run the command in the blade server if it is running, the other
+    # blade modules are not imported in this case
+    exit_code = run_in_server(sys.argv[1:])
+    if exit_code is not None:
+        sys.exit(exit_code)
+    from blade_main import main
     main(sys.argv[0])
@@ -0,0 +1,110 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the action graph module, the targets supported by the ninja
+ backend describe their build steps as actions instead of the rules text,
+ and the actions of all targets are put into the action graph, which is
+ serialized to build.ninja.
+
+ The scons backend does not use the actions, the SConstruct rules are
+ calls of the scons builders, which build their own dependency graph.
+
+"""
+
+
+import console
+
+
+# The resource classes of the actions, the backend schedules the actions
+# of different classes differently, such as the linking actions take much
+# more memory than the others
+RESOURCE_CLASSES = frozenset(['compile', 'archive', 'link', 'copy',
+                              'generate'])
+
+
+class Action(object):
+    """Action.
+
+    An action runs the command with env to produce the outputs from the
+    inputs.  The command is the name of the command template of the
+    backend, such as 'cxx', and env is a list of (name, value) pairs the
+    template is expanded with.  implicit_deps are the inputs not passed
+    to the command, order_only_deps are only built before the action.
+
+    """
+    def __init__(self, target, outputs, command,
+                 inputs=None, implicit_deps=None, order_only_deps=None,
+                 env=None, resource_class='generate'):
+        if resource_class not in RESOURCE_CLASSES:
+            console.error_exit('%s: invalid resource class %s' % (
+                    target, resource_class))
+        self.target = target
+        self.outputs = list(outputs)
+        self.command = command
+        self.inputs = list(inputs or [])
+        self.implicit_deps = list(implicit_deps or [])
+        self.order_only_deps = list(order_only_deps or [])
+        self.env = list(env or [])
+        self.resource_class = resource_class
+
+    def _fields(self):
+        """The fields defining what the action does, except the target
+        which the action belongs to.
+
+        """
+        return (self.outputs, self.command, self.inputs, self.implicit_deps,
+                self.order_only_deps, self.env, self.resource_class)
+
+    def __eq__(self, other):
+        return (isinstance(other, Action) and
+                self._fields() == other._fields())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Action(%s, %s, %s)' % (self.target, self.command,
+                                       self.outputs)
+
+
+class ActionGraph(object):
+    """ActionGraph.
+
+    The actions of the targets, in the order they are added, indexed by
+    their outputs.  The same action added by more than one target is kept
+    once, and two different actions producing the same file are reported.
+
+    """
+    def __init__(self):
+        self.actions = []
+        # {output : action}
+        self.producers = {}
+
+    def add_action(self, action):
+        """Add the action into the graph. """
+        existing = None
+        for output in action.outputs:
+            existing = self.producers.get(output)
+            if existing is not None:
+                break
+        if existing is not None:
+            if existing != action:
+                console.error_exit('%s: %s is also generated by %s' % (
+                        action.target, output, existing.target))
+            return
+        for output in action.outputs:
+            self.producers[output] = action
+        self.actions.append(action)
+
+    def add_actions(self, actions):
+        for action in actions:
+            self.add_action(action)
+
+    def get_producer(self, path):
+        """Returns the action producing path or None if it is a source. """
+        return self.producers.get(path)
+
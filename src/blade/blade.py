@@ -13,18 +13,35 @@
 
 
 import os
+import sys
+import time
 
 import configparse
 import console
 
 from blade_util import relative_path, cpu_count
+from blade_util import get_blade_cache_file
+from build_file_cache import BuildFileCache
+from critical_path import CriticalPath
+from critical_path import load_target_timings
+from critical_path import report_critical_path
 from dependency_analyzer import analyze_deps
+from load_build_files import find_depended_targets
 from load_build_files import load_targets
+from load_build_files import TargetAttributes
+from query_engine import QueryExpression
+from query_output import write_query_result
+from blade_platform import get_scons_platform
 from blade_platform import SconsPlatform
 from build_environment import BuildEnvironment
+from rules_fragment_cache import RulesFragmentCache
+from ninja_rules_generator import NinjaRulesGenerator
 from rules_generator import SconsRulesGenerator
+from rules_generator import generate_target_rules
+from rules_generator import generate_targets_rules_in_parallel
 from binary_runner import BinaryRunner
 from test_runner import TestRunner
+from toolchain_probe import ToolchainProbe
 
 
 # Global blade manager
@@ -55,6 +72,10 @@ class Blade(object):
         # Source dir of current loading BUILD file
         self.__current_source_path = blade_root_dir
 
+        # The parsed query expression of the query command, or None if
+        # the legacy --deps/--depended query is used
+        self.__query_expression = None
+
         # The direct targets that are used for analyzing
         self.__direct_targets = []
 
@@ -71,6 +92,11 @@ class Blade(object):
         # command line targets.
         self.__target_database = {}
 
+        # The descriptors of the targets defined in the loaded BUILD files,
+        # {key : descriptor}.  The target objects are constructed from the
+        # descriptors only when they are required by the command targets.
+        self.__target_descriptors = {}
+
         # targets to build after loading the build files.
         self.__build_targets = {}
 
@@ -78,14 +104,43 @@ class Blade(object):
         # Used to generate build rules in correct order.
         self.__sorted_targets_keys = []
 
+        # The topological levels of the build targets, TargetLevels
+        self.__target_levels = None
+
+        # The direct deps of the build targets, {key : [dep key]}, they
+        # include the implicit deps such as protobuf, which are not in the
+        # deps property of targets, and are replaced by the expanded deps
+        # in analyzing
+        self.__direct_deps = {}
+
         # Inidcating that whether the deps list is expanded by expander or not
         self.__targets_expanded = False
 
-        self.__scons_platform = SconsPlatform()
-        self.build_environment = BuildEnvironment(self.__root_dir)
+        # The reverse dependency index, {key : [depender keys]}.  Before
+        # analyzing, it holds the direct dependers of the registered
+        # targets; after analyzing, it is rebuilt from the expanded deps
+        # of the build targets so it holds all the dependers.
+        self.__depended_by = {}
+
+        # {path : [depender keys]}, the targets which depend on any target
+        # in the path
+        self.__dir_depended_by = {}
+
+        # The tools are probed on demand, the ones required by the build
+        # targets are probed in parallel before generating the rules
+        self.__toolchain_probe = ToolchainProbe(
+                self.get_blade_cache_file('toolchain_probes'))
+        self.__scons_platform = get_scons_platform(self.__toolchain_probe)
+        self.build_environment = None
 
         self.svn_root_dirs = []
 
+        # Cache of the BUILD files loading results, created on demand
+        self.__build_file_cache = None
+
+        # [(phase, seconds)] of generating the build script
+        self.__phase_times = []
+
     def _get_normpath_target(self, command_target):
         """returns a tuple (path, name).
 
@@ -108,12 +163,23 @@ class Blade(object):
         if self.__command == 'query':
             working_dir = self.__root_dir
 
-            if '...' not in self.__command_targets:
+            query_expression = getattr(self.__options,
+                                       'query_expression', None)
+            if query_expression:
+                # Load the targets mentioned in the expression only
+                self.__query_expression = QueryExpression(
+                        query_expression,
+                        relative_path(self.__working_dir, self.__root_dir))
+                self.__command_targets = (
+                        self.__query_expression.target_patterns())
+            elif '...' not in self.__command_targets:
                 new_target_list = []
                 for target in self.__command_targets:
                     new_target_list.append('%s:%s' %
                             self._get_normpath_target(target))
                 self.__command_targets = new_target_list
+                if getattr(self.__options, 'depended', False):
+                    self._add_depended_targets()
         else:
             working_dir = self.__working_dir
         (self.__direct_targets,
@@ -125,29 +191,80 @@ class Blade(object):
         console.info('loading done.')
         return self.__direct_targets, self.__all_command_targets  # For test
 
+    def _add_depended_targets(self):
+        """Add the targets depending on the query targets, which are found
+        by the reverse deps index, to the command targets, so only the
+        BUILD files on the reverse paths are loaded.
+
+        """
+        keys = [tuple(target.split(':')) for target in self.__command_targets]
+        dependers = find_depended_targets(keys, self.__root_dir, self)
+        if dependers is None:
+            self.__command_targets = ['...']
+            return
+        self.__command_targets += ['%s:%s' % key for key in sorted(dependers)]
+
     def analyze_targets(self):
         """Expand the targets. """
         console.info('analyzing dependency graph...')
-        self.__sorted_targets_keys = analyze_deps(self.__build_targets)
+        self.__direct_deps = dict(
+                (key, list(target.expanded_deps))
+                for key, target in self.__build_targets.iteritems())
+        (self.__sorted_targets_keys,
+         self.__target_levels) = analyze_deps(
+                 self.__build_targets,
+                 self.get_blade_cache_file('deps_closures'))
         self.__targets_expanded = True
+        self._build_reverse_deps_index()
 
         console.info('analyzing done.')
         return self.__build_targets  # For test
 
+    def _probe_toolchain(self):
+        """Probe the tools required to build the targets in parallel. """
+        target_types = set([target.type
+                            for target in self.__build_targets.itervalues()])
+        self.__toolchain_probe.probe(
+                self.__scons_platform.get_probe_commands(
+                        SconsPlatform.get_required_info(target_types)) +
+                BuildEnvironment.PROBE_COMMANDS)
+        self.build_environment = BuildEnvironment(
+                self.__root_dir, toolchain_probe=self.__toolchain_probe)
+
     def generate_build_rules(self):
         """Generate the constructing rules. """
+        self._probe_toolchain()
         console.info('generating build rules...')
-        build_rules_generator = SconsRulesGenerator('SConstruct',
-                                                    self.__blade_path, self)
-        rules_buf = build_rules_generator.generate_scons_script()
+        if getattr(self.__options, 'backend', 'scons') == 'ninja':
+            build_rules_generator = NinjaRulesGenerator('build.ninja',
+                                                        self.__blade_path,
+                                                        self)
+            rules_buf = build_rules_generator.generate_ninja_script()
+        else:
+            build_rules_generator = SconsRulesGenerator('SConstruct',
+                                                        self.__blade_path,
+                                                        self)
+            rules_buf = build_rules_generator.generate_scons_script()
         console.info('generating done.')
         return rules_buf
 
     def generate(self):
-        """Generate the build script. """
-        self.load_targets()
-        self.analyze_targets()
-        self.generate_build_rules()
+        """Generate the build script, the targets are loaded and analyzed
+        first unless they have been, e.g., by the blade server.
+
+        """
+        phases = [('generating', self.generate_build_rules)]
+        if not self.__targets_expanded:
+            phases = [('loading', self.load_targets),
+                      ('analyzing', self.analyze_targets)] + phases
+        for phase, method in phases:
+            start_time = time.time()
+            method()
+            self.__phase_times.append((phase, time.time() - start_time))
+
+    def get_phase_times(self):
+        """Returns [(phase, seconds)] of generating the build script. """
+        return self.__phase_times
 
     def run(self, target):
         """Run the target. """
@@ -170,69 +287,79 @@ class Blade(object):
         print_deps = getattr(self.__options, 'deps', False)
         print_depended = getattr(self.__options, 'depended', False)
         dot_file = getattr(self.__options, 'output_to_dot', '')
-        result_map = self.query_helper(targets)
+        output_format = getattr(self.__options, 'output_format', 'text')
+        if getattr(self.__options, 'critical_path', False):
+            return self._query_critical_path()
+        if self.__query_expression is not None:
+            keys = self.__query_expression.evaluate(self.__build_targets,
+                                                    self.__direct_deps)
+        elif dot_file or output_format != 'text':
+            keys = set()
+            for key in self._get_query_keys(targets):
+                keys.add(key)
+                if print_deps:
+                    keys.update(self.__build_targets[key].expanded_deps)
+                if print_depended:
+                    keys.update(self.get_depended_by(key))
+            keys = sorted(keys)
+        else:
+            self._print_query_result(targets, print_deps, print_depended)
+            return 0
+
         if dot_file:
-            print_mode = 0
-            if print_deps:
-                print_mode = 0
-            if print_depended:
-                print_mode = 1
-            dot_file = os.path.join(self.__working_dir, dot_file)
-            self.output_dot(result_map, print_mode, dot_file)
+            output = open(os.path.join(self.__working_dir, dot_file), 'w')
+            output_format = 'dot'
         else:
-            if print_deps:
-                for key in result_map:
-                    print '\n'
-                    deps = result_map[key][0]
-                    console.info('//%s:%s depends on the following targets:' % (
-                            key[0], key[1]))
-                    for d in deps:
-                        print '%s:%s' % (d[0], d[1])
-            if print_depended:
-                for key in result_map:
-                    print '\n'
-                    depended_by = result_map[key][1]
-                    console.info('//%s:%s is depended by the following targets:' % (
-                            key[0], key[1]))
-                    depended_by.sort(key=lambda x: x, reverse=False)
-                    for d in depended_by:
-                        print '%s:%s' % (d[0], d[1])
+            output = sys.stdout
+        try:
+            write_query_result(output, output_format, keys,
+                               self.__build_targets, self.__direct_deps,
+                               getattr(self.__options,
+                                       'transitive_reduction', False))
+        finally:
+            if output is not sys.stdout:
+                output.close()
         return 0
 
-    def print_dot_node(self, output_file, node):
-        print >>output_file, '"%s:%s" [label = "%s:%s"]' % (node[0],
-                                                            node[1],
-                                                            node[0],
-                                                            node[1])
-
-    def print_dot_deps(self, output_file, node, target_set):
-        targets = self.__build_targets
-        deps = targets[node].deps
-        for i in deps:
-            if not i in target_set:
-                continue
-            print >>output_file, '"%s:%s" -> "%s:%s"' % (node[0],
-                                                         node[1],
-                                                         i[0],
-                                                         i[1])
-
-    def output_dot(self, result_map, print_mode, dot_file):
-        f = open(dot_file, 'w')
-        targets = result_map.keys()
-        nodes = set(targets)
-        for key in targets:
-            nodes |= set(result_map[key][print_mode])
-        print >>f, 'digraph blade {'
-        for i in nodes:
-            self.print_dot_node(f, i)
-        for i in nodes:
-            self.print_dot_deps(f, i, nodes)
-        print >>f, '}'
-        f.close()
+    def _query_critical_path(self):
+        """Report the critical path of building the queried targets. """
+        keys = set()
+        for key in self.__query_expression.evaluate(self.__build_targets,
+                                                    self.__direct_deps):
+            keys.add(key)
+            keys.update(self.__build_targets[key].expanded_deps)
+        target_timings = load_target_timings(
+                self.get_blade_cache_file('action_timings'),
+                self.__build_targets,
+                self.__build_path)
+        report_critical_path(CriticalPath(keys,
+                                          self.__target_levels.levels,
+                                          self.__direct_deps,
+                                          target_timings))
+        return 0
 
-    def query_helper(self, targets):
-        """Query the targets helper method. """
-        all_targets = self.__build_targets
+    def _print_query_result(self, targets, print_deps, print_depended):
+        """Print the legacy --deps/--depended query result as text. """
+        query_list = self._get_query_keys(targets)
+        if print_deps:
+            for key in query_list:
+                print '\n'
+                deps = sorted(self.__build_targets[key].expanded_deps)
+                console.info('//%s:%s depends on the following targets:' % (
+                        key[0], key[1]))
+                for d in deps:
+                    print '%s:%s' % (d[0], d[1])
+        if print_depended:
+            for key in query_list:
+                print '\n'
+                depended_by = sorted(self.get_depended_by(key))
+                console.info('//%s:%s is depended by the following targets:' % (
+                        key[0], key[1]))
+                for d in depended_by:
+                    print '%s:%s' % (d[0], d[1])
+
+    def _get_query_keys(self, targets):
+        """Returns the keys of the legacy query targets. """
         query_list = []
         target_path = relative_path(self.__working_dir, self.__root_dir)
         t_path = ''
@@ -244,23 +371,26 @@ class Blade(object):
                 t_path = target_path + '/' + key[0]
             t_path = os.path.normpath(t_path)
             query_list.append((t_path, key[1]))
+        return query_list
+
+    def query_helper(self, targets):
+        """Query the targets helper method. """
+        all_targets = self.__build_targets
         result_map = {}
-        for key in query_list:
-            result_map[key] = ([], [])
-            deps = all_targets[key].expanded_deps
-            deps.sort(key=lambda x: x, reverse=False)
-            depended_by = []
-            for tkey in all_targets:
-                if key in all_targets[tkey].expanded_deps:
-                    depended_by.append(tkey)
-            depended_by.sort(key=lambda x: x, reverse=False)
-            result_map[key] = (list(deps), list(depended_by))
+        for key in self._get_query_keys(targets):
+            deps = sorted(all_targets[key].expanded_deps)
+            depended_by = sorted(self.get_depended_by(key))
+            result_map[key] = (deps, depended_by)
         return result_map
 
     def get_build_path(self):
         """The current building path. """
         return self.__build_path
 
+    def get_blade_path(self):
+        """The path of blade itself. """
+        return self.__blade_path
+
     def get_root_dir(self):
         """Return the blade root path. """
         return self.__root_dir
@@ -273,10 +403,26 @@ class Blade(object):
         """Get the current source path. """
         return self.__current_source_path
 
+    def get_blade_cache_file(self, name):
+        """Returns the path of a cache file maintained by blade. """
+        return get_blade_cache_file(self.__build_path, name)
+
+    def get_build_file_cache(self):
+        """Returns the cache of the BUILD files loading results. """
+        if self.__build_file_cache is None:
+            self.__build_file_cache = BuildFileCache(
+                    self.get_blade_cache_file('build_files'),
+                    TargetAttributes(self.__options).cache_key())
+        return self.__build_file_cache
+
     def get_target_database(self):
         """Get the whole target database that haven't been expanded. """
         return self.__target_database
 
+    def get_target_descriptors(self):
+        """Get the descriptors of the targets defined in BUILD files. """
+        return self.__target_descriptors
+
     def get_direct_targets(self):
         """Return the direct targets. """
         return self.__direct_targets
@@ -285,10 +431,18 @@ class Blade(object):
         """Get all the targets to be build. """
         return self.__build_targets
 
+    def get_direct_deps(self):
+        """Get the direct deps of the build targets before expanding. """
+        return self.__direct_deps
+
     def get_options(self):
         """Get the global command options. """
         return self.__options
 
+    def get_target_levels(self):
+        """Get the topological levels of the build targets. """
+        return self.__target_levels
+
     def is_expanded(self):
         """Whether the targets are expanded. """
         return self.__targets_expanded
@@ -307,6 +461,48 @@ class Blade(object):
                     'target name %s is duplicate in //%s/BUILD' % (
                         target.name, target.path))
         self.__target_database[target_key] = target
+        self._add_reverse_deps(target_key, target.expanded_deps)
+
+    def register_target_descriptor(self, descriptor):
+        """Register the descriptor of a target to be constructed lazily. """
+        key = descriptor.key
+        if key in self.__target_descriptors or key in self.__target_database:
+            console.error_exit(
+                    'target name %s is duplicate in //%s/BUILD' % (
+                        key[1], key[0]))
+        self.__target_descriptors[key] = descriptor
+
+    def _add_reverse_deps(self, key, deps):
+        """Add the reverse edges of key to the reverse dependency index. """
+        for dkey in deps:
+            self.__depended_by.setdefault(dkey, []).append(key)
+            dir_dependers = self.__dir_depended_by.setdefault(dkey[0], [])
+            if not dir_dependers or dir_dependers[-1] != key:
+                dir_dependers.append(key)
+
+    def _build_reverse_deps_index(self):
+        """Rebuild the reverse dependency index from the expanded deps. """
+        self.__depended_by = {}
+        self.__dir_depended_by = {}
+        for key in sorted(self.__build_targets):
+            self._add_reverse_deps(key, self.__build_targets[key].expanded_deps)
+
+    def get_depended_by(self, key, target_types=None):
+        """Returns the keys of the targets which depend on the target key.
+
+        Only the targets whose type is in target_types are returned if it
+        is specified.
+
+        """
+        depended_by = self.__depended_by.get(key, [])
+        if target_types is None:
+            return list(depended_by)
+        return [k for k in depended_by
+                if self.__target_database[k].type in target_types]
+
+    def get_dir_depended_by(self, path):
+        """Returns the keys of the targets which depend on targets in path. """
+        return list(self.__dir_depended_by.get(path, []))
 
     def _is_scons_object_type(self, target_type):
         """The types that shouldn't be registered into blade manager.
@@ -320,11 +516,17 @@ class Blade(object):
         return target_type != 'system_library'
 
     def gen_targets_rules(self):
-        """Get the build rules and return to the object who queries this. """
+        """Get the build rules and return to the object who queries this.
+
+        The rules are the lines of the SConstruct for the scons backend,
+        and the actions of the targets for the ninja backend.
+
+        """
         rules_buf = []
         skip_test_targets = False
         if getattr(self.__options, 'no_test', False):
             skip_test_targets = True
+        keys = []
         for k in self.__sorted_targets_keys:
             target = self.__build_targets[k]
             if not self._is_scons_object_type(target.type):
@@ -335,10 +537,69 @@ class Blade(object):
                 continue
             if skip_test_targets and target.type == 'cc_test':
                 continue
-            scons_object.scons_rules()
-            rules_buf += scons_object.get_rules()
+            keys.append(k)
+
+        backend = getattr(self.__options, 'backend', 'scons')
+        cache_name = 'rules_fragments'
+        if backend != 'scons':
+            cache_name = '%s_rules_fragments' % backend
+
+        # The rules are concatenated in the sorted order, so the output is
+        # the same as the serial generation
+        fragment_cache = None
+        if configparse.blade_config.get_config('global_config')[
+                'rules_fragment_cache']:
+            fragment_cache = RulesFragmentCache(
+                    self.get_blade_cache_file(cache_name), self, backend)
+        targets_rules = {}
+        generate_jobs = getattr(self.__options, 'generate_jobs', 1)
+        if generate_jobs > 1 and len(keys) > 1:
+            targets_rules = generate_targets_rules_in_parallel(
+                    keys, self, generate_jobs, fragment_cache, backend)
+        for k in keys:
+            if k in targets_rules:
+                rules_buf += targets_rules[k]
+                continue
+            scons_object = self.__target_database[k]
+            rules = None
+            if fragment_cache:
+                rules = fragment_cache.get_rules(scons_object)
+            if rules is None:
+                rules = generate_target_rules(scons_object, backend)
+                if fragment_cache:
+                    fragment_cache.update(scons_object, rules)
+            rules_buf += rules
+        if fragment_cache:
+            fragment_cache.save()
+        if backend == 'scons':
+            rules_buf = self._gen_shared_envs_rules(keys, rules_buf)
         return rules_buf
 
+    def _gen_shared_envs_rules(self, keys, rules_buf):
+        """Put the rules defining the envs shared by the targets before
+        the rules of the targets, and report the number of envs.
+
+        """
+        shared_envs_rules = []
+        shared_env_names = set()
+        shared_env_targets = 0
+        for k in keys:
+            shared_env = self.__target_database[k].shared_env
+            if not shared_env:
+                continue
+            shared_env_targets += 1
+            if shared_env[0] not in shared_env_names:
+                shared_env_names.add(shared_env[0])
+                shared_envs_rules += ['%s\n' % rule for rule in shared_env[1]]
+        private_envs = len([rule for rule in rules_buf
+                            if rule.startswith('env_') and
+                            rule.endswith('.Clone()\n')])
+        console.info('%d construction environments generated, '
+                     '%d of them shared by %d targets' % (
+                         private_envs + len(shared_env_names),
+                         len(shared_env_names), shared_env_targets))
+        return shared_envs_rules + rules_buf
+
     def get_scons_platform(self):
         """Return handle of the platform class. """
         return self.__scons_platform
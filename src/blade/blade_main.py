@@ -70,17 +70,22 @@ import os
 import signal
 import subprocess
 import sys
+import time
 import traceback
 from string import Template
 
 import blade
+import blade_server
 import console
 import configparse
 
 from blade import Blade
+from blade_util import get_blade_cache_file
 from blade_util import get_cwd
+from blade_util import load_cache_file
 from blade_util import lock_file
 from blade_util import unlock_file
+from build_fingerprint import BuildFingerprint
 from command_args import CmdArguments
 from configparse import BladeConfig
 from load_build_files import find_blade_root_dir
@@ -92,6 +97,9 @@ query_targets = None
 # Run target
 run_target = None
 
+# The fingerprint of the building, which is saved if the building succeeds
+build_fingerprint = None
+
 
 def is_svn_client(blade_root_dir):
     # We suppose that BLADE_ROOT is under svn root dir now.
@@ -191,8 +199,82 @@ def _check_code_style(opened_files):
     return 0
 
 
-def _main(blade_path):
-    """The main entry of blade. """
+def _check_build_fingerprint(command, targets, working_dir, build_path,
+                             options):
+    """Returns True if nothing is changed since the last successful
+    building of the same targets, then the building is skipped.
+
+    """
+    global build_fingerprint
+    if options.backend != 'scons' or options.scons_only:
+        return False
+    build_fingerprint = BuildFingerprint(
+            get_blade_cache_file(build_path, 'build_fingerprint'),
+            command, targets, working_dir, options)
+    phase_times = build_fingerprint.check()
+    if phase_times is None:
+        build_fingerprint.clear()
+        return False
+    console.info('nothing is changed since the last building, '
+                 'all targets are up to date')
+    console.info('saved %.2fs of %s' % (
+            sum([seconds for phase, seconds in phase_times]),
+            ', '.join(['%s %.2fs' % (phase, seconds)
+                       for phase, seconds in phase_times])))
+    return True
+
+
+# The commands whose targets could be loaded and analyzed by the blade
+# server in advance
+_SERVER_LOADED_COMMANDS = ('build', 'test', 'query', 'clean')
+
+
+def _get_build_path(options):
+    """Returns the build dir of the options. """
+    build_path_format = configparse.blade_config.configs['global_config']['build_path_template']
+    s = Template(build_path_format)
+    return s.substitute(m=options.m, profile=options.profile)
+
+
+def load_targets_for_server(blade_path):
+    """Load and analyze the targets of the command in sys.argv, for the
+    blade server to keep them between the commands.
+
+    Returns the blade manager, or None if the command doesn't load targets.
+
+    """
+    cmd_options = CmdArguments()
+    command = cmd_options.get_command()
+    if command not in _SERVER_LOADED_COMMANDS:
+        return None
+    targets = cmd_options.get_targets()
+    if not targets:
+        targets = ['.']
+    options = cmd_options.get_options()
+    working_dir = get_cwd()
+    blade_root_dir = find_blade_root_dir(working_dir)
+    os.chdir(blade_root_dir)
+    configparse.blade_config = BladeConfig(blade_root_dir)
+    configparse.blade_config.parse()
+    blade.blade = Blade(targets,
+                        blade_path,
+                        working_dir,
+                        _get_build_path(options),
+                        blade_root_dir,
+                        options,
+                        command)
+    blade.blade.load_targets()
+    blade.blade.analyze_targets()
+    return blade.blade
+
+
+def _main(blade_path, loaded_blade=None):
+    """The main entry of blade.
+
+    loaded_blade is the blade manager whose targets have been loaded and
+    analyzed by the blade server for the same command.
+
+    """
 
     cmd_options = CmdArguments()
 
@@ -226,6 +308,9 @@ def _main(blade_path):
     configparse.blade_config = BladeConfig(blade_root_dir)
     configparse.blade_config.parse()
 
+    if command == 'server':
+        return blade_server.run_server(blade_root_dir, blade_path, options)
+
     # Check code style using cpplint.py
     if command == 'build' or command == 'test':
         opened_files = _get_opened_files(targets, blade_root_dir, working_dir)
@@ -234,9 +319,7 @@ def _main(blade_path):
 
     # Init global blade manager.
     
-    build_path_format = configparse.blade_config.configs['global_config']['build_path_template']
-    s = Template(build_path_format)
-    current_building_path = s.substitute(m=options.m, profile=options.profile)
+    current_building_path = _get_build_path(options)
 
     lock_file_fd = None
     locked_scons = False
@@ -255,15 +338,23 @@ def _main(blade_path):
             else:
                 console.error_exit('Lock exception, please try it later.')
 
-        if command == 'query' and getattr(options, 'depended', None):
-            targets = ['...']
-        blade.blade = Blade(targets,
-                            blade_path,
-                            working_dir,
-                            current_building_path,
-                            blade_root_dir,
-                            options,
-                            command)
+        if command == 'build' and _check_build_fingerprint(
+                command, targets, working_dir, current_building_path,
+                options):
+            return 0
+
+        if loaded_blade is not None:
+            console.info('using the targets loaded by the blade server')
+            blade.blade = loaded_blade
+            options = loaded_blade.get_options()
+        else:
+            blade.blade = Blade(targets,
+                                blade_path,
+                                working_dir,
+                                current_building_path,
+                                blade_root_dir,
+                                options,
+                                command)
 
         # Build the targets
         blade.blade.generate()
@@ -290,7 +381,10 @@ def _main(blade_path):
                 command == 'clean' or command == 'query'):
             try:
                 if locked_scons:
-                    os.remove(os.path.join(blade_root_dir, 'SConstruct'))
+                    scons_file = os.path.join(blade_root_dir, 'SConstruct')
+                    # Not generated if the build is skipped by the fingerprint
+                    if os.path.exists(scons_file):
+                        os.remove(scons_file)
                     unlock_file(lock_file_fd.fileno())
                 lock_file_fd.close()
             except OSError:
@@ -298,10 +392,31 @@ def _main(blade_path):
     return 0
 
 
+def _ninja_build(options):
+    ninja_options = '-j %s' % options.jobs
+    if options.keep_going:
+        ninja_options += ' -k 0'
+    if options.verbose:
+        ninja_options += ' -v'
+
+    p = subprocess.Popen('ninja %s' % ninja_options, shell=True)
+    try:
+        p.wait()
+        if p.returncode:
+            console.error('building failure')
+            return p.returncode
+    except:  # KeyboardInterrupt
+        return 1
+    return 0
+
+
 def _build(options):
     if options.scons_only:
         return 0
 
+    if options.backend == 'ninja':
+        return _ninja_build(options)
+
     scons_options = '--duplicate=soft-copy --cache-show'
     scons_options += ' -j %s' % options.jobs
     if options.keep_going:
@@ -318,8 +433,26 @@ def _build(options):
     return 0
 
 
+def _save_build_fingerprint(build_nodes_file, start_time):
+    """Save the fingerprint of the building started at start_time. """
+    build_nodes = load_cache_file(build_nodes_file)
+    if build_nodes is None:
+        return
+    phase_times = blade.blade.get_phase_times() + [
+            ('building', time.time() - start_time)]
+    build_fingerprint.save(blade.blade, build_nodes, start_time, phase_times)
+
+
 def build(options):
-    return _build(options)
+    start_time = time.time()
+    # The files involved are recorded by scons when the building succeeds
+    build_nodes_file = blade.blade.get_blade_cache_file('build_nodes')
+    if os.path.exists(build_nodes_file):
+        os.remove(build_nodes_file)
+    ret = _build(options)
+    if not ret and build_fingerprint:
+        _save_build_fingerprint(build_nodes_file, start_time)
+    return ret
 
 
 def run(options):
@@ -339,8 +472,11 @@ def test(options):
 def clean(options):
     console.info('cleaning...(hint: please specify --generate-dynamic to '
                  'clean your so)')
-    p = subprocess.Popen('scons --duplicate=soft-copy -c -s --cache-show',
-                         shell=True)
+    if options.backend == 'ninja':
+        p = subprocess.Popen('ninja -t clean', shell=True)
+    else:
+        p = subprocess.Popen('scons --duplicate=soft-copy -c -s --cache-show',
+                             shell=True)
     p.wait()
     console.info('cleaning done.')
     return p.returncode
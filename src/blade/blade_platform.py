@@ -14,88 +14,143 @@
 
 import os
 import subprocess
+import time
 
 import configparse
+import console
+from blade_util import find_executable
+from blade_util import load_cache_file
+from blade_util import save_cache_file
 from blade_util import var_to_list
+from toolchain_probe import ToolchainProbe
+from toolchain_probe import preload_toolchain_probes
+
+
+def preload_scons_platform():
+    """Probe the platform of the current environment in advance, the
+    results are reused by the later platforms until the toolchain is
+    changed.
+
+    """
+    preload_toolchain_probes(
+            SconsPlatform().get_probe_commands(_PLATFORM_INFO.keys()))
+
+
+def get_scons_platform(toolchain_probe=None):
+    """Returns the SconsPlatform of the current environment. """
+    return SconsPlatform(toolchain_probe)
+
+
+# The options of cpp to probe the flags of every type
+_FLAG_TYPE_OPTIONS = {'cpp': '', 'c': '-xc', 'cxx': '-xc++'}
+
+
+# {info name : probing command}
+_PLATFORM_INFO = {
+    'gcc_version': 'gcc --version',
+    'python_inc': 'python-config --includes',
+    'php_inc_list': 'php-config --includes',
+    'java_inc_list': 'java -version',
+}
+
+
+# The info required by the target types besides gcc_version and python_inc
+_TARGET_TYPES_INFO = {
+    'swig_library': ['php_inc_list', 'java_inc_list'],
+}
 
 
 class SconsPlatform(object):
-    """The scons platform class that it handles and gets the platform info. """
-    def __init__(self):
+    """The scons platform class that it handles and gets the platform info.
+
+    The info is probed on demand, and the info required by the targets
+    can be probed in parallel in advance.
+
+    """
+    def __init__(self, toolchain_probe=None):
         """Init. """
-        self.gcc_version = self._get_gcc_version('gcc')
-        self.python_inc = self._get_python_include()
-        self.php_inc_list = self._get_php_include()
-        self.java_inc_list = self._get_java_include()
+        self.toolchain_probe = toolchain_probe or ToolchainProbe()
+        # {info name : value}
+        self.info = {}
+
+    @staticmethod
+    def get_required_info(target_types):
+        """Returns the names of the info required to build the targets. """
+        names = ['gcc_version', 'python_inc']
+        for target_type in target_types:
+            names += _TARGET_TYPES_INFO.get(target_type, [])
+        return names
+
+    def get_probe_commands(self, names):
+        """Returns the commands probing the info not probed yet. """
+        commands = []
+        for name in names:
+            if name in self.info:
+                continue
+            if name == 'java_inc_list' and os.environ.get('JAVA_HOME'):
+                continue
+            commands.append(_PLATFORM_INFO[name])
+        return commands
+
+    def probe(self, names):
+        """Probe the info in parallel. """
+        self.toolchain_probe.probe(self.get_probe_commands(names))
+        for name in names:
+            self._get_info(name)
+
+    def _get_info(self, name):
+        if name not in self.info:
+            if name == 'java_inc_list':
+                self.info[name] = self._get_java_include()
+            else:
+                result = self.toolchain_probe.get_result(_PLATFORM_INFO[name])
+                self.info[name] = getattr(self, '_parse_' + name)(result)
+        return self.info[name]
+
+    def get_info(self, names):
+        """Returns {info name : value} of the info, probe it if needed. """
+        return dict((name, self._get_info(name)) for name in names)
 
     @staticmethod
-    def _get_gcc_version(compiler):
+    def _parse_gcc_version(result):
         """Get the gcc version. """
-        p = subprocess.Popen(
-            compiler + ' --version',
-            env=os.environ,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            shell=True,
-            universal_newlines=True)
-        (stdout, stderr) = p.communicate()
-        if p.returncode == 0:
+        (returncode, stdout, stderr) = result
+        if returncode == 0:
             version_line = stdout.splitlines(True)[0]
             version = version_line.split()[2]
             return version
         return ''
 
     @staticmethod
-    def _get_python_include():
+    def _parse_python_inc(result):
         """Get the python include dir. """
-        p = subprocess.Popen(
-            'python-config --includes',
-            env=os.environ,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            shell=True,
-            universal_newlines=True)
-        (stdout, stderr) = p.communicate()
-        if p.returncode == 0:
+        (returncode, stdout, stderr) = result
+        if returncode == 0:
             include_line = stdout.splitlines(True)[0]
             header = include_line.split()[0][2:]
             return header
         return ''
 
     @staticmethod
-    def _get_php_include():
-        p = subprocess.Popen(
-            'php-config --includes',
-            env=os.environ,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            shell=True,
-            universal_newlines=True)
-        (stdout, stderr) = p.communicate()
-        if p.returncode == 0:
+    def _parse_php_inc_list(result):
+        (returncode, stdout, stderr) = result
+        if returncode == 0:
             include_line = stdout.splitlines(True)[0]
             headers = include_line.split()
             header_list = ["'%s'" % s[2:] for s in headers]
             return header_list
         return []
 
-    @staticmethod
-    def _get_java_include():
+    def _get_java_include(self):
         include_list = []
         java_home = os.environ.get('JAVA_HOME', '')
         if java_home:
             include_list.append('%s/include' % java_home)
             include_list.append('%s/include/linux' % java_home)
             return include_list
-        p = subprocess.Popen(
-            'java -version',
-            env=os.environ,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            shell=True,
-            universal_newlines=True)
-        (stdout, stderr) = p.communicate()
-        if p.returncode == 0:
+        (returncode, stdout, stderr) = self.toolchain_probe.get_result(
+                _PLATFORM_INFO['java_inc_list'])
+        if returncode == 0:
             version_line = stderr.splitlines(True)[0]
             version = version_line.split()[2]
             version = version.replace('"', '')
@@ -106,19 +161,19 @@ class SconsPlatform(object):
 
     def get_gcc_version(self):
         """Returns gcc version. """
-        return self.gcc_version
+        return self._get_info('gcc_version')
 
     def get_python_include(self):
         """Returns python include. """
-        return self.python_inc
+        return self._get_info('python_inc')
 
     def get_php_include(self):
         """Returns a list of php include. """
-        return self.php_inc_list
+        return self._get_info('php_inc_list')
 
     def get_java_include(self):
         """Returns a list of java include. """
-        return self.java_inc_list
+        return self._get_info('java_inc_list')
 
 
 class CcFlagsManager(object):
@@ -126,34 +181,83 @@ class CcFlagsManager(object):
 
     This class manages the compile warning flags.
 
+    Whether the compiler supports a flag is probed by running it, the
+    results are saved in cache_file, keyed by the compiler, so they are
+    probed again only after the compiler is changed.
+
     """
-    def __init__(self, options):
+    def __init__(self, options, cache_file='', gcc_version=''):
         self.options = options
+        self.gcc_version = gcc_version
         self.cpp_str = ''
+        self.cache_file = cache_file
+        # The key of the probe results of the current compiler in the cache
+        self.compiler_signature = None
+        # {(flag_type, flag) : supported} of the current compiler
+        self.probe_results = None
+
+    def _get_compiler_signature(self):
+        """The command, and the path, size and mtime of the executable of
+        the compiler, it is got without running the compiler.
+
+        """
+        signature = [self.cpp_str]
+        executable = find_executable(self.cpp_str)
+        if executable:
+            executable = os.path.realpath(executable)
+            try:
+                st = os.stat(executable)
+                signature += [executable, st.st_size, st.st_mtime]
+            except OSError:
+                pass
+        return tuple(signature)
+
+    def _probe_flags(self, flags):
+        """Probe the (flag_type, flag) pairs not probed yet, the compilers
+        are all run at the same time.
+
+        """
+        if self.probe_results is None:
+            self.probe_results = {}
+            if self.cache_file:
+                self.compiler_signature = self._get_compiler_signature()
+                cache = load_cache_file(self.cache_file) or {}
+                self.probe_results = cache.get(self.compiler_signature, {})
+
+        start_time = time.time()
+        probes = {}
+        for flag_type, flag in flags:
+            if (flag_type, flag) in self.probe_results:
+                continue
+            cmd_str = 'echo "" | %s %s %s >/dev/null 2>&1' % (
+                      self.cpp_str, _FLAG_TYPE_OPTIONS[flag_type], flag)
+            probes[(flag_type, flag)] = subprocess.Popen(cmd_str, shell=True)
+        if not probes:
+            return
+        for key, p in probes.iteritems():
+            self.probe_results[key] = p.wait() == 0
+        console.info('%d compiler flags probed in %.2fs' % (
+                len(probes), time.time() - start_time))
+
+        if self.cache_file:
+            cache = load_cache_file(self.cache_file) or {}
+            cache[self.compiler_signature] = self.probe_results
+            save_cache_file(self.cache_file, cache)
 
     def _filter_out_invalid_flags(self, flag_list, flag_type='cpp'):
         """filter the unsupported compliation flags. """
-        flag_type_list = ['cpp', 'c', 'cxx']
         flag_list_var = var_to_list(flag_list)
-        if not flag_type in flag_type_list:
+        if not flag_type in _FLAG_TYPE_OPTIONS:
             return flag_list
 
-        option = ''
-        if flag_type == 'c':
-            option = '-xc'
-        elif flag_type == 'cxx':
-            option = '-xc++'
-
-        ret_flag_list = []
-        for flag in flag_list_var:
-            cmd_str = 'echo "" | %s %s %s >/dev/null 2>&1' % (
-                      self.cpp_str, option, flag)
-            if subprocess.call(cmd_str, shell=True) == 0:
-                ret_flag_list.append(flag)
-        return ret_flag_list
+        self._probe_flags([(flag_type, flag) for flag in flag_list_var])
+        return [flag for flag in flag_list_var
+                if self.probe_results[(flag_type, flag)]]
 
     def set_cpp_str(self, cpp_str):
         """set up the cpp_str. """
+        if cpp_str != self.cpp_str:
+            self.probe_results = None
         self.cpp_str = cpp_str
 
     def get_flags_except_warning(self):
@@ -176,7 +280,7 @@ class CcFlagsManager(object):
             linkflags.append('-pg')
 
         if getattr(self.options, 'gcov', False):
-            if SconsPlatform().gcc_version > '4.1':
+            if self.gcc_version > '4.1':
                 flags_except_warning.append('--coverage')
                 linkflags.append('--coverage')
             else:
@@ -197,6 +301,11 @@ class CcFlagsManager(object):
         cxxflags = cc_config['cxx_warnings']
         cflags = cc_config['c_warnings']
 
+        # Probe the flags of all types together
+        self._probe_flags(
+                [('cpp', flag) for flag in var_to_list(cppflags)] +
+                [('cxx', flag) for flag in var_to_list(cxxflags)] +
+                [('c', flag) for flag in var_to_list(cflags)])
         filtered_cppflags = self._filter_out_invalid_flags(cppflags, 'cpp')
         filtered_cxxflags = self._filter_out_invalid_flags(cxxflags, 'cxx')
         filtered_cflags = self._filter_out_invalid_flags(cflags, 'c')
@@ -0,0 +1,583 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the blade server module.  The blade server is an optional
+ background process of a BLADE_ROOT, it keeps the blade modules, the
+ platform info, the BUILD file caches and the targets loaded and analyzed
+ for the last command in memory, and serves the blade commands of the
+ clients through a unix socket.
+
+ This module is imported by the client before the other blade modules,
+ so it should only import the light modules at the top level.
+
+"""
+
+
+import errno
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+
+import console
+from blade_util import get_cwd
+from blade_util import md5sum_str
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+# The unix socket of the blade server under BLADE_ROOT
+SOCKET_FILE = '.blade.server.sock'
+
+# The log file of the blade server under BLADE_ROOT
+LOG_FILE = '.blade.server.log'
+
+# The commands run by the client itself, 'run' needs the terminal
+_LOCAL_COMMANDS = ('run', 'server')
+
+# The seconds to wait for a request to exit after it is interrupted by
+# the disconnection of the client, before it is killed
+_INTERRUPT_TIMEOUT = 10
+
+# The exit code of a request is sent in the last 4 bytes of the output
+_EXIT_CODE_FORMAT = '!i'
+_EXIT_CODE_SIZE = struct.calcsize(_EXIT_CODE_FORMAT)
+
+
+def _send_message(sock, message):
+    """Send a message in json with its length.
+
+    The strings are decoded as latin-1, so any bytes, such as the non utf-8
+    environment variables, are sent as they are.
+
+    """
+    data = json.dumps(message, encoding='latin-1')
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def _encode_strings(value):
+    """Encode the unicode strings decoded by json back to the bytes. """
+    if isinstance(value, unicode):
+        return value.encode('latin-1')
+    if isinstance(value, list):
+        return [_encode_strings(v) for v in value]
+    if isinstance(value, dict):
+        return dict((_encode_strings(k), _encode_strings(v))
+                    for k, v in value.iteritems())
+    return value
+
+
+def _recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def _recv_message(sock):
+    """Receive a message sent by _send_message, None if disconnected. """
+    header = _recv_exactly(sock, struct.calcsize('!I'))
+    if header is None:
+        return None
+    data = _recv_exactly(sock, struct.unpack('!I', header)[0])
+    if data is None:
+        return None
+    try:
+        return _encode_strings(json.loads(data))
+    except ValueError:
+        return None
+
+
+def _connect(socket_file):
+    """Connect to the blade server, returns None if it is not running. """
+    if not os.path.exists(socket_file):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_file)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def _find_socket_file(working_dir):
+    """Returns the server socket file of the BLADE_ROOT of working_dir. """
+    path = working_dir
+    while True:
+        if os.path.isfile(os.path.join(path, 'BLADE_ROOT')):
+            return os.path.join(path, SOCKET_FILE)
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _receive_output(sock):
+    """Write the output of the request until the server closes the socket.
+
+    Returns the exit code in the last bytes of the output.
+
+    """
+    tail = ''
+    try:
+        while True:
+            data = sock.recv(65536)
+            if not data:
+                break
+            data = tail + data
+            tail = data[-_EXIT_CODE_SIZE:]
+            sys.stdout.write(data[:-_EXIT_CODE_SIZE])
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        console.error_exit('keyboard interrupted', -signal.SIGINT)
+    finally:
+        sock.close()
+    if len(tail) != _EXIT_CODE_SIZE:
+        console.error('blade server exited unexpectedly')
+        return 1
+    return struct.unpack(_EXIT_CODE_FORMAT, tail)[0]
+
+
+def run_in_server(argv):
+    """Run the blade command in the blade server if it is running.
+
+    Returns the exit code, or None if the command should be run locally.
+
+    """
+    if not argv or argv[0] in _LOCAL_COMMANDS or argv[0].startswith('-'):
+        return None
+    working_dir = get_cwd()
+    socket_file = _find_socket_file(working_dir)
+    if not socket_file:
+        return None
+    sock = _connect(socket_file)
+    if not sock:
+        return None
+    try:
+        _send_message(sock, {'command': 'serve',
+                             'argv': argv,
+                             'cwd': working_dir,
+                             'env': dict(os.environ),
+                             'color': console.color_enabled})
+    except socket.error:
+        sock.close()
+        return None
+    return _receive_output(sock)
+
+
+class _BuildFileWatcher(object):
+    """Watches the BUILD files with inotify.
+
+    A BUILD file is trusted if its md5 is verified after it is watched, and
+    no event happens on it since then.  The trusted BUILD files needn't to
+    be read when loading.  The output dirs and the hidden dirs are not
+    watched.
+
+    """
+    def __init__(self, blade_root_dir, output_dirs):
+        from build_file_cache import untrust_build_files
+        self.untrust_build_files = untrust_build_files
+        self.blade_root_dir = blade_root_dir
+        self.output_dirs = output_dirs
+        # {build_file : count of the events on it}
+        self.generations = {}
+        # The count of the events on all BUILD files and dirs
+        self.generation = 0
+        watch_manager = pyinotify.WatchManager()
+        self.notifier = pyinotify.ThreadedNotifier(watch_manager,
+                                                   self._process_event)
+        self.notifier.daemon = True
+        self.notifier.start()
+        mask = (pyinotify.IN_MODIFY | pyinotify.IN_CLOSE_WRITE |
+                pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+                pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO |
+                pyinotify.IN_DELETE_SELF | pyinotify.IN_MOVE_SELF)
+        watch_manager.add_watch(blade_root_dir, mask, rec=True,
+                                auto_add=True,
+                                exclude_filter=self._is_ignored)
+
+    def _relative_path(self, path):
+        return os.path.relpath(path, self.blade_root_dir)
+
+    def _is_ignored(self, path):
+        path = self._relative_path(path)
+        if path == '.':
+            return False
+        if path in self.output_dirs:
+            return True
+        return os.path.basename(path).startswith('.')
+
+    def _process_event(self, event):
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            self.generation += 1
+            self.untrust_build_files()
+            return
+        if self._is_ignored(event.pathname):
+            return
+        path = self._relative_path(event.pathname)
+        if event.dir or event.mask & (pyinotify.IN_DELETE_SELF |
+                                      pyinotify.IN_MOVE_SELF):
+            self.generation += 1
+            self.untrust_build_files(path)
+        elif os.path.basename(path) == 'BUILD':
+            self.generation += 1
+            self.generations[path] = self.generations.get(path, 0) + 1
+            self.untrust_build_files(path)
+
+    def verify(self, entries):
+        """Trust the BUILD files in the entries of a BUILD file cache whose
+        content are the same as the cached ones.
+
+        """
+        from build_file_cache import get_trusted_md5
+        from build_file_cache import trust_build_file
+        for build_file, entry in entries.iteritems():
+            build_file = os.path.normpath(build_file)
+            if get_trusted_md5(build_file) == entry['md5']:
+                continue
+            generation = self.generations.get(build_file, 0)
+            try:
+                f = open(os.path.join(self.blade_root_dir, build_file), 'rU')
+                try:
+                    content = f.read()
+                finally:
+                    f.close()
+            except IOError:
+                continue
+            if (md5sum_str(content) == entry['md5'] and
+                    self.generations.get(build_file, 0) == generation):
+                trust_build_file(build_file, entry['md5'])
+
+    def stop(self):
+        self.notifier.stop()
+
+
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime, st.st_size
+    except OSError:
+        return None
+
+
+class _LoadedTargets(object):
+    """The targets loaded and analyzed by the blade server for a request.
+
+    They are reused by the next requests of the same command line, working
+    dir and environment, until any BUILD file or dir is changed, which is
+    known by the watcher, or any config file is changed.  The targets are
+    not kept if any BUILD file is not replayable, it may read other inputs.
+
+    """
+    def __init__(self, key, blade, generation, files):
+        self.key = key
+        self.blade = blade
+        self.generation = generation
+        # {path : signature} of the config files
+        self.signatures = dict((f, _file_signature(f)) for f in files)
+
+    def is_valid(self, key, generation):
+        if key != self.key or generation != self.generation:
+            return False
+        for path, signature in self.signatures.iteritems():
+            if _file_signature(path) != signature:
+                return False
+        return True
+
+
+class _BladeServer(object):
+    """The blade server.
+
+    Every request is served in a process forked from the server, which
+    inherits the modules and the states loaded by the server, and runs
+    the blade command as the local blade does, with its output sent to
+    the client through the socket.  The process and its children, such
+    as scons, are interrupted if the client disconnects.
+
+    If the BUILD files are watched, the targets of the request are loaded
+    and analyzed by the server before forking, and kept for the next same
+    requests, whose processes only generate the rules and build.
+
+    """
+    def __init__(self, blade_root_dir, blade_path, listen_socket):
+        from blade_platform import preload_scons_platform
+        from source_tree_walker import get_output_dirs
+
+        self.blade_root_dir = blade_root_dir
+        self.blade_path = blade_path
+        self.listen_socket = listen_socket
+        self.output_dirs = set(
+                os.path.normpath(os.path.relpath(d, blade_root_dir))
+                for d in get_output_dirs())
+        self.loaded_targets = None
+        self.watcher = None
+        if pyinotify is not None:
+            self.watcher = _BuildFileWatcher(blade_root_dir, self.output_dirs)
+        else:
+            console.warning('pyinotify is not installed, BUILD files are '
+                            'not watched by the blade server')
+        preload_scons_platform()
+
+    def _preload_build_file_caches(self):
+        """Load the BUILD file caches of all build dirs into memory. """
+        from build_file_cache import preload_cache_file
+        for output_dir in sorted(self.output_dirs):
+            # Blade refers the cache file by the path relative to BLADE_ROOT
+            cache_file = os.path.join(output_dir, '.blade_cache',
+                                      'build_files')
+            entries = preload_cache_file(cache_file)
+            if entries is not None and self.watcher:
+                self.watcher.verify(entries)
+
+    def _load_targets(self, request, key):
+        """Load and analyze the targets of the request in the server.
+
+        Returns the _LoadedTargets, or None if the command doesn't load
+        targets or fails, then the forked process loads them again to
+        report the error.
+
+        """
+        import blade_main
+        import configparse
+        generation = self.watcher.generation
+        environ = dict(os.environ)
+        argv = sys.argv
+        loaded_blade = None
+        try:
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            sys.argv = [self.blade_path] + request['argv']
+            loaded_blade = blade_main.load_targets_for_server(self.blade_path)
+        except (SystemExit, Exception):
+            console.warning('failed to load the targets of %s' %
+                            ' '.join(request['argv']))
+        finally:
+            os.chdir(self.blade_root_dir)
+            os.environ.clear()
+            os.environ.update(environ)
+            sys.argv = argv
+        if (loaded_blade is None or
+                loaded_blade.get_build_file_cache().unreplayable_executed):
+            return None
+        from source_tree_walker import IGNORE_FILE
+        files = configparse.blade_config.config_files + [
+                os.path.join(self.blade_root_dir, IGNORE_FILE)]
+        return _LoadedTargets(key, loaded_blade, generation, files)
+
+    def _get_loaded_blade(self, request):
+        """Returns the blade manager whose targets are loaded and analyzed
+        for the request, or None if the request should load them itself.
+
+        """
+        if not self.watcher:
+            return None
+        key = (request['cwd'], request['argv'], request['env'])
+        loaded_targets = self.loaded_targets
+        if (loaded_targets is None or
+                not loaded_targets.is_valid(key, self.watcher.generation)):
+            # Release the old targets before loading
+            self.loaded_targets = None
+            loaded_targets = self._load_targets(request, key)
+            self.loaded_targets = loaded_targets
+        if loaded_targets is None:
+            return None
+        return loaded_targets.blade
+
+    @staticmethod
+    def _reap_children():
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError:
+                return
+            if not pid:
+                return
+
+    def serve(self):
+        """Serve the requests until the server is stopped. """
+        console.info('blade server is serving %s' % self.blade_root_dir)
+        self._preload_build_file_caches()
+        while True:
+            try:
+                conn, address = self.listen_socket.accept()
+            except socket.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            request = _recv_message(conn)
+            if request is None:
+                conn.close()
+                continue
+            if request['command'] == 'stop':
+                _send_message(conn, os.getpid())
+                conn.close()
+                break
+            loaded_blade = self._get_loaded_blade(request)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                self.listen_socket.close()
+                self._serve_request(conn, request, loaded_blade)
+            conn.close()
+            self._reap_children()
+            # Load the caches updated by the last requests while the
+            # forked process is working
+            self._preload_build_file_caches()
+        if self.watcher:
+            self.watcher.stop()
+        console.info('blade server is stopped')
+
+    @staticmethod
+    def _watch_client(conn):
+        """Interrupt the process group of the request when the client
+        disconnects, e.g., it is interrupted by Ctrl-C, and kill it if it
+        doesn't exit in time, so the build lock is released.
+
+        """
+        def watch():
+            # The client sends nothing after the request
+            try:
+                conn.recv(1)
+            except socket.error:
+                pass
+            os.killpg(0, signal.SIGINT)
+            time.sleep(_INTERRUPT_TIMEOUT)
+            os.killpg(0, signal.SIGKILL)
+
+        thread = threading.Thread(target=watch)
+        thread.daemon = True
+        thread.start()
+
+    def _serve_request(self, conn, request, loaded_blade):
+        """Run the blade command in the forked process, never returns. """
+        exit_code = 1
+        try:
+            os.setpgid(0, 0)
+            self._watch_client(conn)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            null_fd = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(null_fd, 0)
+            os.close(null_fd)
+            os.dup2(conn.fileno(), 1)
+            os.dup2(conn.fileno(), 2)
+            console.color_enabled = request['color']
+            sys.argv = [self.blade_path] + request['argv']
+            exit_code = _run_blade_main(self.blade_path, loaded_blade)
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                conn.sendall(struct.pack(_EXIT_CODE_FORMAT, exit_code))
+            finally:
+                os._exit(0)
+
+
+def _run_blade_main(blade_path, loaded_blade):
+    """Run blade_main._main and returns the exit code. """
+    import blade_main
+    try:
+        exit_code = blade_main._main(blade_path, loaded_blade)
+    except SystemExit, e:
+        exit_code = e.code
+    except KeyboardInterrupt:
+        console.error('keyboard interrupted')
+        exit_code = -signal.SIGINT
+    except:
+        console.error(traceback.format_exc())
+        exit_code = 1
+    if exit_code is None:
+        return 0
+    if not isinstance(exit_code, int):
+        return 1
+    return exit_code
+
+
+def _stop_server(socket_file):
+    sock = _connect(socket_file)
+    if not sock:
+        console.warning('blade server is not running')
+        return 0
+    try:
+        _send_message(sock, {'command': 'stop'})
+        pid = _recv_message(sock)
+    finally:
+        sock.close()
+    console.info('blade server %s is stopped' % pid)
+    return 0
+
+
+def run_server(blade_root_dir, blade_path, options):
+    """Start the blade server of blade_root_dir in background. """
+    socket_file = os.path.join(blade_root_dir, SOCKET_FILE)
+    if options.stop:
+        return _stop_server(socket_file)
+
+    sock = _connect(socket_file)
+    if sock:
+        sock.close()
+        console.error_exit('blade server is already running for %s' %
+                           blade_root_dir)
+    if os.path.exists(socket_file):
+        os.remove(socket_file)
+    listen_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only the owner could connect, the server runs the commands as it
+    old_umask = os.umask(077)
+    try:
+        listen_socket.bind(socket_file)
+        os.chmod(socket_file, 0600)
+    except (socket.error, OSError), e:
+        console.error_exit('failed to create the socket of blade server: %s' % e)
+    finally:
+        os.umask(old_umask)
+    listen_socket.listen(16)
+
+    pid = os.fork()
+    if pid:
+        listen_socket.close()
+        console.info('blade server started, pid %d, log is in %s' % (
+                     pid, os.path.join(blade_root_dir, LOG_FILE)))
+        return 0
+
+    os.setsid()
+    try:
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.close(null_fd)
+        log_fd = os.open(os.path.join(blade_root_dir, LOG_FILE),
+                         os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0644)
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+        os.close(log_fd)
+        console.color_enabled = False
+        # Import the modules in advance, requests are served by the
+        # processes forked from the server
+        import blade_main
+        server = _BladeServer(blade_root_dir, blade_path, listen_socket)
+        server.serve()
+    except:
+        console.error(traceback.format_exc())
+    try:
+        listen_socket.close()
+        os.remove(socket_file)
+    finally:
+        os._exit(0)
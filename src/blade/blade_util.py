@@ -25,6 +25,11 @@ try:
 except ImportError:
     import md5
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 
 def md5sum_str(user_str):
     """md5sum of basestring. """
@@ -40,6 +45,57 @@ def md5sum(obj):
     return md5sum_str(obj)
 
 
+def canonical(value):
+    """Convert the value to be repr-ed in a stable way, so the md5sum of
+    its repr could be used as a fingerprint.
+
+    """
+    if isinstance(value, dict):
+        return sorted((k, canonical(v)) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    return value
+
+
+def load_cache_file(file_name):
+    """Load the data saved by save_cache_file.
+
+    Returns None if the cache file does not exist or is corrupted, the
+    callers should treat it as an empty cache.
+
+    """
+    if not os.path.exists(file_name):
+        return None
+    try:
+        f = open(file_name, 'rb')
+        try:
+            return pickle.load(f)
+        finally:
+            f.close()
+    except Exception:
+        console.warning('ignore corrupted cache file %s' % file_name)
+        return None
+
+
+def save_cache_file(file_name, data):
+    """Save data into the cache file.
+
+    The data is written into a temporary file and then renamed, so a
+    interrupted blade never leaves a half written cache behind.
+
+    """
+    cache_dir = os.path.dirname(file_name)
+    if cache_dir and not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_file_name = '%s.%d.tmp' % (file_name, os.getpid())
+    f = open(tmp_file_name, 'wb')
+    try:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    finally:
+        f.close()
+    os.rename(tmp_file_name, file_name)
+
+
 def lock_file(fd, flags):
     """lock file. """
     try:
@@ -126,3 +182,27 @@ def cpu_count():
         return multiprocessing.cpu_count()
     except ImportError:
         return int(os.sysconf('SC_NPROCESSORS_ONLN'))
+
+
+def ninja_escape_path(path):
+    """Escape the chars that are special in the paths of build.ninja. """
+    return path.replace('$', '$$').replace(' ', '$ ').replace(':', '$:')
+
+
+def find_executable(command):
+    """Returns the path of the executable of the command in PATH. """
+    if not command:
+        return None
+    program = command.split()[0]
+    if os.sep in program:
+        return program
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        executable = os.path.join(path, program)
+        if os.path.isfile(executable):
+            return executable
+    return None
+
+
+def get_blade_cache_file(build_path, name):
+    """Returns the path of a cache file maintained by blade. """
+    return os.path.join(build_path, '.blade_cache', name)
@@ -14,15 +14,23 @@
 import glob
 import math
 import os
-import subprocess
 import time
 
 import console
+from toolchain_probe import ToolchainProbe
 
 
 class BuildEnvironment(object):
     """Managers ccache, distcc, dccc. """
-    def __init__(self, blade_root_dir, distcc_hosts_list=None):
+
+    # The commands probing ccache and distcc
+    PROBE_COMMANDS = ['ccache -V', 'distcc --version']
+
+    def __init__(self, blade_root_dir, distcc_hosts_list=None,
+                 toolchain_probe=None):
+        self.toolchain_probe = toolchain_probe or ToolchainProbe()
+        self.toolchain_probe.probe(self.PROBE_COMMANDS)
+
         # ccache
         self.blade_root_dir = blade_root_dir
         self.ccache_installed = self._check_ccache_install()
@@ -59,38 +67,22 @@ class BuildEnvironment(object):
 
         self.rules_buf = []
 
-    @staticmethod
-    def _check_ccache_install():
+    def _check_ccache_install(self):
         """Check ccache is installed or not. """
-        try:
-            p = subprocess.Popen(
-                ['ccache', '-V'],
-                env=os.environ,
-                stderr=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                universal_newlines=True)
-            (stdout, stderr) = p.communicate()
-            if p.returncode == 0:
-                version_line = stdout.splitlines(True)[0]
-                if version_line and version_line.find('ccache version') != -1:
-                    console.info('ccache found')
-                    return True
-        except OSError:
-            pass
+        (returncode, stdout, stderr) = self.toolchain_probe.get_result(
+                'ccache -V')
+        if returncode == 0:
+            version_line = stdout.splitlines(True)[0]
+            if version_line and version_line.find('ccache version') != -1:
+                console.info('ccache found')
+                return True
         return False
 
-    @staticmethod
-    def _check_distcc_install():
+    def _check_distcc_install(self):
         """Check distcc is installed or not. """
-        p = subprocess.Popen(
-            'distcc --version',
-            env={},
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            shell=True,
-            universal_newlines=True)
-        (stdout, stderr) = p.communicate()
-        if p.returncode == 0:
+        (returncode, stdout, stderr) = self.toolchain_probe.get_result(
+                'distcc --version')
+        if returncode == 0:
             version_line = stdout.splitlines(True)[0]
             if version_line and version_line.find('distcc') != -1:
                 console.info('distcc found')
@@ -0,0 +1,287 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the BUILD file cache module which keeps the loading results of
+ BUILD files on disk, so unchanged BUILD files needn't to be executed
+ again in the next run.
+
+"""
+
+
+import dis
+import marshal
+import os
+import sys
+import types
+
+from blade_util import load_cache_file
+from blade_util import pickle
+from blade_util import save_cache_file
+
+
+# Increase it when the format of the cache file changes
+_CACHE_VERSION = 2
+
+
+# The builtins returning the same values for the same arguments, a BUILD
+# file which only reads them, the build functions and its own variables
+# produces the same targets for the same content and options
+_PURE_BUILTINS = frozenset([
+    'None', 'True', 'False', 'abs', 'all', 'any', 'basestring', 'bool',
+    'dict', 'enumerate', 'filter', 'float', 'frozenset', 'int',
+    'isinstance', 'len', 'list', 'map', 'max', 'min', 'range', 'reversed',
+    'set', 'sorted', 'str', 'sum', 'tuple', 'unicode', 'xrange', 'zip'])
+
+
+# The opcodes which let a BUILD file read other inputs, such as the files
+# found by glob or the environment variables read through os
+_UNSAFE_OPCODES = frozenset(dis.opmap[name] for name in (
+        'IMPORT_NAME', 'IMPORT_FROM', 'IMPORT_STAR', 'EXEC_STMT'))
+_LOAD_GLOBAL_OPCODES = frozenset([dis.opmap['LOAD_NAME'],
+                                  dis.opmap['LOAD_GLOBAL']])
+_STORE_GLOBAL_OPCODES = frozenset([dis.opmap['STORE_NAME'],
+                                   dis.opmap['STORE_GLOBAL']])
+
+
+# The cache files loaded in advance by the blade server,
+# {cache_file : (mtime, entries)}, the processes forked by the server to
+# serve the requests inherit them
+_preloaded_entries = {}
+
+
+# {build_file : md5} of the BUILD files which are known to be unchanged
+# since their md5 were computed, so they needn't to be read again.  It is
+# maintained by the blade server, which watches the BUILD files.
+_trusted_md5s = {}
+
+
+class BuildFileCache(object):
+    """BuildFileCache.
+
+    For every BUILD file, the cache holds the md5sum of its content, the
+    compiled code object and the records of the build functions calls
+    which registered targets, such as cc_library(...).  Replaying these
+    records registers the same targets as executing the BUILD file.
+
+    The code object only depends on the content of the BUILD file, but
+    the records also depend on the options which the BUILD file could see
+    through build_target, so they are saved per options_key.  The BUILD
+    files reading other inputs, such as importing os or glob, are not
+    replayable, they are always executed.
+
+    """
+    def __init__(self, cache_file, options_key):
+        self.cache_file = cache_file
+        self.options_key = options_key
+        # {build_file : {'md5' : md5, 'code' : marshaled code,
+        #                'replayable' : bool,
+        #                'records' : {options_key : [record, ...]}}}
+        self.entries = {}
+        self.dirty = False
+        # Whether any BUILD file which is not replayable has been executed,
+        # then the loaded targets depend on more than the BUILD files
+        self.unreplayable_executed = False
+
+        if cache_file in _preloaded_entries:
+            self.entries = _preloaded_entries[cache_file][1]
+        else:
+            self.entries = _load_entries(cache_file)
+
+    @staticmethod
+    def _version():
+        """The marshal format of code objects is python version dependent. """
+        return _version()
+
+    def get_records(self, build_file, content_md5):
+        """Returns the cached records of build_file, or None if missing. """
+        entry = self.entries.get(build_file)
+        if entry and entry['md5'] == content_md5:
+            return entry['records'].get(self.options_key)
+        return None
+
+    def is_replayable(self, build_file, content_md5):
+        """Returns False if build_file is known to be always executed. """
+        entry = self.entries.get(build_file)
+        if entry and entry['md5'] == content_md5:
+            return entry['replayable']
+        return True
+
+    def get_md5(self, build_file):
+        """Returns the md5 of the cached content of build_file. """
+        entry = self.entries.get(build_file)
+        if entry:
+            return entry['md5']
+        return None
+
+    def get_trusted_records(self, build_file):
+        """Returns the cached records of build_file if it is known to be
+        unchanged, or None if it has to be read to check.
+
+        """
+        content_md5 = get_trusted_md5(build_file)
+        if content_md5 is None:
+            return None
+        return self.get_records(build_file, content_md5)
+
+    def get_code(self, build_file, content, content_md5):
+        """Returns the code object of build_file, compile it if necessary. """
+        entry = self.entries.get(build_file)
+        if entry and entry['md5'] == content_md5:
+            return marshal.loads(entry['code'])
+        if not content.endswith('\n'):
+            content += '\n'
+        return compile(content, build_file, 'exec')
+
+    def update(self, build_file, content_md5, code, records):
+        """Save the loading result of build_file.
+
+        records is None if the BUILD file is not replayable, in this case
+        only the code object is cached.
+
+        """
+        entry = self.entries.get(build_file)
+        if not entry or entry['md5'] != content_md5:
+            entry = {'md5': content_md5,
+                     'code': marshal.dumps(code),
+                     'replayable': True,
+                     'records': {}}
+            self.entries[build_file] = entry
+        if records is None:
+            entry['replayable'] = False
+            self.unreplayable_executed = True
+        else:
+            entry['records'][self.options_key] = records
+        self.dirty = True
+
+    def save(self):
+        """Write the cache back to disk if it has been changed. """
+        if not self.dirty:
+            return
+        save_cache_file(self.cache_file, {'version': self._version(),
+                                          'entries': self.entries})
+        self.dirty = False
+
+
+def _version():
+    """The marshal format of code objects is python version dependent. """
+    return (_CACHE_VERSION, sys.version)
+
+
+def _load_entries(cache_file):
+    """Returns the entries in the cache file. """
+    data = load_cache_file(cache_file)
+    if data and data.get('version') == _version():
+        return data['entries']
+    return {}
+
+
+def preload_cache_file(cache_file):
+    """Load the cache file in advance if it is changed since last loading.
+
+    Returns the entries if the cache file is loaded, otherwise None.
+
+    """
+    try:
+        mtime = os.path.getmtime(cache_file)
+    except OSError:
+        return None
+    if (cache_file in _preloaded_entries and
+            _preloaded_entries[cache_file][0] == mtime):
+        return None
+    entries = _load_entries(cache_file)
+    _preloaded_entries[cache_file] = (mtime, entries)
+    return entries
+
+
+def get_trusted_md5(build_file):
+    """Returns the md5 of the BUILD file if it is known to be unchanged. """
+    return _trusted_md5s.get(os.path.normpath(build_file))
+
+
+def trust_build_file(build_file, content_md5):
+    """Mark the BUILD file to be unchanged with the md5. """
+    _trusted_md5s[os.path.normpath(build_file)] = content_md5
+
+
+def untrust_build_files(path=None):
+    """The BUILD files under path may be changed, all if path is None. """
+    if path is not None:
+        path = os.path.normpath(path)
+    if path is None or path == '.':
+        _trusted_md5s.clear()
+        return
+    _trusted_md5s.pop(path, None)
+    prefix = path + '/'
+    for build_file in _trusted_md5s.keys():
+        if build_file.startswith(prefix):
+            _trusted_md5s.pop(build_file, None)
+
+
+def _scan_code(code, loaded_names, stored_names):
+    """Collect the global names loaded and stored by the code and the
+    functions defined in it.  Returns False if it imports modules or
+    executes dynamic code.
+
+    """
+    co_code = code.co_code
+    extended_arg = 0
+    i = 0
+    while i < len(co_code):
+        op = ord(co_code[i])
+        if op < dis.HAVE_ARGUMENT:
+            i += 1
+            continue
+        arg = ord(co_code[i + 1]) + ord(co_code[i + 2]) * 256 + extended_arg
+        extended_arg = 0
+        i += 3
+        if op == dis.EXTENDED_ARG:
+            extended_arg = arg * 65536
+        elif op in _UNSAFE_OPCODES:
+            return False
+        elif op in _LOAD_GLOBAL_OPCODES:
+            loaded_names.add(code.co_names[arg])
+        elif op in _STORE_GLOBAL_OPCODES:
+            stored_names.add(code.co_names[arg])
+    for const in code.co_consts:
+        if (isinstance(const, types.CodeType) and
+                not _scan_code(const, loaded_names, stored_names)):
+            return False
+    return True
+
+
+def is_hermetic(code, build_names):
+    """Whether the code of a BUILD file only reads the build_names, its own
+    variables and the pure builtins, so its records only depend on its
+    content and the options.
+
+    """
+    loaded_names = set()
+    stored_names = set()
+    if not _scan_code(code, loaded_names, stored_names):
+        return False
+    return not (loaded_names - stored_names - _PURE_BUILTINS -
+                set(build_names))
+
+
+def dump_record(function_name, args, kwargs):
+    """Make a record of a build function call.
+
+    The arguments are pickled immediately so the record is not affected
+    if the build function modifies them later.  Returns None if any of the
+    arguments could not be pickled.
+
+    """
+    try:
+        return pickle.dumps((function_name, args, kwargs),
+                            pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError):
+        return None
+
+
+def load_record(record):
+    """Returns the (function_name, args, kwargs) tuple of the record. """
+    return pickle.loads(record)
@@ -0,0 +1,162 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the build fingerprint module which records the state of the
+ files involved in the last successful building, so building the same
+ targets again without any change returns at once, without loading the
+ BUILD files and running scons.
+
+"""
+
+
+import os
+
+import configparse
+from blade_util import canonical
+from blade_util import find_executable
+from blade_util import load_cache_file
+from blade_util import md5sum_str
+from blade_util import save_cache_file
+
+
+# Increase it when the format of the fingerprint file changes
+_FINGERPRINT_VERSION = 1
+
+
+# The options which don't change the result of the building
+_IRRELEVANT_OPTIONS = frozenset(['color', 'generate_jobs', 'jobs',
+                                 'keep_going', 'load_jobs', 'test_jobs',
+                                 'verbose'])
+
+
+# The environment variables read by blade when generating the rules
+_ENV_VARS = ('CC', 'CPP', 'CXX', 'DISTCC_HOSTS', 'DISTLD_HOSTS', 'LD',
+             'MASTER_HOSTS', 'PATH', 'TOOLCHAIN_DIR', 'USER')
+
+
+def _stat_signature(path):
+    """The mtime and size of the file, or None if it doesn't exist. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size)
+
+
+def _blade_files(blade_path):
+    """The files of blade itself, blade_path is blade.zip or its dir. """
+    if not os.path.isdir(blade_path):
+        return [blade_path]
+    files = []
+    for dir_path, dir_names, file_names in os.walk(blade_path):
+        files += [os.path.join(dir_path, name) for name in file_names
+                  if name.endswith('.py')]
+    return files
+
+
+def _toolchain_files():
+    """The executables of the compilers and the linker. """
+    toolchain_dir = os.environ.get('TOOLCHAIN_DIR', '')
+    files = []
+    for name, default in (('CPP', 'cpp'), ('CC', 'gcc'),
+                          ('CXX', 'g++'), ('LD', 'g++')):
+        executable = find_executable(
+                toolchain_dir + os.environ.get(name, default))
+        if executable:
+            files.append(executable)
+    return files
+
+
+def _loading_files(blade):
+    """The BUILD files and the dirs whose change affects the loading. """
+    files = []
+    source_dirs = set(key[0] for key in blade.get_target_database())
+    source_dirs.update(key[0] for key in blade.get_target_descriptors())
+    source_dirs.discard('#')
+    # The dirs walked for the 'path/...' targets, a BUILD file is created
+    # or removed in them if their mtime is changed
+    walked_dirs = load_cache_file(blade.get_blade_cache_file('source_dirs'))
+    for source_dir, entry in (walked_dirs or {}).iteritems():
+        files.append(source_dir)
+        if entry[1]:
+            source_dirs.add(source_dir)
+    files += [os.path.join(source_dir, 'BUILD') for source_dir in source_dirs]
+    return files
+
+
+class BuildFingerprint(object):
+    """BuildFingerprint.
+
+    The fingerprint of a building holds a key and the stat signatures of
+    the files involved, the key covers the command line, the options and
+    the environment variables affecting the building, the files are the
+    config files, blade itself, the toolchain, the BUILD files, and the
+    sources and the generated files known by scons.
+
+    """
+    def __init__(self, fingerprint_file, command, command_targets,
+                 working_dir, options):
+        self.fingerprint_file = fingerprint_file
+        self.key = md5sum_str(repr(canonical([
+                command,
+                command_targets,
+                working_dir,
+                dict((name, value)
+                     for name, value in vars(options).iteritems()
+                     if name not in _IRRELEVANT_OPTIONS),
+                [os.environ.get(name) for name in _ENV_VARS]])))
+
+    def check(self):
+        """Returns the time of every phase of the last building if none of
+        the files is changed since it, otherwise None.
+
+        """
+        data = load_cache_file(self.fingerprint_file)
+        if (not data or data.get('version') != _FINGERPRINT_VERSION or
+                data.get('key') != self.key):
+            return None
+        for path, signature in data['files'].iteritems():
+            if _stat_signature(path) != signature:
+                return None
+        return data['phase_times']
+
+    def clear(self):
+        """Remove the fingerprint before building. """
+        if os.path.exists(self.fingerprint_file):
+            os.remove(self.fingerprint_file)
+
+    def save(self, blade, build_nodes, start_time, phase_times):
+        """Save the fingerprint of the building started at start_time.
+
+        build_nodes are the generated files and the sources recorded by
+        scons.  Nothing is saved if any source is modified during the
+        building, scons may have read it before the modification.
+
+        """
+        files = {}
+        for path in build_nodes['sources']:
+            signature = _stat_signature(path)
+            if signature:
+                mtime = signature[0]
+                # The mtime may be truncated to seconds by the file system
+                if mtime == int(mtime):
+                    mtime += 1
+                if mtime >= start_time:
+                    return False
+            files[path] = signature
+        for path in (build_nodes['generated'] +
+                     configparse.blade_config.config_files +
+                     _blade_files(blade.get_blade_path()) +
+                     _toolchain_files() +
+                     _loading_files(blade)):
+            files[path] = _stat_signature(path)
+        save_cache_file(self.fingerprint_file,
+                        {'version': _FINGERPRINT_VERSION,
+                         'key': self.key,
+                         'files': files,
+                         'phase_times': phase_times})
+        return True
@@ -12,6 +12,10 @@
 __build_rules = {}
 
 
+# The names of the build functions which define targets
+__target_functions = set()
+
+
 def register_variable(name, value):
     """Register a variable that accessiable in BUILD file """
     __build_rules[name] = value
@@ -22,6 +26,20 @@ def register_function(f):
     register_variable(f.__name__, f)
 
 
+def register_target_function(f):
+    """Register a build function which defines a target named by its
+    'name' argument, the target could be constructed lazily.
+
+    """
+    register_function(f)
+    __target_functions.add(f.__name__)
+
+
+def is_target_function(name):
+    """Whether the build function defines a target """
+    return name in __target_functions
+
+
 def get_all():
     """Get the globals dict"""
     return __build_rules
@@ -17,4 +17,4 @@ def cc_benchmark(name, deps=[], **kwargs):
     cc_binary(name=name, deps=deps, **kwargs)
 
 
-build_rules.register_function(cc_benchmark)
+build_rules.register_target_function(cc_benchmark)
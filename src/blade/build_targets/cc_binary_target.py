@@ -146,6 +146,68 @@ class CcBinary(CcTarget):
         else:
             self._cc_binary()
 
+    def _ninja_cc_binary(self, objs):
+        """Generate the linking action of the binary. """
+        linkflags = ['$linkflags']
+        platform = self.blade.get_scons_platform()
+        if platform.get_gcc_version() > '4.5':
+            linkflags += ['-static-libgcc', '-static-libstdc++']
+
+        (link_all_symbols_lib_list,
+         lib_list) = self._ninja_static_deps_list()
+        if link_all_symbols_lib_list:
+            linkflags.append('-Wl,--whole-archive')
+            linkflags += link_all_symbols_lib_list
+            linkflags.append('-Wl,--no-whole-archive')
+
+        if self.data.get('export_dynamic'):
+            linkflags.append('-rdynamic')
+
+        cc_config = configparse.blade_config.get_config('cc_config')
+        linkflags += cc_config['linkflags']
+        linkflags += self.data.get('extra_linkflags', [])
+
+        libs = [l for l in link_all_symbols_lib_list + lib_list
+                if not l.startswith('-l')]
+        self._ninja_link(objs, linkflags, lib_list, libs)
+
+    def _ninja_dynamic_cc_binary(self, objs):
+        """Generate the linking action of the dynamic binary. """
+        linkflags = ['$linkflags']
+        if self.data.get('export_dynamic'):
+            linkflags.append('-rdynamic')
+        linkflags += self.data.get('extra_linkflags', [])
+
+        lib_list = self._ninja_dynamic_deps_list()
+        libs = [l for l in lib_list if not l.startswith('-l')]
+        self._ninja_link(objs, linkflags, lib_list, libs)
+
+    def _ninja_link(self, objs, linkflags, lib_list, libs):
+        """Link the objects and version information into the binary. """
+        target_file = self._target_file_path()
+        version_obj = os.path.join(self.build_path, 'version.o')
+        self._add_action([target_file], 'link', objs + [version_obj],
+                         implicit_deps=libs,
+                         env=[('linkflags', ' '.join(linkflags)),
+                              ('libs', ' '.join(lib_list))],
+                         resource_class='link')
+        self.data['ninja_outputs'] = [target_file]
+
+    def ninja_rules(self):
+        """ninja_rules.
+
+        It outputs the actions according to user options.
+
+        """
+        self._check_deprecated_deps()
+
+        objs = self._ninja_cc_objects_rules()
+
+        if self.data['dynamic_link']:
+            self._ninja_dynamic_cc_binary(objs)
+        else:
+            self._ninja_cc_binary(objs)
+
 
 def cc_binary(name,
               srcs=[],
@@ -178,4 +240,4 @@ def cc_binary(name,
     blade.blade.register_target(cc_binary_target)
 
 
-build_rules.register_function(cc_binary)
+build_rules.register_target_function(cc_binary)
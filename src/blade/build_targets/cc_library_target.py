@@ -78,6 +78,26 @@ class CcLibrary(CcTarget):
             if build_dynamic:
                 self._dynamic_cc_library()
 
+    def ninja_rules(self):
+        """ninja_rules.
+
+        It outputs the actions according to user options.
+
+        """
+        self._check_deprecated_deps()
+
+        options = self.blade.get_options()
+        build_dynamic = (getattr(options, 'generate_dynamic', False) or
+                         self.data.get('build_dynamic'))
+
+        if self.type == 'prebuilt_cc_library':
+            self._ninja_prebuilt_cc_library(build_dynamic)
+        else:
+            objs = self._ninja_cc_objects_rules()
+            self._ninja_cc_library(objs)
+            if build_dynamic:
+                self._ninja_dynamic_cc_library(objs)
+
 
 def cc_library(name,
                srcs=[],
@@ -119,4 +139,4 @@ def cc_library(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(cc_library)
+build_rules.register_target_function(cc_library)
@@ -124,5 +124,5 @@ def cc_plugin(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(cc_plugin)
+build_rules.register_target_function(cc_plugin)
 
@@ -18,6 +18,7 @@ import configparse
 
 import console
 import build_rules
+from blade_util import md5sum_str
 from blade_util import var_to_list
 from target import Target
 
@@ -99,6 +100,9 @@ class CcTarget(Target):
 
     def _clone_env(self):
         """Select env. """
+        if self.type == 'cc_library':
+            self._select_shared_env()
+            return
         env_name = self._env_name()
         warning = self.data.get('warning', '')
         if warning == 'yes':
@@ -106,6 +110,34 @@ class CcTarget(Target):
         else:
             self._write_rule('%s = env_no_warning.Clone()' % env_name)
 
+    def _select_shared_env(self):
+        """Select the env shared by the cc_library targets with the same
+        compiling flags, it is never changed after it is defined, the
+        flags of linking the dynamic library are passed to the builder.
+
+        """
+        if self.data.get('warning', '') == 'yes':
+            base_env = 'env_with_error'
+        else:
+            base_env = 'env_no_warning'
+        flags_from_option, incs_list = self._get_cc_flags()
+        settings = [('CPPFLAGS', flags_from_option),
+                    ('CPPPATH', incs_list),
+                    ('ASFLAGS', self._get_as_flags())]
+        env_name = 'env_shared_%s' % md5sum_str(
+                repr((base_env, settings)))[:16]
+        rules = ['%s = %s.Clone()' % (env_name, base_env)]
+        for var, value in settings:
+            if value:
+                rules.append('%s.Append(%s=%s)' % (env_name, var, value))
+        self.shared_env = (env_name, rules)
+
+    def _env_name(self):
+        """The name of the shared env if the target uses it. """
+        if self.shared_env:
+            return self.shared_env[0]
+        return Target._env_name(self)
+
     __cxx_keyword_list = frozenset([
         'and', 'and_eq', 'alignas', 'alignof', 'asm', 'auto',
         'bitand', 'bitor', 'bool', 'break', 'case', 'catch',
@@ -427,20 +459,16 @@ class CcTarget(Target):
 
     def _prebuilt_cc_library(self, dynamic=0):
         """prebuilt cc library rules. """
-        build_targets = self.blade.get_build_targets()
         prebuilt_target_file = ''
         prebuilt_src_file = ''
         prebuilt_symlink = ''
-        allow_only_dynamic = True
         need_static_lib_targets = ['cc_test',
                                    'cc_binary',
                                    'cc_benchmark',
                                    'cc_plugin',
                                    'swig_library']
-        for key in build_targets:
-            if (self.key in build_targets[key].expanded_deps and
-                build_targets[key].type in need_static_lib_targets):
-                allow_only_dynamic = False
+        allow_only_dynamic = not self.blade.get_depended_by(
+                self.key, need_static_lib_targets)
 
         var_name = self._generate_variable_name(self.path,
                                                 self.name)
@@ -501,22 +529,24 @@ class CcTarget(Target):
         It will output the dynamic_cc_library rule into the buffer.
 
         """
-        self._setup_extra_link_flags()
-
         var_name = self._generate_variable_name(self.path,
                                                 self.name,
                                                 'dynamic')
 
         lib_str = self._get_dynamic_deps_lib_list()
         if self.srcs or self.expanded_deps:
-            self._write_rule('%s.Append(LINKFLAGS=["-Xlinker", "--no-undefined"])'
-                             % self._env_name())
-            self._write_rule('%s = %s.SharedLibrary("%s", %s, %s)' % (
+            linkflags = self.data.get('extra_linkflags', []) + [
+                    '-Xlinker', '--no-undefined']
+            self._write_rule(
+                    '%s = %s.SharedLibrary("%s", %s, %s, '
+                    'LINKFLAGS=%s["LINKFLAGS"] + %s)' % (
                     var_name,
                     self._env_name(),
                     self._target_file_path(),
                     self._objs_name(),
-                    lib_str))
+                    lib_str,
+                    self._env_name(),
+                    linkflags))
             self._write_rule('%s.Depends(%s, %s)' % (
                     self._env_name(),
                     var_name,
@@ -541,8 +571,10 @@ class CcTarget(Target):
         objs_name = self._objs_name()
         env_name = self._env_name()
 
-        self._setup_cc_flags()
-        self._setup_as_flags()
+        # The flags are set in the shared env when it is defined
+        if not self.shared_env:
+            self._setup_cc_flags()
+            self._setup_as_flags()
 
         objs = []
         sources = []
@@ -566,3 +598,154 @@ class CcTarget(Target):
         self._write_rule('%s = [%s]' % (objs_name, ','.join(objs)))
         return sources
 
+
+    def _ninja_objects_rules(self, sources):
+        """_ninja_objects_rules.
+
+        Generate the compiling actions of sources, which is a list
+        of (source, object) pairs.  The objects are compiled after the
+        headers generated by the deps, the included headers are found in
+        the depfiles written by gcc then.
+
+        """
+        cpp_flags, incs_list = self._get_cc_flags()
+        with_warning = self.data.get('warning', '') == 'yes'
+        cppflags = ['$cppflags']
+        if with_warning:
+            cppflags.append('$warnings')
+        cppflags += cpp_flags
+        includes = ['$includes'] + ['-I%s' % inc for inc in incs_list]
+        generated_hdrs = self._ninja_deps_files('generated_hdrs')
+
+        objs = []
+        for src, obj in sources:
+            env = [('cppflags', ' '.join(cppflags)),
+                   ('includes', ' '.join(includes))]
+            if src.endswith('.c'):
+                command = 'cc'
+                if with_warning:
+                    env.append(('cflags', '$cflags $c_warnings'))
+            else:
+                command = 'cxx'
+                if with_warning:
+                    env.append(('cxxflags', '$cxxflags $cxx_warnings'))
+            self._add_action([obj], command, [src],
+                             order_only_deps=generated_hdrs,
+                             env=env, resource_class='compile')
+            objs.append(obj)
+        return objs
+
+    def _ninja_cc_objects_rules(self):
+        """Generate the compiling actions of the srcs. """
+        generated_files = self._ninja_deps_files('generated_hdrs')
+        sources = []
+        for src in self.srcs:
+            obj = os.path.join(self.build_path, self.path,
+                               '%s.objs' % self.name, src + '.o')
+            sources.append((self._ninja_source_path(src, generated_files),
+                            obj))
+        return self._ninja_objects_rules(sources)
+
+    def _ninja_static_deps_list(self):
+        """_ninja_static_deps_list.
+
+        Returns
+        -----------
+        link_all_symbols_lib_list: the libs to link all its symbols into target
+        lib_list: the libs to be statically linked into target, the system
+            libraries are -l flags
+
+        """
+        build_targets = self.blade.get_build_targets()
+        lib_list = []
+        link_all_symbols_lib_list = []
+        for dep in self.expanded_deps:
+            if not self._dep_is_library(dep):
+                continue
+
+            if dep[0] == '#':
+                lib = '-l%s' % dep[1]
+            else:
+                lib = self._target_file_path(dep[0], 'lib%s.a' % dep[1])
+
+            if build_targets[dep].data.get('link_all_symbols'):
+                link_all_symbols_lib_list.append(lib)
+            else:
+                lib_list.append(lib)
+
+        return (link_all_symbols_lib_list, lib_list)
+
+    def _ninja_dynamic_deps_list(self):
+        """Returns the libs to be dynamically linked into target, the
+        system libraries are -l flags.
+
+        """
+        build_targets = self.blade.get_build_targets()
+        lib_list = []
+        for dep in self.expanded_deps:
+            if not self._dep_is_library(dep):
+                continue
+
+            if (build_targets[dep].type == 'cc_library' and
+                not build_targets[dep].srcs):
+                continue
+            if dep[0] == '#':
+                lib_list.append('-l%s' % dep[1])
+            else:
+                lib_list.append(
+                        self._target_file_path(dep[0], 'lib%s.so' % dep[1]))
+
+        return lib_list
+
+    def _ninja_cc_library(self, objs):
+        """Generate the archiving action of the objects. """
+        lib = self._target_file_path(self.path, 'lib%s.a' % self.name)
+        self._add_action([lib], 'ar', objs, resource_class='archive')
+        self.data['ninja_outputs'] = [lib]
+
+    def _ninja_dynamic_cc_library(self, objs):
+        """Generate the linking action of the shared library. """
+        if not self.srcs and not self.expanded_deps:
+            return
+        lib = self._target_file_path(self.path, 'lib%s.so' % self.name)
+        libs = self._ninja_dynamic_deps_list()
+        linkflags = ['$linkflags', '-Xlinker', '--no-undefined']
+        linkflags += self.data.get('extra_linkflags', [])
+        self._add_action(
+                [lib], 'solink', objs,
+                implicit_deps=[l for l in libs if not l.startswith('-l')],
+                env=[('linkflags', ' '.join(linkflags)),
+                     ('libs', ' '.join(libs))],
+                resource_class='link')
+        self.data['ninja_outputs'].append(lib)
+
+    def _ninja_prebuilt_cc_library(self, dynamic=0):
+        """Generate the actions copying the prebuilt libraries. """
+        need_static_lib_targets = ['cc_test',
+                                   'cc_binary',
+                                   'cc_benchmark',
+                                   'cc_plugin',
+                                   'swig_library']
+        allow_only_dynamic = not self.blade.get_depended_by(
+                self.key, need_static_lib_targets)
+
+        self.data['ninja_outputs'] = []
+        if not allow_only_dynamic:
+            lib = self._prebuilt_cc_library_build_path()
+            self._add_action(
+                    [lib], 'copy', [self._prebuilt_cc_library_src_path()],
+                    resource_class='copy')
+            self.data['ninja_outputs'].append(lib)
+        if dynamic:
+            prebuilt_target_file = self._prebuilt_cc_library_build_path(
+                                            dynamic=1)
+            prebuilt_src_file = self._prebuilt_cc_library_src_path(
+                                            dynamic=1)
+            self._add_action([prebuilt_target_file], 'copy',
+                             [prebuilt_src_file], resource_class='copy')
+            self.data['ninja_outputs'].append(prebuilt_target_file)
+            prebuilt_symlink = os.path.realpath(prebuilt_src_file)
+            prebuilt_symlink = os.path.basename(prebuilt_symlink)
+            self.file_and_link = (prebuilt_target_file, prebuilt_symlink)
+        else:
+            self.file_and_link = None
@@ -143,4 +143,4 @@ def cc_test(name,
     blade.blade.register_target(cc_test_target)
 
 
-build_rules.register_function(cc_test)
+build_rules.register_target_function(cc_test)
@@ -17,6 +17,7 @@ import os
 import blade
 import build_rules
 import java_jar_target
+from blade_util import ninja_escape_path
 from blade_util import var_to_list
 from target import Target
 
@@ -121,6 +122,45 @@ class GenRuleTarget(Target):
                                                      var_name,
                                                      dep_var_name))
 
+    def ninja_rules(self):
+        """ninja_rules.
+
+        Description
+        -----------
+        It outputs the action of the command, which runs
+        after the deps are built.  The command is run every time if there
+        are no srcs, the targets depending on the outs are not rebuilt if
+        the command leaves the outs untouched.
+
+        """
+        generated_files = self._ninja_deps_files('generated_hdrs')
+        srcs = [self._ninja_source_path(src, generated_files)
+                for src in self.srcs]
+        outs = [self._target_file_path(self.path, out)
+                for out in self.data['outs']]
+
+        # $in and $out are not expanded in the variables of ninja build statements
+        srcs_str = [ninja_escape_path(src) for src in srcs]
+        outs_str = [ninja_escape_path(out) for out in outs]
+        # The other '$' in the command, such as the shell variables, are
+        # kept by escaping them for ninja
+        cmd = self.data['cmd'].replace('$', '$$')
+        cmd = cmd.replace('$$SRCS', ' '.join(srcs_str))
+        cmd = cmd.replace('$$OUTS', ' '.join(outs_str))
+        cmd = cmd.replace('$$FIRST_SRC', srcs_str[0] if srcs_str else '')
+        cmd = cmd.replace('$$FIRST_OUT', outs_str[0] if outs_str else '')
+        cmd = cmd.replace('$$BUILD_DIR', ninja_escape_path(self.build_path))
+
+        implicit_deps = self._ninja_deps_files('ninja_outputs')
+        if not srcs:
+            implicit_deps.append('always')
+        self._add_action(outs, 'gen_rule', srcs,
+                         implicit_deps=implicit_deps,
+                         env=[('cmd', cmd)])
+
+        self.data['ninja_outputs'] = outs
+        self.data['generated_hdrs'] = outs
+
 
 def gen_rule(name,
              srcs=[],
@@ -139,4 +179,4 @@ def gen_rule(name,
     blade.blade.register_target(gen_rule_target)
 
 
-build_rules.register_function(gen_rule)
+build_rules.register_target_function(gen_rule)
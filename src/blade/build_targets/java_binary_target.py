@@ -40,4 +40,4 @@ def java_binary(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(java_binary)
\ No newline at end of file
+build_rules.register_target_function(java_binary)
\ No newline at end of file
@@ -440,4 +440,4 @@ def java_jar(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(java_jar)
+build_rules.register_target_function(java_jar)
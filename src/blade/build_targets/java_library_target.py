@@ -44,4 +44,4 @@ def java_library(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(java_library)
+build_rules.register_target_function(java_library)
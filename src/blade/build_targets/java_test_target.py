@@ -40,4 +40,4 @@ def java_test(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(java_test)
+build_rules.register_target_function(java_test)
@@ -134,4 +134,4 @@ def lex_yacc_library(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(lex_yacc_library)
+build_rules.register_target_function(lex_yacc_library)
@@ -243,6 +243,42 @@ class ProtoLibrary(CcTarget):
             self.data.get('build_dynamic', False)):
             self._dynamic_cc_library()
 
+    def ninja_rules(self):
+        """ninja_rules.
+
+        It outputs the actions of the cc sources generated from the proto
+        files, the proto files imported are the srcs of the proto_library
+        deps.
+
+        """
+        self._check_deprecated_deps()
+
+        imported_protos = []
+        targets = self.blade.get_build_targets()
+        for dkey in self.expanded_deps:
+            dep = targets[dkey]
+            if dep.type == 'proto_library':
+                imported_protos += [os.path.join(dep.path, src)
+                                    for src in dep.srcs]
+
+        sources = []
+        generated_hdrs = []
+        for src in self.srcs:
+            (proto_src, proto_hdr) = self._proto_gen_files(self.path, src)
+            self._add_action([proto_src, proto_hdr], 'proto',
+                             [os.path.join(self.path, src)],
+                             implicit_deps=imported_protos)
+            sources.append((proto_src, proto_src + '.o'))
+            generated_hdrs.append(proto_hdr)
+        self.data['generated_hdrs'] = generated_hdrs
+
+        objs = self._ninja_objects_rules(sources)
+        self._ninja_cc_library(objs)
+        options = self.blade.get_options()
+        if (getattr(options, 'generate_dynamic', False) or
+            self.data.get('build_dynamic', False)):
+            self._ninja_dynamic_cc_library(objs)
+
 
 def proto_library(name,
                   srcs=[],
@@ -261,4 +297,4 @@ def proto_library(name,
     blade.blade.register_target(proto_library_target)
 
 
-build_rules.register_function(proto_library)
+build_rules.register_target_function(proto_library)
@@ -110,4 +110,4 @@ def py_binary(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(py_binary)
+build_rules.register_target_function(py_binary)
@@ -82,6 +82,40 @@ class ResourceLibrary(CcTarget):
             self.data.get('build_dynamic')):
             self._dynamic_cc_library()
 
+    def ninja_rules(self):
+        """ninja_rules.
+
+        It outputs the actions according to user options.
+
+        """
+        self._check_deprecated_deps()
+
+        out_dir = os.path.join(self.build_path, self.path)
+        res_header_path = os.path.join(
+                out_dir, '%s.h' % self._regular_variable_name(self.name))
+        src_list = [os.path.join(self.path, src) for src in self.srcs]
+        self._add_action([res_header_path], 'resource_header', src_list)
+        self.data['generated_hdrs'] = [res_header_path]
+
+        sources = []
+        for src_path in src_list:
+            src_base_name = self._regular_variable_name(
+                    os.path.basename(src_path))
+            new_src_path = os.path.join(out_dir, '%s.c' % src_base_name)
+            if new_src_path in [source for source, obj in sources]:
+                continue
+            self._add_action([new_src_path], 'resource_file', [src_path])
+            obj = os.path.join(out_dir, '%s.objs' % self.name,
+                               src_base_name + '.o')
+            sources.append((new_src_path, obj))
+
+        objs = self._ninja_objects_rules(sources)
+        self._ninja_cc_library(objs)
+        options = self.blade.get_options()
+        if (getattr(options, 'generate_dynamic', False) or
+            self.data.get('build_dynamic')):
+            self._ninja_dynamic_cc_library(objs)
+
     def _resource_library_rules_objects(self):
         """Generate resource library object rules.  """
         env_name = self._env_name()
@@ -152,4 +186,4 @@ def resource_library(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(resource_library)
+build_rules.register_target_function(resource_library)
@@ -476,4 +476,4 @@ def swig_library(name,
     blade.blade.register_target(target)
 
 
-build_rules.register_function(swig_library)
+build_rules.register_target_function(swig_library)
@@ -256,4 +256,4 @@ def thrift_library(name,
     blade.blade.register_target(thrift_library_target)
 
 
-build_rules.register_function(thrift_library)
+build_rules.register_target_function(thrift_library)
@@ -18,6 +18,7 @@ import shlex
 
 import console
 from argparse import ArgumentParser
+from query_output import OUTPUT_FORMATS
 
 
 class CmdArguments(object):
@@ -42,7 +43,9 @@ class CmdArguments(object):
             self.options.args = []
 
         for t in self.targets:
-            if t.startswith('-'):
+            # Targets like -//foo/... are excluded targets, a single '-'
+            # is the except operator of query expressions
+            if t.startswith('-') and t != '-' and not t.startswith('-//'):
                 console.error_exit('unregconized option %s, use blade [action] '
                                    '--help to get all the options' % t)
 
@@ -54,7 +57,8 @@ class CmdArguments(object):
                   'run':   self._check_run_command,
                   'test':  self._check_test_command,
                   'clean': self._check_clean_command,
-                  'query': self._check_query_command
+                  'query': self._check_query_command,
+                  'server': self._check_server_command
                   }
         actions[command]()
 
@@ -143,9 +147,18 @@ class CmdArguments(object):
 
     def _check_query_options(self):
         """check query action options. """
+        self.options.query_expression = None
+        if self.options.critical_path and (self.options.deps or
+                                           self.options.depended):
+            console.error_exit('--critical-path can not be used with --deps '
+                               'or --depended')
         if not self.options.deps and not self.options.depended:
-            console.error_exit('please specify --deps, --depended or both to '
-                               'query target')
+            # The targets are a query expression, such as
+            # blade query 'rdeps(//..., //base:string)'
+            if not self.targets:
+                console.error_exit('Please specify a query expression or '
+                                   'use --deps, --depended with targets')
+            self.options.query_expression = ' '.join(self.targets)
 
     def _check_build_options(self):
         """check the building options. """
@@ -189,7 +202,13 @@ class CmdArguments(object):
         self._check_plat_and_profile_options()
         self._check_color_options()
         self._check_query_options()
-        self._check_query_targets()
+        if not self.options.query_expression:
+            self._check_query_targets()
+
+    def _check_server_command(self):
+        """check server options. """
+        if self.targets:
+            console.error_exit('blade server does not accept targets')
 
     def __add_plat_profile_arguments(self, parser):
         """Add plat and profile arguments. """
@@ -224,6 +243,13 @@ class CmdArguments(object):
             action='store_true', default=False,
             help='Generate php files for proto_library and swig_library.')
 
+        parser.add_argument(
+            '--backend', dest='backend', default='scons',
+            choices=('scons', 'ninja'),
+            help=('The build tool to generate the build script for and to '
+                  'build with: scons (SConstruct) or ninja (build.ninja), '
+                  'default is scons.'))
+
     def __add_build_actions_arguments(self, parser):
         """Add build related action arguments. """
         parser.add_argument(
@@ -236,6 +262,11 @@ class CmdArguments(object):
             help=('Specifies the number of jobs (commands) to '
                   'run simultaneously.'))
 
+        parser.add_argument(
+            '--generate-jobs', dest='generate_jobs', type=int, default=1,
+            help=('Specifies the number of processes to generate the build '
+                  'rules of targets simultaneously, default is 1.'))
+
         parser.add_argument(
             '-k', '--keep-going', dest='keep_going',
             action='store_true', default=False,
@@ -249,6 +280,19 @@ class CmdArguments(object):
             '--no-test', dest='no_test', action='store_true',
             default=False, help='Do not build the test targets.')
 
+    def __add_loading_arguments(self, parser):
+        """Add BUILD files loading arguments. """
+        parser.add_argument(
+            '--load-jobs', dest='load_jobs', type=int, default=1,
+            help=('Specifies the number of processes to load BUILD files '
+                  'simultaneously, default is 1.'))
+        parser.add_argument(
+            '--strict-load', dest='strict_load', action='store_true',
+            default=False,
+            help=('Construct and validate all of the targets in the loaded '
+                  'BUILD files, not only the ones required by the command '
+                  'targets, useful for CI.'))
+
     def __add_color_arguments(self, parser):
         """Add color argument. """
         parser.add_argument(
@@ -282,6 +326,7 @@ class CmdArguments(object):
         """Add query arguments for parser. """
         self.__add_plat_profile_arguments(parser)
         self.__add_color_arguments(parser)
+        self.__add_loading_arguments(parser)
         parser.add_argument(
             '--deps', dest='deps',
             action='store_true', default=False,
@@ -294,6 +339,24 @@ class CmdArguments(object):
             '--output-to-dot', dest='output_to_dot', type=str,
             help='The name of file to output query results as dot(graphviz) '
                  'format.')
+        parser.add_argument(
+            '--output-format', dest='output_format', default='text',
+            choices=OUTPUT_FORMATS,
+            help=('The format of query results written to stdout: text, '
+                  'jsonl (a JSON object per target), binary (compact edge '
+                  'list) or dot (graphviz, clustered by package), default is '
+                  'text.'))
+        parser.add_argument(
+            '--critical-path', dest='critical_path',
+            action='store_true', default=False,
+            help=('Report the critical path of building the queried targets, '
+                  'the parallelism of each level and the targets worth '
+                  'speeding up, by the action timings of previous builds.'))
+        parser.add_argument(
+            '--transitive-reduction', dest='transitive_reduction',
+            action='store_true', default=False,
+            help='Remove the dependency edges implied by other edges from '
+                 'query results.')
 
     def _add_clean_arguments(self, parser):
         """Add clean arguments for parser. """
@@ -327,10 +390,18 @@ class CmdArguments(object):
             '--runargs', dest='runargs', type=str,
             help='Command line arguments to be passed to the single run target.')
 
+    def _add_server_arguments(self, parser):
+        """Add server command arguments. """
+        parser.add_argument(
+            '--stop', dest='stop',
+            action='store_true', default=False,
+            help='Stop the blade server of current source tree.')
+
     def _add_build_arguments(self, parser):
         """Add building arguments for parser. """
         self.__add_plat_profile_arguments(parser)
         self.__add_build_actions_arguments(parser)
+        self.__add_loading_arguments(parser)
         self.__add_color_arguments(parser)
         self.__add_cache_arguments(parser)
         self.__add_generate_arguments(parser)
@@ -363,7 +434,12 @@ class CmdArguments(object):
 
         query_parser = sub_parser.add_parser(
             'query',
-            help='Execute a dependency graph query')
+            help='Execute a dependency graph query, such as '
+                 '"deps(//foo:bar) - //foo/..."')
+
+        server_parser = sub_parser.add_parser(
+            'server',
+            help='Start a background server to speed up the commands')
 
         self._add_build_arguments(build_parser)
         self._add_build_arguments(run_parser)
@@ -373,6 +449,7 @@ class CmdArguments(object):
         self._add_test_arguments(test_parser)
         self._add_clean_arguments(clean_parser)
         self._add_query_arguments(query_parser)
+        self._add_server_arguments(server_parser)
 
         return arg_parser.parse_known_args()
 
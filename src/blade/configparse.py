@@ -36,9 +36,14 @@ class BladeConfig(object):
     def __init__(self, current_source_dir):
         self.current_source_dir = current_source_dir
         self.current_file_name = ''
+        # The config files tried, including the ones not existing
+        self.config_files = []
         self.configs = {
             'global_config' : {
                 'build_path_template': 'build${m}_${profile}',
+                'implicit_cache': False,
+                'check_working_copy': False,
+                'rules_fragment_cache': True,
             },
 
             'cc_test_config': {
@@ -60,7 +65,8 @@ class BladeConfig(object):
 
             'link_config': {
                 'link_on_tmp': False,
-                'enable_dccc': False
+                'enable_dccc': False,
+                'link_jobs': 0
             },
 
             'java_config': {
@@ -96,11 +102,13 @@ class BladeConfig(object):
                 'optimize': [],
                 'benchmark_libs': [],
                 'benchmark_main_libs': [],
+                'header_deps_from_depfile': False,
             }
         }
 
     def _try_parse_file(self, filename):
         """load the configuration file and parse. """
+        self.config_files.append(filename)
         try:
             self.current_file_name = filename
             if os.path.exists(filename):
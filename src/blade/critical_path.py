@@ -0,0 +1,259 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the critical path module which finds out what limits the wall
+ time of building some targets, from the timings of the actions recorded
+ in previous builds.
+
+"""
+
+
+import os
+
+import console
+from blade_util import load_cache_file
+
+
+# The number of targets suggested to be sped up
+_SUGGESTION_COUNT = 10
+
+
+class TargetTiming(object):
+    """TargetTiming.
+
+    The recorded time of building a target, in seconds.
+
+    cost: the total time of all actions of the target.
+    latency: the time to build the target if its actions are run as
+        parallel as possible, that is, the objects are compiled in parallel,
+        then the other actions, such as linking, are run one by one.
+
+    """
+    def __init__(self):
+        self.cost = 0.0
+        self.compile_time = 0.0
+        self.other_time = 0.0
+
+    def add(self, seconds, is_compile):
+        self.cost += seconds
+        if is_compile:
+            self.compile_time = max(self.compile_time, seconds)
+        else:
+            self.other_time += seconds
+
+    @property
+    def latency(self):
+        return self.compile_time + self.other_time
+
+
+def _split_objs_dir(path):
+    """Returns the key of the target if path is under its objs dir. """
+    parts = path.split('/')
+    for i, part in enumerate(parts):
+        if part.endswith('.objs') and i < len(parts) - 1:
+            return ('/'.join(parts[:i]) or '.', part[:-len('.objs')])
+    return None
+
+
+def _target_names_of_file(file_name):
+    """The names of the targets which could generate the file. """
+    names = [file_name]
+    stem = file_name
+    # libfoo.a, libfoo.so, and _foo.so of swig python modules
+    for prefix in ('lib', '_'):
+        if stem.startswith(prefix):
+            stem = stem[len(prefix):]
+            break
+    for suffix in ('.a', '.so', '.jar'):
+        if stem.endswith(suffix):
+            names.append(stem[:-len(suffix)])
+    return names
+
+
+class _ActionAttributor(object):
+    """Attribute the actions to the targets by the files they build.
+
+    An action belongs to the target whose objs dir contains its target or
+    source file, or the target owning its source file, such as a .proto
+    file, or the target whose output is named after it, such as libfoo.a.
+
+    """
+    def __init__(self, targets, build_path):
+        self.targets = targets
+        self.build_prefix = os.path.normpath(build_path) + '/'
+        # {source file : key}
+        self.sources = {}
+        for key, target in targets.iteritems():
+            for src in target.srcs:
+                self.sources[os.path.normpath(
+                        os.path.join(key[0], src))] = key
+
+    def _relative_path(self, path):
+        path = os.path.normpath(path)
+        if path.startswith(self.build_prefix):
+            return path[len(self.build_prefix):]
+        return path
+
+    def find_target(self, target_file, source_file):
+        target_file = self._relative_path(target_file)
+        paths = [target_file]
+        if source_file:
+            paths.append(self._relative_path(source_file))
+        for path in paths:
+            key = _split_objs_dir(path)
+            if key in self.targets:
+                return key
+            key = self.sources.get(path)
+            if key is not None:
+                return key
+        package, file_name = os.path.split(target_file)
+        for name in _target_names_of_file(file_name):
+            key = (package or '.', name)
+            if key in self.targets:
+                return key
+        return None
+
+
+def load_target_timings(timing_file, targets, build_path):
+    """Returns the {key : TargetTiming} of the targets from the action
+    timings recorded by previous builds.
+
+    """
+    action_timings = load_cache_file(timing_file) or {}
+    attributor = _ActionAttributor(targets, build_path)
+    target_timings = {}
+    for target_file, (source_file, seconds) in action_timings.iteritems():
+        key = attributor.find_target(target_file, source_file)
+        if key is None:
+            continue
+        is_compile = (target_file.endswith('.o') or
+                      _split_objs_dir(target_file) is not None)
+        target_timings.setdefault(key, TargetTiming()).add(seconds,
+                                                           is_compile)
+    return target_timings
+
+
+class CriticalPath(object):
+    """CriticalPath.
+
+    A target starts building after all of its deps are built, the longest
+    chain weighted by the latencies of the targets determines the wall
+    time of the build, no matter how many jobs are used.
+
+    """
+    def __init__(self, keys, levels, direct_deps, target_timings):
+        self.keys = frozenset(keys)
+        # The topological levels of the targets, restricted to keys
+        self.levels = [[key for key in level if key in self.keys]
+                       for level in levels]
+        self.direct_deps = direct_deps
+        self.latencies = {}
+        self.costs = {}
+        for key in self.keys:
+            timing = target_timings.get(key)
+            self.latencies[key] = timing.latency if timing else 0.0
+            self.costs[key] = timing.cost if timing else 0.0
+        # System libraries are never built
+        self.untimed_targets = [key for key in self.keys
+                                if key not in target_timings and
+                                key[0] != '#']
+        self.wall_time, self.chain = self._longest_chain(self.latencies)
+
+    def _longest_chain(self, latencies):
+        """Returns the wall time and the longest chain of targets. """
+        finish_times = {}
+        longest_deps = {}
+        for level in self.levels:
+            for key in level:
+                start_time = 0.0
+                longest_dep = None
+                for dkey in self.direct_deps.get(key, []):
+                    if dkey in self.keys and finish_times[dkey] > start_time:
+                        start_time = finish_times[dkey]
+                        longest_dep = dkey
+                finish_times[key] = start_time + latencies[key]
+                longest_deps[key] = longest_dep
+        if not finish_times:
+            return 0.0, []
+        key = max(sorted(finish_times), key=finish_times.get)
+        wall_time = finish_times[key]
+        chain = []
+        while key is not None:
+            chain.append(key)
+            key = longest_deps[key]
+        chain.reverse()
+        return wall_time, chain
+
+    def get_level_parallelism(self):
+        """Returns [(targets count, cost, latency, parallelism)] of levels.
+
+        The parallelism of a level is the speed-up of building its targets
+        with unlimited jobs, compared with building them one by one.
+
+        """
+        result = []
+        for level in self.levels:
+            if not level:
+                continue
+            cost = sum(self.costs[key] for key in level)
+            latency = max(self.latencies[key] for key in level)
+            parallelism = 0.0
+            if latency > 0:
+                parallelism = cost / latency
+            result.append((len(level), cost, latency, parallelism))
+        return result
+
+    def get_speed_up_suggestions(self):
+        """Returns [(saved wall time, key)] of the targets on the critical
+        path, the wall time is saved if the target were built instantly.
+
+        """
+        candidates = sorted(self.chain, key=self.latencies.get,
+                            reverse=True)[:_SUGGESTION_COUNT]
+        suggestions = []
+        for key in candidates:
+            if self.latencies[key] <= 0:
+                continue
+            latencies = dict(self.latencies)
+            latencies[key] = 0.0
+            wall_time = self._longest_chain(latencies)[0]
+            suggestions.append((self.wall_time - wall_time, key))
+        suggestions.sort(key=lambda s: (-s[0], s[1]))
+        return suggestions
+
+
+def report_critical_path(critical_path):
+    """Print the critical path report. """
+    total_cost = sum(critical_path.costs.itervalues())
+    print 'Critical path: %.2fs, total cost of actions: %.2fs' % (
+            critical_path.wall_time, total_cost)
+    if critical_path.wall_time > 0:
+        print 'Available parallelism: %.1f' % (
+                total_cost / critical_path.wall_time)
+    for key in critical_path.chain:
+        print '  %8.2fs  //%s:%s' % ((critical_path.latencies[key],) + key)
+
+    print
+    print 'Levels:'
+    print '  %5s  %7s  %9s  %9s  %11s' % (
+            'level', 'targets', 'cost', 'latency', 'parallelism')
+    for i, (count, cost, latency, parallelism) in enumerate(
+            critical_path.get_level_parallelism()):
+        print '  %5d  %7d  %8.2fs  %8.2fs  %11.1f' % (
+                i, count, cost, latency, parallelism)
+
+    print
+    print 'Targets to speed up:'
+    print '  %9s  %9s  %s' % ('saved', 'latency', 'target')
+    for saved_time, key in critical_path.get_speed_up_suggestions():
+        print '  %8.2fs  %8.2fs  //%s:%s' % (
+                (saved_time, critical_path.latencies[key]) + key)
+
+    if critical_path.untimed_targets:
+        console.warning('%d targets have no recorded timings, build them '
+                        'to make the result accurate' %
+                        len(critical_path.untimed_targets))
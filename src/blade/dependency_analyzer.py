@@ -17,6 +17,9 @@
 
 
 import console
+from blade_util import load_cache_file
+from blade_util import md5
+from blade_util import save_cache_file
 
 
 """
@@ -31,94 +34,316 @@ and then provide the query interface to users by blade manager.
 """
 
 
-def analyze_deps(related_targets):
+def analyze_deps(related_targets, cache_file=None):
     """analyze the dependency relationship between targets.
 
     Input: related targets after loading targets from BUILD files.
            {(target_path, target_name) : (target_data), ...}
+           cache_file, the file to persist the expanded deps.  The expanded
+           deps of the targets whose deps subgraph is unchanged are loaded
+           from it instead of being computed again.
 
-    Output:the targets that are expanded and the keys sorted
+    Output:the targets that are expanded, the keys sorted and the levels
            [all the targets keys] - sorted
+           TargetLevels of all the targets
            {(target_path, target_name) : (target_data with deps expanded), ...}
 
     """
-    _expand_deps(related_targets)
-    keys_list_sorted = _topological_sort(related_targets)
+    closure = _DepsClosure(related_targets)
+    cache = _DepsClosureCache(cache_file)
+    graph_fingerprint = closure.graph_fingerprint()
+    cached_graph = cache.get_graph(graph_fingerprint)
+    if cached_graph:
+        keys_list_sorted, closures = cached_graph
+        closure.restore(keys_list_sorted, closures)
+    else:
+        closure.expand(cache.get_closures())
+        keys_list_sorted = _topological_sort(related_targets)
+        closures = closure.dump()
+    cache.save(graph_fingerprint, keys_list_sorted, closures)
+    closure.propagate_flags()
 
-    return keys_list_sorted
+    return keys_list_sorted, closure.levels()
 
 
-def _expand_deps(targets):
-    """_expand_deps.
+# Increase it when the format of the closure cache file changes
+_CLOSURE_CACHE_VERSION = 2
 
-    Find out all the targets that certain target depeneds on them.
-    Fill the related options according to different targets.
+
+# The max number of the deps graphs kept in the closure cache
+_MAX_CACHED_GRAPHS = 8
+
+
+class _DepsClosureCache(object):
+    """_DepsClosureCache.
+
+    The expanded deps saved by the last analyzings of the different deps
+    graphs, e.g., the graphs of the different command targets, so running
+    the commands alternately reuses the results of each other.
+
+    graphs: [(graph_fingerprint, sorted_keys, closures)], the most recently
+        used first.  graph_fingerprint is the fingerprint of the whole
+        direct deps graph, sorted_keys are the keys sorted topologically,
+        closures are {key : (fingerprint, expanded deps)}, the fingerprint
+        of a target covers the direct deps subgraph reachable from it.
 
     """
-    deps_map_cache = {}  # Cache expanded target deps to avoid redundant expand
-    for target_id in targets:
-        target = targets[target_id]
-        target.expanded_deps = _find_all_deps(target_id, targets, deps_map_cache)
-        # Handle the special case: dependencies of a dynamic_cc_binary
-        # must be built as dynamic libraries.
-        if target.data.get('dynamic_link'):
-            for dep in target.expanded_deps:
-                targets[dep].data['build_dynamic'] = True
-        elif target.type == 'swig_library':
-            for dep in target.expanded_deps:
-                if targets[dep].type == 'proto_library':
-                    targets[dep].data['generate_php'] = True
-        elif target.type == 'py_binary':
-            for dep in target.expanded_deps:
-                targets[dep].data['generate_python'] = True
-        elif target.type == 'java_jar':
-            for dep in target.expanded_deps:
-                targets[dep].data['generate_java'] = True
-
-
-def _find_all_deps(target_id, targets, deps_map_cache, root_targets=None):
-    """_find_all_deps.
-
-    Return all targets depended by target_id directly and/or indirectly.
-    We need the parameter root_target_id to check loopy dependency.
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.graphs = []
+        if not cache_file:
+            return
+        data = load_cache_file(cache_file)
+        if data and data.get('version') == _CLOSURE_CACHE_VERSION:
+            self.graphs = data['graphs']
+
+    def get_graph(self, graph_fingerprint):
+        """Returns (sorted_keys, closures) of the graph, or None. """
+        for fingerprint, sorted_keys, closures in self.graphs:
+            if fingerprint == graph_fingerprint:
+                return sorted_keys, closures
+        return None
+
+    def get_closures(self):
+        """Returns the closures of all of the graphs, the closures of the
+        same target in the more recently used graph take precedence.
+
+        """
+        all_closures = {}
+        for fingerprint, sorted_keys, closures in reversed(self.graphs):
+            all_closures.update(closures)
+        return all_closures
+
+    def save(self, graph_fingerprint, sorted_keys, closures):
+        """Save the result of analyzing as the most recently used graph. """
+        if not self.cache_file:
+            return
+        if self.graphs and self.graphs[0][0] == graph_fingerprint:
+            return
+        graphs = [(graph_fingerprint, sorted_keys, closures)]
+        graphs += [graph for graph in self.graphs
+                   if graph[0] != graph_fingerprint]
+        self.graphs = graphs[:_MAX_CACHED_GRAPHS]
+        save_cache_file(self.cache_file,
+                        {'version': _CLOSURE_CACHE_VERSION,
+                         'graphs': self.graphs})
+
+
+class TargetLevels(object):
+    """TargetLevels.
+
+    The topological levels of the targets.
+
+    levels: [[key, ...], ...], the antichains of the dependency graph.
+        Level 0 holds the targets without deps, and all deps of a target
+        are in the lower levels, so the targets in the same level could be
+        built in parallel once the lower levels are done.
+    height: {key : n}, the length of the longest deps chain from the target
+        down to a target without deps, it is the level of the target.
+    depth: {key : n}, the length of the longest deps chain from a target
+        which is not depended by others down to the target.
 
     """
-    new_deps_list = deps_map_cache.get(target_id)
-    if new_deps_list is not None:
-        return new_deps_list
-
-    if root_targets is None:
-        root_targets = set()
-
-    root_targets.add(target_id)
-    new_deps_list = []
-
-    for d in targets[target_id].expanded_deps:
-        # loop dependency
-        if d in root_targets:
-            err_msg = ''
-            for t in root_targets:
-                err_msg += '//%s:%s --> ' % (t[0], t[1])
-            console.error_exit('loop dependency found: //%s:%s --> [%s]' % (
-                       d[0], d[1], err_msg))
-        new_deps_piece = [d]
-        if d not in targets:
-            console.error_exit('Target %s:%s depends on %s:%s, '
-                               'but it is missing, exit...' % (
-                                   target_id[0], target_id[1],
-                                   d[0], d[1]))
-        new_deps_piece += _find_all_deps(d, targets, deps_map_cache, root_targets)
-        # Append new_deps_piece to new_deps_list, be aware of
-        # de-duplication:
-        for nd in new_deps_piece:
-            if nd in new_deps_list:
-                new_deps_list.remove(nd)
-            new_deps_list.append(nd)
-
-    deps_map_cache[target_id] = new_deps_list
-    root_targets.remove(target_id)
-
-    return new_deps_list
+    def __init__(self, levels, height, depth):
+        self.levels = levels
+        self.height = height
+        self.depth = depth
+
+
+class _DepsClosure(object):
+    """_DepsClosure.
+
+    Computes the transitive closures of the deps of all targets.
+
+    The target keys are interned as integers, the closures are computed by
+    an iterative post-order walk so deep graphs could not exceed the
+    recursion limit.
+
+    The order of the expanded deps is the same as before: the closure of
+    a target is the concatenation of [dep] + closure(dep) for each direct
+    dep, in which only the last occurrence of every target is kept.  So a
+    target always comes after all of the targets depending on it, which
+    is the order required by linking.
+
+    A fingerprint of the direct deps subgraph reachable from every target
+    is computed during the walk, the closure of a target is reused from
+    the cache if its fingerprint is unchanged.
+
+    """
+    def __init__(self, targets):
+        self.targets = targets
+        self.keys = sorted(targets)
+        self.ids = dict((key, i) for i, key in enumerate(self.keys))
+        # Snapshot the direct deps, expanded_deps will be replaced later
+        self.direct_deps = [list(targets[key].expanded_deps)
+                            for key in self.keys]
+        self.closures = [None] * len(self.keys)
+        self.heights = [0] * len(self.keys)
+        self.fingerprints = [None] * len(self.keys)
+        # The closures as keys, they become the expanded_deps
+        self.closure_keys = [None] * len(self.keys)
+        # {key : (fingerprint, closure keys)} of the last analyzing
+        self.cached_closures = {}
+
+    def _report_missing(self, key, dkey):
+        console.error_exit('Target %s:%s depends on %s:%s, '
+                           'but it is missing, exit...' % (
+                               key[0], key[1], dkey[0], dkey[1]))
+
+    def _report_loop(self, dkey, path):
+        err_msg = ''
+        for i in path:
+            err_msg += '//%s:%s --> ' % self.keys[i]
+        console.error_exit('loop dependency found: //%s:%s --> [%s]' % (
+                   dkey[0], dkey[1], err_msg))
+
+    def _walk(self, root):
+        """Compute the closures of root and all targets it depends on. """
+        closures = self.closures
+        on_path = set([root])
+        # [(id, index of the next dep to visit)]
+        stack = [(root, 0)]
+        while stack:
+            i, next_dep = stack[-1]
+            deps = self.direct_deps[i]
+            while next_dep < len(deps):
+                dkey = deps[next_dep]
+                next_dep += 1
+                d = self.ids.get(dkey)
+                if d in on_path:
+                    self._report_loop(dkey, [t for t, n in stack])
+                if d is None:
+                    self._report_missing(self.keys[i], dkey)
+                if closures[d] is None:
+                    stack[-1] = (i, next_dep)
+                    stack.append((d, 0))
+                    on_path.add(d)
+                    break
+            else:
+                stack.pop()
+                on_path.remove(i)
+                self._merge(i)
+
+    def _merge(self, i):
+        """Compute the closure of i from the closures of its direct deps. """
+        key = self.keys[i]
+        fingerprint = md5.md5(repr(key))
+        for dkey in self.direct_deps[i]:
+            fingerprint.update(self.fingerprints[self.ids[dkey]])
+        fingerprint = fingerprint.digest()
+        self.fingerprints[i] = fingerprint
+
+        cached = self.cached_closures.get(key)
+        if cached and cached[0] == fingerprint:
+            self.closure_keys[i] = cached[1]
+            self.closures[i] = [self.ids[k] for k in cached[1]]
+        else:
+            pieces = []
+            for dkey in self.direct_deps[i]:
+                d = self.ids[dkey]
+                pieces.append([d])
+                pieces.append(self.closures[d])
+            # Keep the last occurrence of every target
+            closure = []
+            seen = set()
+            for piece in reversed(pieces):
+                for d in reversed(piece):
+                    if d not in seen:
+                        seen.add(d)
+                        closure.append(d)
+            closure.reverse()
+            self.closures[i] = closure
+            self.closure_keys[i] = [self.keys[d] for d in closure]
+        self._merge_height(i)
+
+    def _merge_height(self, i):
+        """Compute the height of i from its direct deps. """
+        height = 0
+        for dkey in self.direct_deps[i]:
+            height = max(height, self.heights[self.ids[dkey]] + 1)
+        self.heights[i] = height
+
+    def graph_fingerprint(self):
+        """The fingerprint of the whole direct deps graph. """
+        fingerprint = md5.md5()
+        for i, key in enumerate(self.keys):
+            fingerprint.update(repr((key, self.direct_deps[i])))
+        return fingerprint.hexdigest()
+
+    def expand(self, cached_closures):
+        """Replace the expanded_deps of all targets with their closures. """
+        self.cached_closures = cached_closures
+        for i in xrange(len(self.keys)):
+            if self.closures[i] is None:
+                self._walk(i)
+        for i, key in enumerate(self.keys):
+            self.targets[key].expanded_deps = self.closure_keys[i]
+
+    def restore(self, sorted_keys, cached_closures):
+        """Restore the closures when the whole graph is unchanged.
+
+        sorted_keys are sorted topologically, so the deps of a target are
+        always visited before it.
+
+        """
+        for key in sorted_keys:
+            self._merge_height(self.ids[key])
+            self.targets[key].expanded_deps = cached_closures[key][1]
+
+    def dump(self):
+        """Returns the closures to be saved in cache. """
+        closures = {}
+        for i, key in enumerate(self.keys):
+            closures[key] = (self.fingerprints[i], self.closure_keys[i])
+        return closures
+
+    def levels(self):
+        """Returns the TargetLevels of the targets. """
+        keys = self.keys
+        levels = []
+        for i, height in enumerate(self.heights):
+            while len(levels) <= height:
+                levels.append([])
+            levels[height].append(i)
+        # The deps of a target are always in lower levels, so the depth of
+        # all the dependers are known when visiting the levels downwards
+        depths = [0] * len(keys)
+        for level in reversed(levels):
+            for i in level:
+                for dkey in self.direct_deps[i]:
+                    d = self.ids[dkey]
+                    depths[d] = max(depths[d], depths[i] + 1)
+        return TargetLevels([[keys[i] for i in level] for level in levels],
+                            dict(zip(keys, self.heights)),
+                            dict(zip(keys, depths)))
+
+    def propagate_flags(self):
+        """Set the options required by the targets to their dependencies.
+
+        The dependencies of a dynamic_cc_binary must be built as dynamic
+        libraries, and the proto_library dependencies of a swig_library,
+        py_binary and java_jar targets must generate php, python and java
+        code respectively.
+
+        """
+        # Only the closures of the targets requiring the flags are visited
+        for key in self.keys:
+            target = self.targets[key]
+            if target.data.get('dynamic_link'):
+                flag = 'build_dynamic'
+            elif target.type == 'swig_library':
+                flag = 'generate_php'
+            elif target.type == 'py_binary':
+                flag = 'generate_python'
+            elif target.type == 'java_jar':
+                flag = 'generate_java'
+            else:
+                continue
+            for dkey in target.expanded_deps:
+                dep = self.targets[dkey]
+                if flag == 'generate_php' and dep.type != 'proto_library':
+                    continue
+                dep.data[flag] = True
 
 
 def _topological_sort(pairlist):
@@ -15,12 +15,25 @@
 """
 
 
+import marshal
 import os
 import traceback
 
 import build_rules
+import configparse
 import console
+from blade_util import load_cache_file
+from blade_util import md5sum_str
 from blade_util import relative_path
+from blade_util import save_cache_file
+from build_file_cache import dump_record
+from build_file_cache import is_hermetic
+from build_file_cache import load_record
+from build_file_cache import trust_build_file
+from build_file_cache import untrust_build_files
+from reverse_deps_index import ReverseDepsIndex
+from source_tree_walker import SourceTreeWalker
+from working_copy import get_working_copy_status
 
 
 # import these modules make build functions registered into build_rules
@@ -47,20 +60,34 @@ class TargetAttributes(object):
     def is_debug(self):
         return self._options.profile == 'debug'
 
+    def cache_key(self):
+        """All of the options which could be seen by BUILD files. """
+        return 'm=%s,profile=%s' % (self._options.m, self._options.profile)
+
 
 build_target = None
 
 
+def _init_build_target(blade):
+    """Initialize the build_target for the options of the blade, to be
+    used for BUILD file loaded by execfile.  The blade server loads the
+    targets of the commands with different options in one process.
+
+    """
+    global build_target
+    options = blade.get_options()
+    if build_target is None or build_target._options is not options:
+        build_target = TargetAttributes(options)
+        build_rules.register_variable('build_target', build_target)
+
+
 def _find_dir_depender(dir, blade):
     """_find_dir_depender to find which target depends on the dir.
 
     """
-    target_database = blade.get_target_database()
-    for key in target_database:
-        for dkey in target_database[key].expanded_deps:
-            if dkey[0] == dir:
-                return '//%s:%s' % (target_database[key].path,
-                                    target_database[key].name)
+    dependers = blade.get_dir_depended_by(dir)
+    if dependers:
+        return '//%s:%s' % dependers[0]
     return None
 
 
@@ -104,14 +131,6 @@ def _load_build_file(source_dir, action_if_fail, processed_source_dirs, blade):
     caller and used to avoid duplicated execution of BUILD files.
 
     """
-
-    # Initialize the build_target at first time, to be used for BUILD file
-    # loaded by execfile
-    global build_target
-    if build_target is None:
-        build_target = TargetAttributes(blade.get_options())
-        build_rules.register_variable('build_target', build_target)
-
     source_dir = os.path.normpath(source_dir)
     # TODO(yiwang): the character '#' is a magic value.
     if source_dir in processed_source_dirs or source_dir == '#':
@@ -126,9 +145,7 @@ def _load_build_file(source_dir, action_if_fail, processed_source_dirs, blade):
     build_file = os.path.join(source_dir, 'BUILD')
     if os.path.exists(build_file):
         try:
-            # The magic here is that a BUILD file is a Python script,
-            # which can be loaded and executed by execfile().
-            execfile(build_file, build_rules.get_all(), None)
+            _exec_build_file(build_file, blade)
         except SystemExit:
             console.error_exit('%s: fatal error, exit...' % build_file)
         except:
@@ -141,18 +158,447 @@ def _load_build_file(source_dir, action_if_fail, processed_source_dirs, blade):
     blade.set_current_source_path(old_current_source_path)
 
 
+class _TargetDescriptor(object):
+    """The lightweight descriptor of a target defined in a BUILD file.
+
+    It holds the arguments of the build function call, the target object
+    is constructed and validated by calling the build function only when
+    the target is required.
+
+    """
+    def __init__(self, function_name, args, kwargs, source_dir):
+        self.function_name = function_name
+        self.args = args
+        self.kwargs = kwargs
+        self.source_dir = source_dir
+        self.key = (source_dir, _get_target_name(args, kwargs))
+
+
+def _get_target_name(args, kwargs):
+    """Returns the name argument of a target function call, or None. """
+    if args:
+        name = args[0]
+    else:
+        name = kwargs.get('name')
+    if isinstance(name, basestring) and name:
+        return name
+    return None
+
+
+def _define_target(function_name, args, kwargs, blade):
+    """Define a target by the call of the target function.
+
+    The target is registered as a descriptor to be constructed later,
+    unless its name is unknown, then it is constructed immediately to
+    report the error.
+
+    """
+    if _get_target_name(args, kwargs) is None:
+        build_rules.get_all()[function_name](*args, **kwargs)
+        return
+    blade.register_target_descriptor(_TargetDescriptor(
+            function_name, args, kwargs, blade.get_current_source_path()))
+
+
+def _construct_target(descriptor, blade):
+    """Construct the target object from its descriptor. """
+    old_current_source_path = blade.get_current_source_path()
+    blade.set_current_source_path(descriptor.source_dir)
+    build_file = os.path.join(descriptor.source_dir, 'BUILD')
+    try:
+        build_rules.get_all()[descriptor.function_name](*descriptor.args,
+                                                        **descriptor.kwargs)
+    except SystemExit:
+        console.error_exit('%s: fatal error, exit...' % build_file)
+    except:
+        console.error_exit('Parse error in %s, exit...\n%s' % (
+                build_file, traceback.format_exc()))
+    blade.set_current_source_path(old_current_source_path)
+
+
+class _BuildFunctionRecorder(object):
+    """Wrap a build function to record the calls which define targets. """
+    def __init__(self, function, records, blade):
+        self.function = function
+        self.records = records
+        self.blade = blade
+
+    def __call__(self, *args, **kwargs):
+        # Dump the record before calling, the function may modify args
+        function_name = self.function.__name__
+        record = dump_record(function_name, args, kwargs)
+        if (record is not None and
+                build_rules.is_target_function(function_name)):
+            # Define the target with the copy of the arguments in the
+            # record, so it is not affected by later modifications
+            self.records.append(record)
+            function_name, args, kwargs = load_record(record)
+            _define_target(function_name, args, kwargs, self.blade)
+            return None
+        target_database = self.blade.get_target_database()
+        targets_count = len(target_database)
+        ret = self.function(*args, **kwargs)
+        if len(target_database) != targets_count:
+            self.records.append(record)
+        return ret
+
+
+def _read_build_file(build_file):
+    """Returns the content of the BUILD file and its md5sum. """
+    f = open(build_file, 'rU')
+    try:
+        content = f.read()
+    finally:
+        f.close()
+    return content, md5sum_str(content)
+
+
+def _run_build_file_code(code, blade):
+    """Execute the code of a BUILD file and returns the records. """
+    records = []
+    build_globals = {}
+    for name, value in build_rules.get_all().iteritems():
+        if callable(value):
+            value = _BuildFunctionRecorder(value, records, blade)
+        build_globals[name] = value
+    exec code in build_globals
+
+    if None in records or not is_hermetic(code, build_globals):
+        # Some arguments could not be pickled or the BUILD file reads
+        # other inputs, always execute it
+        return None
+    return records
+
+
+def _exec_build_file(build_file, blade):
+    """Execute the BUILD file, or replay its records in the cache. """
+    build_file_cache = blade.get_build_file_cache()
+    records = build_file_cache.get_trusted_records(build_file)
+    if records is not None:
+        _replay_records(records, blade)
+        return
+
+    content, content_md5 = _read_build_file(build_file)
+    records = build_file_cache.get_records(build_file, content_md5)
+    if records is not None:
+        _replay_records(records, blade)
+        return
+
+    # The magic here is that a BUILD file is a Python script, which can be
+    # compiled and executed, the build functions called in it register
+    # targets into target database.
+    code = build_file_cache.get_code(build_file, content, content_md5)
+    records = _run_build_file_code(code, blade)
+    build_file_cache.update(build_file, content_md5, code, records)
+
+
+def _replay_records(records, blade):
+    """Call the build functions recorded in the records. """
+    build_functions = build_rules.get_all()
+    for record in records:
+        function_name, args, kwargs = load_record(record)
+        if build_rules.is_target_function(function_name):
+            _define_target(function_name, args, kwargs, blade)
+        else:
+            build_functions[function_name](*args, **kwargs)
+
+
+def _init_loading_worker():
+    """Initialize the worker process of parallel loading.
+
+    Messages are discarded in workers, they are reported again when the
+    parent process replays the records.
+
+    """
+    null_fd = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(null_fd, 1)
+    os.dup2(null_fd, 2)
+    os.close(null_fd)
+
+
+def _load_build_file_in_worker(source_dir):
+    """Execute the BUILD file in source_dir in a worker process.
+
+    The worker is forked from the blade process, targets are registered
+    into its own copy of the target database, which is discarded.  Returns
+    the loading result to be put into the BUILD file cache, or None if the
+    BUILD file fails, then the parent process will execute it again to
+    report the error.
+
+    """
+    import blade
+    blade_manager = blade.blade
+    build_file = os.path.join(source_dir, 'BUILD')
+    try:
+        content, content_md5 = _read_build_file(build_file)
+        code = blade_manager.get_build_file_cache().get_code(
+                build_file, content, content_md5)
+        blade_manager.set_current_source_path(source_dir)
+        records = _run_build_file_code(code, blade_manager)
+    except (SystemExit, Exception):
+        return None
+    return build_file, content_md5, marshal.dumps(code), records
+
+
+def _parallel_load_build_files(source_dirs, processed_source_dirs,
+                               loading_pool, blade):
+    """Execute the BUILD files in source_dirs in the loading pool.
+
+    The results are put into the BUILD file cache, later calls of
+    _load_build_file replay them in the parent process in deterministic
+    order, so the targets are registered and errors are reported in the
+    same way as the serial loading.
+
+    """
+    build_file_cache = blade.get_build_file_cache()
+    pending_source_dirs = []
+    for source_dir in source_dirs:
+        source_dir = os.path.normpath(source_dir)
+        if source_dir in processed_source_dirs or source_dir == '#':
+            continue
+        build_file = os.path.join(source_dir, 'BUILD')
+        if not os.path.isfile(build_file):
+            continue
+        if build_file_cache.get_trusted_records(build_file) is not None:
+            continue
+        content, content_md5 = _read_build_file(build_file)
+        if (build_file_cache.get_records(build_file, content_md5) is None and
+                build_file_cache.is_replayable(build_file, content_md5)):
+            pending_source_dirs.append(source_dir)
+
+    if len(pending_source_dirs) < 2:
+        return
+    for result in loading_pool.map(_load_build_file_in_worker,
+                                   sorted(set(pending_source_dirs))):
+        if result is None:
+            continue
+        build_file, content_md5, code, records = result
+        build_file_cache.update(build_file, content_md5,
+                                marshal.loads(code), records)
+
+
+class _LoadingPool(object):
+    """The process pool for parallel loading.
+
+    The worker processes are created when there are really some BUILD
+    files to be executed, so a fully cached loading costs nothing.
+
+    """
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.pool = None
+
+    def map(self, function, iterable):
+        if self.pool is None:
+            import multiprocessing
+            self.pool = multiprocessing.Pool(self.jobs, _init_loading_worker)
+        return self.pool.map(function, iterable)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _create_loading_pool(blade):
+    """Create the process pool for parallel loading if it is enabled. """
+    load_jobs = getattr(blade.get_options(), 'load_jobs', 1)
+    if not load_jobs or load_jobs <= 1:
+        return None
+    try:
+        import multiprocessing
+    except ImportError:
+        console.warning('multiprocessing is not available, '
+                        'load BUILD files serially')
+        return None
+    return _LoadingPool(load_jobs)
+
+
+def _is_build_file_unchanged(working_copy_status, build_file):
+    """Whether the BUILD file and the other files in its dir are unchanged. """
+    return (working_copy_status.is_build_file_unchanged(build_file) and
+            not working_copy_status.is_dir_changed(os.path.dirname(build_file)))
+
+
+def _trust_unchanged_build_files(working_copy_status, state_file):
+    """Trust the BUILD files which are unchanged since the last loading.
+
+    The state of the last loading holds the revision of the working copy
+    and the md5 of the BUILD files which were unchanged in the working
+    copy.  If the working copy is still in the same revision, the BUILD
+    files which are still unchanged have the same content as last time,
+    so they needn't to be read again.
+
+    Returns the trusted {build_file : md5}.
+
+    """
+    state = load_cache_file(state_file)
+    if not state or state.get('revision') != working_copy_status.revision:
+        return {}
+    trusted_build_files = {}
+    for build_file, content_md5 in state['build_files'].iteritems():
+        if _is_build_file_unchanged(working_copy_status, build_file):
+            trust_build_file(build_file, content_md5)
+            trusted_build_files[build_file] = content_md5
+    return trusted_build_files
+
+
+def _save_loading_state(working_copy_status, state_file,
+                        trusted_build_files, processed_source_dirs,
+                        build_file_cache):
+    """Save the md5 of the BUILD files which are unchanged in the working
+    copy, for _trust_unchanged_build_files of the next loading.
+
+    """
+    build_files = dict(trusted_build_files)
+    for source_dir in processed_source_dirs:
+        build_file = os.path.join(source_dir, 'BUILD')
+        if build_file in build_files:
+            continue
+        content_md5 = build_file_cache.get_md5(build_file)
+        if (content_md5 and
+                _is_build_file_unchanged(working_copy_status, build_file)):
+            build_files[build_file] = content_md5
+    save_cache_file(state_file, {'revision': working_copy_status.revision,
+                                 'build_files': build_files})
+
+
+def _index_build_file_in_worker(source_dir):
+    """Load the BUILD file in source_dir and construct all of its targets
+    in a worker process.
+
+    Returns the direct deps of the targets, {key : [dep key]}, or None if
+    the BUILD file fails.  The targets are discarded with the worker.
+
+    """
+    import blade
+    blade_manager = blade.blade
+    target_descriptors = blade_manager.get_target_descriptors()
+    target_database = blade_manager.get_target_database()
+    # Only the targets in this BUILD file are needed
+    target_descriptors.clear()
+    target_database.clear()
+    build_file = os.path.join(source_dir, 'BUILD')
+    try:
+        blade_manager.set_current_source_path(source_dir)
+        _exec_build_file(build_file, blade_manager)
+        for key in sorted(target_descriptors):
+            _construct_target(target_descriptors[key], blade_manager)
+    except (SystemExit, Exception):
+        return None
+    return dict((key, list(target.expanded_deps))
+                for key, target in target_database.iteritems()
+                if key[0] == source_dir)
+
+
+def find_depended_targets(keys, blade_root_dir, blade):
+    """Find the targets depending on keys by the reverse deps index.
+
+    The index covers all BUILD files under BLADE_ROOT, the entries of the
+    BUILD files changed since last time are updated, by constructing
+    their targets in worker processes, then the dependers are looked up
+    in the index.  Returns None if the index is not available.
+
+    """
+    try:
+        import multiprocessing
+    except ImportError:
+        return None
+    _init_build_target(blade)
+
+    source_tree_walker = SourceTreeWalker(
+            blade_root_dir, blade.get_blade_cache_file('source_dirs'))
+    build_dirs = source_tree_walker.find_build_dirs('.')
+    source_tree_walker.save()
+
+    index = ReverseDepsIndex(blade.get_blade_cache_file('reverse_deps'))
+    build_files = set()
+    stale_build_files = []
+    for source_dir in build_dirs:
+        build_file = os.path.join(source_dir, 'BUILD')
+        try:
+            mtime = os.path.getmtime(build_file)
+        except OSError:
+            continue
+        build_files.add(build_file)
+        entry = index.get_entry(build_file)
+        if entry and entry[0] == mtime:
+            continue
+        content, content_md5 = _read_build_file(build_file)
+        if entry and entry[1] == content_md5:
+            index.update(build_file, mtime, content_md5, entry[2])
+        else:
+            stale_build_files.append((build_file, mtime, content_md5))
+    index.retain(build_files)
+
+    if stale_build_files:
+        console.info('indexing %d BUILD files...' % len(stale_build_files))
+        load_jobs = getattr(blade.get_options(), 'load_jobs', 1)
+        loading_pool = _LoadingPool(max(load_jobs, 1))
+        try:
+            results = loading_pool.map(
+                    _index_build_file_in_worker,
+                    [os.path.dirname(b) for b, m, c in stale_build_files])
+        finally:
+            loading_pool.close()
+        for (build_file, mtime, content_md5), deps in zip(stale_build_files,
+                                                          results):
+            if deps is None:
+                console.warning('%s: failed to index, the targets in it are '
+                                'not queried' % build_file)
+                continue
+            index.update(build_file, mtime, content_md5, deps)
+    index.save()
+    return index.find_dependers(keys)
+
+
 def _find_depender(dkey, blade):
     """_find_depender to find which target depends on the target with dkey.
 
     """
-    target_database = blade.get_target_database()
-    for key in target_database:
-        if dkey in target_database[key].expanded_deps:
-            return '//%s:%s' % (target_database[key].path,
-                                target_database[key].name)
+    dependers = blade.get_depended_by(dkey)
+    if dependers:
+        return '//%s:%s' % dependers[0]
     return None
 
 
+class _ExcludedTargets(object):
+    """The targets excluded from command line, such as -//foo/... """
+    def __init__(self):
+        self.dirs = set()
+        self.recursive_dirs = []
+        self.targets = set()
+
+    def add(self, target_id):
+        """Add a target pattern relative to BLADE_ROOT. """
+        if target_id.startswith('//'):
+            target_id = target_id[2:]
+        if target_id.find(':') == -1:
+            path, name = target_id, '*'
+        else:
+            path, name = target_id.rsplit(':', 1)
+        if path.endswith('...'):
+            self.recursive_dirs.append(os.path.normpath(path[:-3] or '.'))
+        elif name == '*' or name == '':
+            self.dirs.add(os.path.normpath(path or '.'))
+        else:
+            self.targets.add((os.path.normpath(path or '.'), name))
+
+    def match_dir(self, path):
+        """Whether all targets in the dir are excluded. """
+        if path in self.dirs:
+            return True
+        for d in self.recursive_dirs:
+            if d == '.' or path == d or path.startswith(d + '/'):
+                return True
+        return False
+
+    def match(self, key):
+        """Whether the target is excluded. """
+        return key in self.targets or self.match_dir(key[0])
+
+
 def load_targets(target_ids, working_dir, blade_root_dir, blade):
     """load_targets.
 
@@ -174,10 +620,19 @@ def load_targets(target_ids, working_dir, blade_root_dir, blade):
 
     direct_targets = []
     all_command_targets = []
+    # Target patterns prefixed by '-' in command line, the matched targets
+    # are excluded from the command targets.
+    excluded_targets = _ExcludedTargets()
+
+    source_tree_walker = SourceTreeWalker(
+            blade_root_dir, blade.get_blade_cache_file('source_dirs'))
     # Parse command line target_ids.  For those in the form of <path>:<target>,
     # record (<path>,<target>) in cited_targets; for the rest (with <path>
     # but without <target>), record <path> into paths.
     for target_id in target_ids:
+        if target_id.startswith('-'):
+            excluded_targets.add(target_id[1:])
+            continue
         if target_id.find(':') == -1:
             source_dir, target_name = target_id, '*'
         else:
@@ -193,52 +648,112 @@ def load_targets(target_ids, working_dir, blade_root_dir, blade):
             if not source_dir:
                 source_dir = './'
             source_dirs.append((source_dir, WARN_IF_FAIL))
-            for root, dirs, files in os.walk(source_dir):
-                # Skip over subdirs starting with '.', e.g., .svn.
-                dirs[:] = [d for d in dirs if not d.startswith('.')]
-                for d in dirs:
-                    source_dirs.append((os.path.join(root, d), IGNORE_IF_FAIL))
+            source_dir = os.path.normpath(source_dir)
+            for d in source_tree_walker.find_build_dirs(source_dir):
+                if d != source_dir:
+                    source_dirs.append((d, IGNORE_IF_FAIL))
         else:
             source_dirs.append((source_dir, ABORT_IF_FAIL))
+    source_tree_walker.save()
 
-    direct_targets = list(cited_targets)
-
-    # Load BUILD files in paths, and add all loaded targets into
-    # cited_targets.  Together with above step, we can ensure that all
-    # targets mentioned in the command line are now in cited_targets.
-    for source_dir, action_if_fail in source_dirs:
-        _load_build_file(source_dir,
-                         action_if_fail,
-                         processed_source_dirs,
-                         blade)
-
-    for key in target_database:
-        cited_targets.add(key)
-    all_command_targets = list(cited_targets)
-
-    # Starting from targets specified in command line, breath-first
-    # propagate to load BUILD files containing directly and indirectly
-    # dependent targets.  All these targets form related_targets,
-    # which is a subset of target_databased created by loading  BUILD files.
-    while cited_targets:
-        source_dir, target_name = cited_targets.pop()
-        target_id = (source_dir, target_name)
-        if target_id in related_targets:
-            continue
+    source_dirs = [(d, a) for d, a in source_dirs
+                   if not excluded_targets.match_dir(os.path.normpath(d))]
+    cited_targets = set([key for key in cited_targets
+                         if not excluded_targets.match(key)])
 
-        _load_build_file(source_dir,
-                         ABORT_IF_FAIL,
-                         processed_source_dirs,
-                         blade)
-
-        if target_id not in target_database:
-            console.error_exit('%s: target //%s:%s does not exists' % (
-                _find_depender(target_id, blade), source_dir, target_name))
+    direct_targets = list(cited_targets)
 
-        related_targets[target_id] = target_database[target_id]
-        for key in related_targets[target_id].expanded_deps:
-            if key not in related_targets:
+    _init_build_target(blade)
+
+    # Ask the version control system for the changed files, the BUILD
+    # files which are unchanged since the last loading are not read again
+    working_copy_status = None
+    if configparse.blade_config.get_config('global_config')[
+            'check_working_copy']:
+        working_copy_status = get_working_copy_status(blade_root_dir)
+    loading_state_file = blade.get_blade_cache_file('loading_state')
+    trusted_build_files = {}
+    if working_copy_status:
+        trusted_build_files = _trust_unchanged_build_files(
+                working_copy_status, loading_state_file)
+
+    loading_pool = _create_loading_pool(blade)
+    try:
+        # Load BUILD files in paths, and add all loaded targets into
+        # cited_targets.  Together with above step, we can ensure that all
+        # targets mentioned in the command line are now in cited_targets.
+        if loading_pool:
+            _parallel_load_build_files([d for d, a in source_dirs],
+                                       processed_source_dirs,
+                                       loading_pool,
+                                       blade)
+        for source_dir, action_if_fail in source_dirs:
+            _load_build_file(source_dir,
+                             action_if_fail,
+                             processed_source_dirs,
+                             blade)
+
+        target_descriptors = blade.get_target_descriptors()
+        for key in target_descriptors.keys() + target_database.keys():
+            if not excluded_targets.match(key):
                 cited_targets.add(key)
+        all_command_targets = list(cited_targets)
+
+        # Starting from targets specified in command line, breath-first
+        # propagate to load BUILD files containing directly and indirectly
+        # dependent targets.  All these targets form related_targets,
+        # which is a subset of target_databased created by loading  BUILD
+        # files.  Each round handles the targets cited by the last round
+        # in sorted order, so the loading is deterministic.
+        while cited_targets:
+            if loading_pool:
+                _parallel_load_build_files([d for d, n in cited_targets],
+                                           processed_source_dirs,
+                                           loading_pool,
+                                           blade)
+            frontier = sorted(cited_targets)
+            cited_targets = set()
+            for target_id in frontier:
+                if target_id in related_targets:
+                    continue
+                source_dir, target_name = target_id
+
+                _load_build_file(source_dir,
+                                 ABORT_IF_FAIL,
+                                 processed_source_dirs,
+                                 blade)
+
+                if (target_id not in target_database and
+                        target_id in target_descriptors):
+                    _construct_target(target_descriptors[target_id], blade)
+                if target_id not in target_database:
+                    console.error_exit('%s: target //%s:%s does not exists' % (
+                        _find_depender(target_id, blade), source_dir, target_name))
+
+                related_targets[target_id] = target_database[target_id]
+                for key in related_targets[target_id].expanded_deps:
+                    if key not in related_targets:
+                        cited_targets.add(key)
+
+        if getattr(blade.get_options(), 'strict_load', False):
+            # Construct and validate all of the loaded targets, even if
+            # they are not required by the command targets
+            for key in sorted(target_descriptors):
+                if key not in target_database:
+                    _construct_target(target_descriptors[key], blade)
+    finally:
+        if loading_pool:
+            loading_pool.close()
+        if trusted_build_files:
+            untrust_build_files()
+
+    blade.get_build_file_cache().save()
+    if working_copy_status:
+        _save_loading_state(working_copy_status,
+                            loading_state_file,
+                            trusted_build_files,
+                            processed_source_dirs,
+                            blade.get_build_file_cache())
 
     # Iterating to get svn root dirs
     for path, name in related_targets:
@@ -0,0 +1,51 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the ninja helper module which is run by the commands in
+ build.ninja for the actions that are not plain shell commands, such as:
+
+    python -m ninja_helper resource_header <header> <resource files...>
+
+"""
+
+
+import os
+import sys
+
+
+def generate_resource_header(res_header_path, sources):
+    """Declare the arrays of the resource files in the header. """
+    f = open(res_header_path, 'w')
+
+    print >>f, '// This file was automatically generated by blade'
+    print >>f, '#ifdef __cplusplus\nextern "C" {\n#endif\n'
+    for s in sources:
+        var_name = s
+        for i in [',', '-', '/', '.', '+']:
+            var_name = var_name.replace(i, '_')
+        print >>f, 'extern const char RESOURCE_%s[%d];' % (
+                var_name, os.path.getsize(s))
+    print >>f, '\n#ifdef __cplusplus\n}\n#endif\n'
+    f.close()
+
+
+_ACTIONS = {
+    'resource_header': generate_resource_header,
+}
+
+
+def main(argv):
+    if len(argv) < 3 or argv[1] not in _ACTIONS:
+        print >>sys.stderr, 'Usage: %s <%s> <target> [sources...]' % (
+                argv[0], '|'.join(sorted(_ACTIONS)))
+        return 1
+    _ACTIONS[argv[1]](argv[2], argv[3:])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,285 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the ninja rules generator module which generates build.ninja
+ from the action graph of the targets, it is the alternative to the scons
+ rules generator, and the building is done by ninja.
+
+ Only the cc targets, proto_library, gen_rule and resource_library are
+ supported now.
+
+"""
+
+
+import os
+import sys
+
+import configparse
+
+from action_graph import Action
+from action_graph import ActionGraph
+from blade_util import cpu_count
+from blade_util import ninja_escape_path
+from rules_generator import SconsFileHeaderGenerator
+
+
+def _ninja_paths(paths):
+    return ' '.join([ninja_escape_path(path) for path in paths])
+
+
+def ninja_build_statement(action):
+    """Returns the lines of the ninja build statement of the action, the
+    command of the action is the ninja rule, and its env are the variables
+    of the statement.
+
+    """
+    statement = 'build %s: %s' % (_ninja_paths(action.outputs),
+                                  action.command)
+    if action.inputs:
+        statement += ' ' + _ninja_paths(action.inputs)
+    if action.implicit_deps:
+        statement += ' | ' + _ninja_paths(action.implicit_deps)
+    if action.order_only_deps:
+        statement += ' || ' + _ninja_paths(action.order_only_deps)
+    lines = [statement]
+    if action.resource_class == 'link':
+        lines.append('  pool = link_pool')
+    for name, value in action.env:
+        lines.append(('  %s = %s' % (name, value)).rstrip())
+    return lines
+
+
+class NinjaFileHeaderGenerator(SconsFileHeaderGenerator):
+    """NinjaFileHeaderGenerator.
+
+    Generates the variables and the rules of build.ninja, the variables
+    hold the toolchain and the flags for all targets, which are extended
+    by the targets in their build statements.
+
+    """
+    def __init__(self, options, build_dir, gcc_version,
+                 python_inc, build_environment, svn_roots,
+                 blade_path):
+        SconsFileHeaderGenerator.__init__(self, options, build_dir,
+                                          gcc_version, python_inc,
+                                          build_environment, svn_roots)
+        self.blade_path = blade_path
+
+    def _add_variable(self, name, value):
+        if isinstance(value, list):
+            value = ' '.join(value)
+        self._add_rule(('%s = %s' % (name, value)).rstrip())
+
+    def _add_ninja_rule(self, name, command, description, **kwargs):
+        """Add a ninja rule, the other variables of the rule, such as
+        depfile, are passed as keyword arguments.
+
+        """
+        self._add_rule('rule %s' % name)
+        self._add_rule('  command = %s' % command)
+        if not getattr(self.options, 'verbose', False):
+            self._add_rule('  description = %s' % description)
+        for key in sorted(kwargs):
+            self._add_rule('  %s = %s' % (key, kwargs[key]))
+        self._add_rule('')
+
+    def _get_link_jobs(self):
+        """The number of the linking jobs run simultaneously, linking takes
+        much more memory than compiling.
+
+        """
+        link_config = configparse.blade_config.get_config('link_config')
+        link_jobs = link_config.get('link_jobs', 0)
+        if link_jobs <= 0:
+            link_jobs = max(1, cpu_count() / 2)
+        return link_jobs
+
+    def generate_variables(self):
+        """Generates the toolchain and flags variables. """
+        self._add_rule('# This file was generated by blade')
+        self._add_variable('ninja_required_version', '1.3')
+        self._add_variable('builddir', self.build_dir)
+        self._add_rule('')
+
+        cc_str, cxx_str, ld_str = self._get_toolchain()
+        if self.build_environment.ccache_installed:
+            ccache_env = 'CCACHE_BASEDIR=%s' % (
+                    self.build_environment.blade_root_dir)
+            cc_str = '%s %s' % (ccache_env, cc_str)
+            cxx_str = '%s %s' % (ccache_env, cxx_str)
+        if (self.distcc_enabled and
+            self.build_environment.distcc_env_prepared):
+            distcc_env = 'DISTCC_HOSTS="%s"' % (
+                    self.build_environment.distcc_host_list)
+            cc_str = '%s %s' % (distcc_env, cc_str)
+            cxx_str = '%s %s' % (distcc_env, cxx_str)
+        self._add_variable('cc', cc_str)
+        self._add_variable('cxx', cxx_str)
+        self._add_variable('ld', ld_str)
+
+        cc_config = configparse.blade_config.get_config('cc_config')
+        (cppflags_except_warning,
+         linkflags) = self.ccflags_manager.get_flags_except_warning()
+        (warnings,
+         cxx_warnings,
+         c_warnings) = self.ccflags_manager.get_warning_flags()
+        self._add_variable('cppflags',
+                           cc_config['cppflags'] + cppflags_except_warning)
+        self._add_variable('cflags', cc_config['cflags'])
+        self._add_variable('cxxflags', cc_config['cxxflags'])
+        self._add_variable('warnings', warnings)
+        self._add_variable('c_warnings', c_warnings)
+        self._add_variable('cxx_warnings', cxx_warnings)
+        incs = cc_config['extra_incs'] + ['.', self.build_dir,
+                                          self.python_inc]
+        self._add_variable('includes', ['-I%s' % inc for inc in incs if inc])
+        self._add_variable('linkflags', linkflags)
+
+        proto_config = configparse.blade_config.get_config(
+                'proto_library_config')
+        self._add_variable('protoc', proto_config['protoc'])
+        self._add_variable('protobuf_incs', ['-I%s' % inc for inc in
+                                             proto_config['protobuf_incs']])
+        self._add_rule('')
+
+    def generate_rules(self):
+        """Generates the rules. """
+        # The linking actions are run in it
+        self._add_rule('pool link_pool')
+        self._add_rule('  depth = %d' % self._get_link_jobs())
+        self._add_rule('')
+
+        # The header dependencies are written into the depfiles by gcc,
+        # and kept in .ninja_deps by ninja
+        self._add_ninja_rule(
+                'cc',
+                '$cc -o $out -MMD -MF $out.d -c $cflags -fPIC $cppflags '
+                '$includes $in',
+                'Compiling $in',
+                depfile='$out.d', deps='gcc')
+        self._add_ninja_rule(
+                'cxx',
+                '$cxx -o $out -MMD -MF $out.d -c $cxxflags -fPIC $cppflags '
+                '$includes $in',
+                'Compiling $in',
+                depfile='$out.d', deps='gcc')
+        self._add_ninja_rule(
+                'ar',
+                'rm -f $out && ar rcs $out $in',
+                'Creating Static Library $out')
+        self._add_ninja_rule(
+                'link',
+                '$ld -o $out $linkflags $in $libs',
+                'Linking Program $out')
+        self._add_ninja_rule(
+                'solink',
+                '$ld -o $out -shared $linkflags $in $libs',
+                'Linking Shared Library $out')
+        self._add_ninja_rule(
+                'copy',
+                'cp -f $in $out',
+                'Copying $in')
+
+        # The generated files may be unchanged after the commands are run,
+        # restat stops rebuilding the targets depending on them then
+        self._add_ninja_rule(
+                'proto',
+                '$protoc --proto_path=. -I. $protobuf_incs -I=`dirname $in` '
+                '--cpp_out=%s $in' % self.build_dir,
+                'Compiling $in to cc source',
+                restat='1')
+        self._add_ninja_rule(
+                'gen_rule',
+                '$cmd',
+                'Generating $out',
+                restat='1')
+        self._add_ninja_rule(
+                'resource_header',
+                'PYTHONPATH=%s %s -m ninja_helper resource_header '
+                '$out $in' % (self.blade_path, sys.executable),
+                'Generating resource header $out',
+                restat='1')
+        self._add_ninja_rule(
+                'resource_file',
+                'xxd -i $in | sed "s/unsigned char /const char RESOURCE_/g"'
+                ' > $out',
+                'Compiling $in as resource file',
+                restat='1')
+
+        # The gen_rule targets without srcs depend on it to be always run
+        self._add_rule('build always: phony')
+        self._add_rule('')
+
+    def generate_version_file(self):
+        """Generate version information files. """
+        self._write_version_file()
+        action = Action('version',
+                        [os.path.join(self.build_dir, 'version.o')],
+                        'cxx',
+                        [os.path.join(self.build_dir, 'version.cpp')],
+                        env=[('cppflags', '-m%s' % self.options.m),
+                             ('cxxflags', ''),
+                             ('includes', '')],
+                        resource_class='compile')
+        for line in ninja_build_statement(action):
+            self._add_rule(line)
+        self._add_rule('')
+
+    def generate(self, blade_path):
+        """Generates all rules. """
+        self.generate_variables()
+        self.generate_rules()
+        self.generate_version_file()
+        return self.rules_buf
+
+
+class NinjaRulesGenerator(object):
+    """The main class to generate build.ninja. """
+    def __init__(self, ninja_path, blade_path, blade):
+        """Init method. """
+        self.ninja_path = ninja_path
+        self.blade_path = blade_path
+        self.blade = blade
+        self.scons_platform = self.blade.get_scons_platform()
+
+        build_dir = self.blade.get_build_path()
+        self.ninja_file_header_generator = NinjaFileHeaderGenerator(
+                self.blade.get_options(),
+                build_dir,
+                self.scons_platform.get_gcc_version(),
+                self.scons_platform.get_python_include(),
+                self.blade.build_environment,
+                self.blade.svn_root_dirs,
+                blade_path)
+        try:
+            os.remove('blade-bin')
+        except os.error:
+            pass
+        os.symlink(os.path.abspath(build_dir), 'blade-bin')
+
+    def generate_ninja_script(self):
+        """Generates build.ninja. """
+        rules_buf = self.ninja_file_header_generator.generate(self.blade_path)
+        action_graph = ActionGraph()
+        action_graph.add_actions(self.blade.gen_targets_rules())
+        for action in action_graph.actions:
+            rules_buf += ['%s\n' % line
+                          for line in ninja_build_statement(action)]
+
+        # Write to build.ninja only if it is changed, so its mtime is kept
+        content = ''.join(rules_buf)
+        if os.path.isfile(self.ninja_path):
+            ninja_file = open(self.ninja_path)
+            try:
+                if ninja_file.read() == content:
+                    return rules_buf
+            finally:
+                ninja_file.close()
+        ninja_file = open(self.ninja_path, 'w')
+        ninja_file.write(content)
+        ninja_file.close()
+        return rules_buf
@@ -0,0 +1,379 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the query engine module which parses the query expressions of
+ blade query and evaluates them over the dependency graph.
+
+ Expressions:
+    //path:name, path:name, :name    a target
+    //path, //path:*                 all targets in the dir
+    //path/...                       all targets in the dir and its subdirs
+    deps(x [, depth])                x and the targets x depends on
+    rdeps(u, x [, depth])            x and the targets in deps(u) depending on x
+    somepath(x, y)                   a dependency path from x to y
+    allpaths(x, y)                   all of the dependency paths from x to y
+    kind(regex, x)                   the targets in x whose type matches regex
+    filter(regex, x)                 the targets in x whose label matches regex
+    x + y, x union y                 union
+    x ^ y, x intersect y             intersection
+    x - y, x except y                difference
+
+ Binary operators are of equal precedence and left associative, use
+ parentheses to group.
+
+"""
+
+
+import os
+import re
+
+import console
+
+
+_OPERATORS = {
+    '+': 'union',
+    'union': 'union',
+    '^': 'intersect',
+    'intersect': 'intersect',
+    '-': 'except',
+    'except': 'except',
+}
+
+
+# {function name : argument kinds}, 'expr' is an expression, 'word' is a
+# plain word such as a regex, 'int' is an optional depth
+_FUNCTIONS = {
+    'deps': ('expr', 'int'),
+    'rdeps': ('expr', 'expr', 'int'),
+    'somepath': ('expr', 'expr'),
+    'allpaths': ('expr', 'expr'),
+    'kind': ('word', 'expr'),
+    'filter': ('word', 'expr'),
+}
+
+
+def _query_error(message, expression):
+    console.error_exit('query error: %s in "%s"' % (message, expression))
+
+
+def _tokenize(expression):
+    """Split the expression into words and punctuations '(', ')', ','. """
+    tokens = []
+    i = 0
+    n = len(expression)
+    while i < n:
+        c = expression[i]
+        if c.isspace():
+            i += 1
+        elif c in '(),':
+            tokens.append(c)
+            i += 1
+        elif c in '\'"':
+            end = expression.find(c, i + 1)
+            if end == -1:
+                _query_error('unclosed quotation', expression)
+            # Quoted words are never operators, keep the quotation to
+            # tell them apart
+            tokens.append(expression[i:end + 1])
+            i = end + 1
+        else:
+            start = i
+            while (i < n and not expression[i].isspace() and
+                   expression[i] not in '(),\'"'):
+                i += 1
+            tokens.append(expression[start:i])
+    return tokens
+
+
+def _unquote(word):
+    if word[:1] in ('\'', '"'):
+        return word[1:-1]
+    return word
+
+
+class QueryGraph(object):
+    """QueryGraph.
+
+    The indexed dependency graph of the loaded targets.  Targets are
+    interned to sorted integers, so the results of the expressions are
+    frozensets of integers and the set operators are cheap.
+
+    targets: {key : target} of the loaded targets.
+    direct_deps: {key : [dep key]}, the direct deps including the implicit
+        ones, such as protobuf for proto_library.
+
+    """
+    def __init__(self, targets, direct_deps):
+        self.keys = sorted(targets)
+        self.index = dict((key, i) for i, key in enumerate(self.keys))
+        self.types = [targets[key].type for key in self.keys]
+        self.deps = []
+        self.rdeps = [[] for key in self.keys]
+        for i, key in enumerate(self.keys):
+            deps = [self.index[dkey] for dkey in direct_deps[key]
+                    if dkey in self.index]
+            self.deps.append(deps)
+            for d in deps:
+                self.rdeps[d].append(i)
+
+    def get_keys(self, result):
+        """Returns the sorted keys of the targets in the result. """
+        return [self.keys[i] for i in sorted(result)]
+
+    def match(self, path, name):
+        """Returns the targets matching the target pattern. """
+        if name is not None and name != '*':
+            i = self.index.get((path, name))
+            if i is None:
+                return frozenset()
+            return frozenset([i])
+        if name == '*':
+            return frozenset(i for i, key in enumerate(self.keys)
+                             if key[0] == path)
+        # Recursive, system libraries are never under any dir
+        prefix = path + '/'
+        return frozenset(i for i, key in enumerate(self.keys)
+                         if key[0] != '#' and
+                         (path == '.' or key[0] == path or
+                          key[0].startswith(prefix)))
+
+    @staticmethod
+    def _closure(start, edges, depth=None, universe=None):
+        """The targets reachable from start along edges in depth steps. """
+        result = set(start)
+        frontier = list(start)
+        level = 0
+        while frontier and (depth is None or level < depth):
+            next_frontier = []
+            for i in frontier:
+                for j in edges[i]:
+                    if j not in result and (universe is None or
+                                            j in universe):
+                        result.add(j)
+                        next_frontier.append(j)
+            frontier = next_frontier
+            level += 1
+        return frozenset(result)
+
+    def get_deps(self, start, depth=None):
+        return self._closure(start, self.deps, depth)
+
+    def get_rdeps(self, universe, start, depth=None):
+        universe = self.get_deps(universe)
+        return self._closure(start & universe, self.rdeps, depth, universe)
+
+    def get_somepath(self, start, end):
+        """Returns the targets on a shortest path from start to end. """
+        parents = dict((i, None) for i in start)
+        frontier = sorted(start)
+        while frontier:
+            next_frontier = []
+            for i in frontier:
+                if i in end:
+                    path = []
+                    while i is not None:
+                        path.append(i)
+                        i = parents[i]
+                    return frozenset(path)
+                for j in self.deps[i]:
+                    if j not in parents:
+                        parents[j] = i
+                        next_frontier.append(j)
+            frontier = next_frontier
+        return frozenset()
+
+    def get_allpaths(self, start, end):
+        forward = self.get_deps(start)
+        return forward & self._closure(end & forward, self.rdeps,
+                                       universe=forward)
+
+    def get_kind(self, pattern, targets):
+        regex = re.compile(pattern)
+        return frozenset(i for i in targets if regex.search(self.types[i]))
+
+    def get_filter(self, pattern, targets):
+        regex = re.compile(pattern)
+        return frozenset(i for i in targets
+                         if regex.search('//%s:%s' % self.keys[i]))
+
+
+class _TargetPattern(object):
+    """A target pattern, path is relative to BLADE_ROOT, name is None for
+    path/... and '*' for all targets in the dir.
+
+    """
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+
+    def target_patterns(self):
+        if self.name is None:
+            if self.path == '.':
+                return ['...']
+            return ['%s/...' % self.path]
+        return ['%s:%s' % (self.path, self.name)]
+
+    def evaluate(self, graph):
+        return graph.match(self.path, self.name)
+
+
+class _FunctionCall(object):
+    """A query function call, such as deps(x). """
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def target_patterns(self):
+        patterns = []
+        for arg in self.args:
+            if hasattr(arg, 'target_patterns'):
+                patterns += arg.target_patterns()
+        return patterns
+
+    def evaluate(self, graph):
+        args = [arg.evaluate(graph) if hasattr(arg, 'evaluate') else arg
+                for arg in self.args]
+        return getattr(graph, 'get_' + self.name)(*args)
+
+
+class _BinaryOperation(object):
+    """The set operation of two expressions. """
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def target_patterns(self):
+        return self.left.target_patterns() + self.right.target_patterns()
+
+    def evaluate(self, graph):
+        left = self.left.evaluate(graph)
+        right = self.right.evaluate(graph)
+        if self.operator == 'union':
+            return left | right
+        if self.operator == 'intersect':
+            return left & right
+        return left - right
+
+
+class QueryExpression(object):
+    """QueryExpression.
+
+    The parsed query expression.  The target paths are resolved against
+    the working dir, which is relative to BLADE_ROOT.
+
+    """
+    def __init__(self, expression, working_dir):
+        self.expression = expression
+        self.working_dir = working_dir
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        if not self.tokens:
+            _query_error('empty expression', expression)
+        self.root = self._parse_expression()
+        if self.pos != len(self.tokens):
+            self._error('unexpected "%s"' % self.tokens[self.pos])
+
+    def _error(self, message):
+        _query_error(message, self.expression)
+
+    def _peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            self._error('unexpected end of expression')
+        self.pos += 1
+        return token
+
+    def _expect(self, expected):
+        token = self._next()
+        if token != expected:
+            self._error('expect "%s" but got "%s"' % (expected, token))
+
+    def _parse_expression(self):
+        expression = self._parse_primary()
+        while self._peek() in _OPERATORS:
+            operator = _OPERATORS[self._next()]
+            expression = _BinaryOperation(operator, expression,
+                                          self._parse_primary())
+        return expression
+
+    def _parse_primary(self):
+        token = self._next()
+        if token == '(':
+            expression = self._parse_expression()
+            self._expect(')')
+            return expression
+        if token in (')', ',') or token in _OPERATORS:
+            self._error('unexpected "%s"' % token)
+        if self._peek() == '(' and token in _FUNCTIONS:
+            self.pos += 1
+            return self._parse_function(token)
+        return self._parse_target_pattern(_unquote(token))
+
+    def _parse_function(self, name):
+        args = []
+        kinds = _FUNCTIONS[name]
+        for i, kind in enumerate(kinds):
+            if kind == 'int':
+                if self._peek() != ',':
+                    args.append(None)
+                    break
+                self.pos += 1
+                depth = _unquote(self._next())
+                if not depth.isdigit():
+                    self._error('depth of %s must be an integer' % name)
+                args.append(int(depth))
+                continue
+            if i > 0:
+                self._expect(',')
+            if kind == 'word':
+                args.append(_unquote(self._next()))
+            else:
+                args.append(self._parse_expression())
+        self._expect(')')
+        return _FunctionCall(name, args)
+
+    def _parse_target_pattern(self, word):
+        if word.startswith('//'):
+            path = word[2:]
+            working_dir = '.'
+        else:
+            path = word
+            working_dir = self.working_dir
+        if ':' in path:
+            path, name = path.rsplit(':', 1)
+            if not name:
+                name = '*'
+        elif path == '...' or path.endswith('/...'):
+            path, name = path[:-3], None
+        else:
+            name = '*'
+        path = os.path.normpath(os.path.join(working_dir, path))
+        if path.startswith('..'):
+            self._error('"%s" is out of BLADE_ROOT' % word)
+        return _TargetPattern(path, name)
+
+    def target_patterns(self):
+        """The target patterns to be loaded, relative to BLADE_ROOT. """
+        patterns = []
+        for pattern in self.root.target_patterns():
+            if pattern not in patterns:
+                patterns.append(pattern)
+        return patterns
+
+    def evaluate(self, targets, direct_deps):
+        """Evaluate the expression over the targets, returns the sorted
+        keys of the result.
+
+        """
+        graph = QueryGraph(targets, direct_deps)
+        return graph.get_keys(self.root.evaluate(graph))
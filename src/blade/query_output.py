@@ -0,0 +1,218 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the query output module which writes the targets of the query
+ result with their dependency edges in various formats.
+
+ Every target is written as a row as soon as its edges are computed, so
+ the output of large graphs is streamed rather than built in memory.
+
+"""
+
+
+import json
+
+
+# The formats of the query output
+OUTPUT_FORMATS = ('text', 'jsonl', 'binary', 'dot')
+
+
+# The magic of the binary format
+BINARY_MAGIC = 'BLQ\x01'
+
+
+def _label(key):
+    return '//%s:%s' % key
+
+
+class _TextWriter(object):
+    """One target label per line. """
+    def __init__(self, output):
+        self.output = output
+
+    def begin(self, keys):
+        pass
+
+    def write_target(self, key, target_type, deps):
+        self.output.write(_label(key) + '\n')
+
+    def end(self):
+        pass
+
+
+class _JsonLinesWriter(object):
+    """One JSON object per line:
+    {"target": "//path:name", "type": "cc_library", "deps": [...]}
+
+    """
+    def __init__(self, output):
+        self.output = output
+
+    def begin(self, keys):
+        pass
+
+    def write_target(self, key, target_type, deps):
+        self.output.write(json.dumps({'target': _label(key),
+                                      'type': target_type,
+                                      'deps': [_label(d) for d in deps]},
+                                     sort_keys=True))
+        self.output.write('\n')
+
+    def end(self):
+        pass
+
+
+def _varint(value):
+    """Encode the unsigned integer as a protobuf varint. """
+    result = []
+    while value >= 0x80:
+        result.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    result.append(chr(value))
+    return ''.join(result)
+
+
+def _string(value):
+    """Encode the string as a varint length and utf-8 bytes. """
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return _varint(len(value)) + value
+
+
+class _BinaryWriter(object):
+    """The compact binary edge list, in the protobuf wire style.
+
+    The output begins with BINARY_MAGIC and the varint count of targets,
+    then a record for each target: the varint count of its deps, its
+    label and type as length prefixed strings, and the varint ids of its
+    deps.  The id of a target is the index of its record, so a dep could
+    refer to a target whose record comes later.
+
+    """
+    def __init__(self, output):
+        self.output = output
+        self.ids = {}
+
+    def begin(self, keys):
+        self.ids = dict((key, i) for i, key in enumerate(keys))
+        self.output.write(BINARY_MAGIC + _varint(len(keys)))
+
+    def write_target(self, key, target_type, deps):
+        record = [_varint(len(deps)), _string(_label(key)),
+                  _string(target_type)]
+        record += [_varint(self.ids[d]) for d in deps]
+        self.output.write(''.join(record))
+
+    def end(self):
+        pass
+
+
+class _DotWriter(object):
+    """The graphviz dot format, the targets are clustered by package.
+
+    The targets come sorted, so the targets of a package are contiguous
+    and every package is written as a cluster once its last target is
+    seen.  The edges are written outside the clusters, otherwise dot
+    would put the targets of other packages into the current cluster.
+
+    """
+    def __init__(self, output):
+        self.output = output
+        self.package = None
+        self.edges = []
+        self.clusters = 0
+
+    def begin(self, keys):
+        self.output.write('digraph blade {\n')
+        self.output.write('  node [shape=box];\n')
+
+    def _end_package(self):
+        if self.package is None:
+            return
+        self.output.write('  }\n')
+        for edge in self.edges:
+            self.output.write('  "%s" -> "%s";\n' % edge)
+        self.package = None
+        self.edges = []
+
+    def write_target(self, key, target_type, deps):
+        if key[0] != self.package:
+            self._end_package()
+            self.package = key[0]
+            self.clusters += 1
+            self.output.write('  subgraph cluster_%d {\n' % self.clusters)
+            self.output.write('    label = "//%s";\n' % key[0])
+        label = _label(key)
+        self.output.write('    "%s" [label = "%s"];\n' % (label, key[1]))
+        for d in deps:
+            self.edges.append((label, _label(d)))
+
+    def end(self):
+        self._end_package()
+        self.output.write('}\n')
+
+
+_WRITERS = {
+    'text': _TextWriter,
+    'jsonl': _JsonLinesWriter,
+    'binary': _BinaryWriter,
+    'dot': _DotWriter,
+}
+
+
+class _TransitiveReducer(object):
+    """Remove the edges implied by other edges.
+
+    The edge a -> c is removed if there is another edge a -> b, c is in
+    the expanded deps of b.
+
+    """
+    def __init__(self, targets):
+        self.targets = targets
+        self.expanded_deps = {}
+
+    def _get_expanded_deps(self, key):
+        expanded_deps = self.expanded_deps.get(key)
+        if expanded_deps is None:
+            expanded_deps = frozenset(self.targets[key].expanded_deps)
+            self.expanded_deps[key] = expanded_deps
+        return expanded_deps
+
+    def reduce(self, deps):
+        if len(deps) < 2:
+            return deps
+        implied = set()
+        for d in deps:
+            implied.update(self._get_expanded_deps(d))
+        return [d for d in deps if d not in implied]
+
+
+def write_query_result(output, output_format, keys, targets, direct_deps,
+                       transitive_reduction=False):
+    """Write the query result.
+
+    output: the file to write to.
+    output_format: one of OUTPUT_FORMATS.
+    keys: the sorted keys of the targets in the result.
+    targets: {key : target}, the expanded targets.
+    direct_deps: {key : [dep key]}, only the edges between the targets in
+        the result are written.
+    transitive_reduction: whether to remove the edges implied by others.
+
+    """
+    writer = _WRITERS[output_format](output)
+    reducer = None
+    if transitive_reduction:
+        reducer = _TransitiveReducer(targets)
+    key_set = frozenset(keys)
+    writer.begin(keys)
+    for key in keys:
+        deps = [d for d in direct_deps.get(key, []) if d in key_set]
+        if reducer:
+            deps = reducer.reduce(deps)
+        writer.write_target(key, targets[key].type, deps)
+    writer.end()
@@ -0,0 +1,95 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the reverse deps index module which keeps the direct deps of
+ the targets in all BUILD files of the workspace on disk, so the targets
+ depending on a target can be found without loading the whole tree.
+
+"""
+
+
+import configparse
+from blade_util import canonical
+from blade_util import load_cache_file
+from blade_util import md5sum_str
+from blade_util import save_cache_file
+
+
+# Increase it when the format of the index file changes
+_INDEX_VERSION = 1
+
+
+def _config_fingerprint():
+    """The implicit deps of targets depend on the blade config. """
+    return md5sum_str(repr(canonical(configparse.blade_config.configs)))
+
+
+class ReverseDepsIndex(object):
+    """ReverseDepsIndex.
+
+    For every BUILD file, the index holds its mtime, the md5sum of its
+    content and the direct deps of the targets defined in it, including
+    the implicit ones.  The entries of changed BUILD files are updated
+    incrementally, the whole index is dropped if the blade config is
+    changed.
+
+    """
+    def __init__(self, index_file):
+        self.index_file = index_file
+        # {build_file : (mtime, md5, {key : [dep key]})}
+        self.entries = {}
+        self.dirty = False
+        self.fingerprint = _config_fingerprint()
+
+        data = load_cache_file(index_file)
+        if (data and data.get('version') == _INDEX_VERSION and
+                data.get('fingerprint') == self.fingerprint):
+            self.entries = data['entries']
+
+    def get_entry(self, build_file):
+        """Returns (mtime, md5, {key : [dep key]}) of build_file or None. """
+        return self.entries.get(build_file)
+
+    def update(self, build_file, mtime, content_md5, deps):
+        """Update the entry of build_file. """
+        self.entries[build_file] = (mtime, content_md5, deps)
+        self.dirty = True
+
+    def retain(self, build_files):
+        """Remove the entries of the BUILD files not in build_files. """
+        for build_file in self.entries.keys():
+            if build_file not in build_files:
+                del self.entries[build_file]
+                self.dirty = True
+
+    def find_dependers(self, keys):
+        """Returns the set of targets depending on any of keys directly or
+        indirectly.
+
+        """
+        depended_by = {}
+        for entry in self.entries.itervalues():
+            for key, deps in entry[2].iteritems():
+                for dkey in deps:
+                    depended_by.setdefault(dkey, []).append(key)
+        dependers = set()
+        stack = list(keys)
+        while stack:
+            for key in depended_by.get(stack.pop(), []):
+                if key not in dependers:
+                    dependers.add(key)
+                    stack.append(key)
+        return dependers
+
+    def save(self):
+        """Write the index back to disk if it has been changed. """
+        if not self.dirty:
+            return
+        save_cache_file(self.index_file, {'version': _INDEX_VERSION,
+                                          'fingerprint': self.fingerprint,
+                                          'entries': self.entries})
+        self.dirty = False
@@ -0,0 +1,214 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the rules fragment cache module which keeps the scons rules
+ generated by every target on disk, so the rules of the unchanged targets
+ are reused without calling scons_rules again.
+
+"""
+
+
+import os
+
+import configparse
+from blade_util import canonical
+from blade_util import load_cache_file
+from blade_util import md5sum_str
+from blade_util import save_cache_file
+
+
+# Increase it when the format of the cache file changes
+_CACHE_VERSION = 3
+
+
+# The options which are read by the targets when generating rules
+_RULES_OPTIONS = ('m', 'profile', 'generate_dynamic', 'generate_java',
+                  'generate_php', 'generate_python')
+
+
+# The attributes of the target covered by the fingerprint, the ones set
+# when generating rules, such as the var_name of gen_rule, are read by the
+# targets depending on it
+_FINGERPRINT_ATTRIBUTES = ('key', 'type', 'srcs', 'deps', 'expanded_deps',
+                           'data', 'var_name', 'file_and_link', 'shared_env')
+
+
+# The rules of these targets depend on the existence of files in the
+# source tree or build dir, such as the jar files or the included swig
+# files, they are always generated
+_UNCACHED_TYPES = frozenset(['java_jar', 'py_binary', 'swig_library'])
+
+
+# The rules of these targets depend on the content of their srcs, such as
+# the java package declared in the proto file
+_CONTENT_DEPENDENT_TYPES = frozenset(['proto_library', 'thrift_library'])
+
+
+# The attributes of the targets holding the rules of every backend
+_BACKEND_RULES_ATTRIBUTES = {
+    'scons': 'scons_rule_buf',
+    'ninja': 'actions',
+}
+
+
+def set_target_rules(target, rules, backend):
+    """Put the rules generated elsewhere into the target, as if they were
+    generated by it, such as by a worker process or from the cache.
+
+    """
+    setattr(target, _BACKEND_RULES_ATTRIBUTES[backend], list(rules))
+
+
+def get_shared_object_ids(blade):
+    """The ids of the objects shared by all targets, such as the blade
+    manager and the target database.
+
+    """
+    return frozenset(id(o) for o in (blade,
+                                     blade.get_options(),
+                                     blade.get_direct_targets(),
+                                     blade.get_build_targets(),
+                                     blade.get_target_database()))
+
+
+def get_target_attributes(target, shared_object_ids):
+    """The attributes of the target, except the rules buffer, the actions
+    and the references to the shared objects.
+
+    """
+    return dict((name, value) for name, value in target.__dict__.iteritems()
+                if name not in ('scons_rule_buf', 'actions') and
+                id(value) not in shared_object_ids)
+
+
+def _file_md5(path):
+    try:
+        f = open(path)
+        try:
+            return md5sum_str(f.read())
+        finally:
+            f.close()
+    except IOError:
+        return None
+
+
+class RulesFragmentCache(object):
+    """RulesFragmentCache.
+
+    The cache holds the rules of every target and its attributes after
+    the rules are generated.  The attributes are restored on cache hit,
+    because generating rules may set some of them, such as the data of
+    proto_library and the var_name of gen_rule, which are read by the
+    targets depending on it.
+
+    An entry is valid if the fingerprint of the target is unchanged, it
+    covers the attributes of the target and its expanded deps, the types
+    of the targets depending on it, the platform info required by its
+    type, the blade config and the options affecting the rules.
+
+    """
+    def __init__(self, cache_file, blade, backend='scons'):
+        self.cache_file = cache_file
+        self.blade = blade
+        self.backend = backend
+        # {key : (fingerprint, rules, attributes)}
+        self.entries = {}
+        self.dirty = False
+        # The fingerprints of the targets being generated
+        self.fingerprints = {}
+        # The md5 of the attributes of the generated targets
+        self.states = {}
+        self.shared_object_ids = get_shared_object_ids(blade)
+        self.direct_targets = frozenset(blade.get_direct_targets())
+        self.platform = blade.get_scons_platform()
+        # {target type : platform info required}
+        self.platform_info = {}
+
+        options = blade.get_options()
+        self.global_fingerprint = md5sum_str(repr(canonical([
+                configparse.blade_config.configs,
+                blade.get_build_path(),
+                [getattr(options, o, None) for o in _RULES_OPTIONS]])))
+
+        data = load_cache_file(cache_file)
+        if (data and data.get('version') == _CACHE_VERSION and
+                data.get('fingerprint') == self.global_fingerprint):
+            self.entries = data['entries']
+
+    def _get_platform_info(self, target_type):
+        info = self.platform_info.get(target_type)
+        if info is None:
+            info = self.platform.get_info(
+                    self.platform.get_required_info([target_type]))
+            self.platform_info[target_type] = info
+        return info
+
+    def _get_state(self, target):
+        """The md5 of the attributes of the target. """
+        attributes = dict((name, getattr(target, name, None))
+                          for name in _FINGERPRINT_ATTRIBUTES)
+        attributes['platform_info'] = self._get_platform_info(target.type)
+        if target.type in _CONTENT_DEPENDENT_TYPES:
+            attributes['srcs_md5'] = [
+                    _file_md5(os.path.join(target.path, src))
+                    for src in target.srcs]
+        attributes['depended_by_types'] = sorted(set(
+                self.blade.get_target_database()[k].type
+                for k in self.blade.get_depended_by(target.key)))
+        attributes['is_direct_target'] = target.key in self.direct_targets
+        return md5sum_str(repr(canonical(attributes)))
+
+    def _get_dep_state(self, key):
+        """The md5 of the attributes of a dep, whose rules have been
+        generated, so the attributes set by the generation are included.
+
+        """
+        state = self.states.get(key)
+        if state is None:
+            state = self._get_state(self.blade.get_target_database()[key])
+            self.states[key] = state
+        return state
+
+    def get_rules(self, target):
+        """Returns the cached rules of the target and restores its
+        attributes, or None if the target should be generated.  The rules
+        of the deps of the target must have been generated.
+
+        """
+        if target.type in _UNCACHED_TYPES:
+            return None
+        fingerprint = md5sum_str(repr([
+                self._get_state(target),
+                [(dkey, self._get_dep_state(dkey))
+                 for dkey in target.expanded_deps]]))
+        self.fingerprints[target.key] = fingerprint
+        entry = self.entries.get(target.key)
+        if entry is None or entry[0] != fingerprint:
+            return None
+        target.__dict__.update(entry[2])
+        set_target_rules(target, entry[1], self.backend)
+        return entry[1]
+
+    def update(self, target, rules):
+        """Update the entry of the target whose rules are generated. """
+        fingerprint = self.fingerprints.get(target.key)
+        if fingerprint is None:
+            return
+        self.entries[target.key] = (
+                fingerprint, rules,
+                get_target_attributes(target, self.shared_object_ids))
+        self.dirty = True
+
+    def save(self):
+        """Write the cache back to disk if it has been changed. """
+        if not self.dirty:
+            return
+        save_cache_file(self.cache_file,
+                        {'version': _CACHE_VERSION,
+                         'fingerprint': self.global_fingerprint,
+                         'entries': self.entries})
+        self.dirty = False
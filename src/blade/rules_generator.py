@@ -15,16 +15,50 @@
 """
 
 
+import copy
 import os
 import socket
 import subprocess
 import string
+import sys
 import time
+from cStringIO import StringIO
 
 import configparse
 import console
 
 from blade_platform import CcFlagsManager
+from blade_util import get_blade_cache_file
+from blade_util import load_cache_file
+from blade_util import md5sum_str
+from blade_util import save_cache_file
+from rules_fragment_cache import get_shared_object_ids
+from rules_fragment_cache import get_target_attributes
+from rules_fragment_cache import set_target_rules
+
+
+def _svn_signature(root_dir):
+    """The mtime and size of the svn administrative files of the working
+    copy, they are changed when the working copy is updated.
+
+    """
+    signature = []
+    for name in ('entries', 'wc.db'):
+        path = os.path.join(root_dir, '.svn', name)
+        try:
+            st = os.stat(path)
+            signature.append((name, st.st_mtime, st.st_size))
+        except OSError:
+            pass
+    return signature
+
+
+def _get_build_time_line(version_cpp_content):
+    """Returns the line of kBuildTime in the content of version.cpp. """
+    for line in version_cpp_content.splitlines():
+        if line.startswith('extern const char kBuildTime[]'):
+            return line
+    return ''
 
 
 def _incs_list_to_string(incs):
@@ -34,18 +68,171 @@ def _incs_list_to_string(incs):
     return ' '.join(['-I ' + path for path in incs])
 
 
+# The methods of the targets generating the rules of every backend and
+# returning the rules generated, the scons rules are the lines of the
+# SConstruct, and the ninja rules are the actions of the action graph
+_BACKEND_RULES_METHODS = {
+    'scons': ('scons_rules', 'get_rules'),
+    'ninja': ('ninja_rules', 'get_actions'),
+}
+
+
+def generate_target_rules(target, backend):
+    """Generate the rules of the target for the backend and return them. """
+    generate_method, get_method = _BACKEND_RULES_METHODS[backend]
+    getattr(target, generate_method)()
+    return getattr(target, get_method)()
+
+
+# The targets whose rules are generated by the worker processes, the
+# ids of the objects shared by the targets, such as the blade manager, and
+# the backend.  They are set before the workers are forked, so every
+# worker has a snapshot of the analyzed targets
+_generating_targets = {}
+_shared_object_ids = frozenset()
+_backend = 'scons'
+
+
+def _generate_rules_in_worker(task):
+    """Generate the rules of a shard of targets in a worker process.
+
+    The attributes of the deps changed by generating their rules in other
+    workers are applied to the snapshot first, because targets read them
+    when generating their own rules, such as java_jar reads the data set
+    by proto_library and swig_library, and any target reads the var_name
+    of the gen_rule it depends on.
+
+    Returns [(key, rules, changed attributes, messages)], or None if any
+    target fails, then the parent process generates it again to report
+    the error.
+
+    """
+    keys, deps_attributes = task
+    targets = _generating_targets
+    stderr = sys.stderr
+    results = []
+    try:
+        for dkey, attributes in deps_attributes.iteritems():
+            targets[dkey].__dict__.update(attributes)
+        for key in keys:
+            target = targets[key]
+            sys.stderr = StringIO()
+            attributes = copy.deepcopy(
+                    get_target_attributes(target, _shared_object_ids))
+            rules = generate_target_rules(target, _backend)
+            changed_attributes = dict(
+                    (name, value)
+                    for name, value in get_target_attributes(
+                            target, _shared_object_ids).iteritems()
+                    if name not in attributes or attributes[name] != value)
+            results.append((key, rules, changed_attributes,
+                            sys.stderr.getvalue()))
+    except:
+        return None
+    finally:
+        sys.stderr = stderr
+    return results
+
+
+def generate_targets_rules_in_parallel(keys, blade, jobs,
+                                       fragment_cache=None,
+                                       backend='scons'):
+    """Generate the rules of the targets by a process pool.
+
+    The targets are generated level by level, since the rules of a target
+    depend on the attributes of its deps, which may be changed by their
+    rules generation, and the targets of a level are sharded across the
+    workers.  The changed attributes of the generated targets are put back
+    into the targets of the blade process.  The targets whose rules are
+    in the fragment cache are not generated.
+
+    Returns {key : rules} of the generated targets.  If any target fails,
+    the generation stops before its level, the remaining targets are left
+    to be generated serially.
+
+    """
+    try:
+        import multiprocessing
+    except ImportError:
+        console.warning('multiprocessing is not available, '
+                        'generate rules serially')
+        return {}
+
+    global _generating_targets, _shared_object_ids, _backend
+    targets = blade.get_target_database()
+    _generating_targets = targets
+    _shared_object_ids = get_shared_object_ids(blade)
+    _backend = backend
+    key_set = frozenset(keys)
+    changed_attributes = {}
+    targets_rules = {}
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for level in blade.get_target_levels().levels:
+            level_keys = []
+            for key in level:
+                if key not in key_set:
+                    continue
+                rules = None
+                if fragment_cache:
+                    rules = fragment_cache.get_rules(targets[key])
+                if rules is None:
+                    level_keys.append(key)
+                    continue
+                # The workers have the attributes before generating rules
+                targets_rules[key] = rules
+                changed_attributes[key] = get_target_attributes(
+                        targets[key], _shared_object_ids)
+            if not level_keys:
+                continue
+            tasks = []
+            for i in range(min(jobs, len(level_keys))):
+                shard = level_keys[i::jobs]
+                deps_attributes = {}
+                for key in shard:
+                    for dkey in targets[key].expanded_deps:
+                        if dkey in changed_attributes:
+                            deps_attributes[dkey] = changed_attributes[dkey]
+                tasks.append((shard, deps_attributes))
+            results = pool.map(_generate_rules_in_worker, tasks)
+            if None in results:
+                break
+            for shard_results in results:
+                for key, rules, attributes, messages in shard_results:
+                    targets_rules[key] = rules
+                    set_target_rules(targets[key], rules, backend)
+                    if attributes:
+                        targets[key].__dict__.update(attributes)
+                        changed_attributes[key] = attributes
+                    if fragment_cache:
+                        fragment_cache.update(targets[key], rules)
+                    sys.stderr.write(messages)
+    finally:
+        pool.close()
+        pool.join()
+        _generating_targets = {}
+        _shared_object_ids = frozenset()
+        _backend = 'scons'
+    return targets_rules
+
+
 class SconsFileHeaderGenerator(object):
     """SconsFileHeaderGenerator class"""
     def __init__(self, options, build_dir, gcc_version,
-                 python_inc, build_environment, svn_roots):
+                 python_inc, build_environment, svn_roots,
+                 action_timing_file='', build_nodes_file=''):
         """Init method. """
         self.rules_buf = []
         self.options = options
         self.build_dir = build_dir
+        self.action_timing_file = action_timing_file
+        self.build_nodes_file = build_nodes_file
         self.gcc_version = gcc_version
         self.python_inc = python_inc
         self.build_environment = build_environment
-        self.ccflags_manager = CcFlagsManager(options)
+        self.ccflags_manager = CcFlagsManager(
+                options, get_blade_cache_file(build_dir, 'cc_flags_probes'),
+                gcc_version)
         self.env_list = ['env_with_error', 'env_no_warning']
 
         self.svn_roots = svn_roots
@@ -79,10 +266,20 @@ version_obj = env_version.SharedObject('$filename')
             return building_var
 
     def _get_version_info(self):
-        """Gets svn root dir info. """
+        """Gets svn root dir info.
+
+        The svn commands are run in parallel, and their outputs are cached
+        until the working copies are updated.
+
+        """
+        cache_file = get_blade_cache_file(self.build_dir, 'svn_info')
+        # {root_dir : (signature, svn info)}
+        cache = load_cache_file(cache_file) or {}
+        new_cache = {}
+        lc_all_env = dict(os.environ)
+        lc_all_env['LC_ALL'] = 'POSIX'
+        processes = {}
         for root_dir in self.svn_roots:
-            lc_all_env = os.environ
-            lc_all_env['LC_ALL'] = 'POSIX'
             root_dir_realpath = os.path.realpath(root_dir)
             svn_working_dir = os.path.dirname(root_dir_realpath)
             svn_dir = os.path.basename(root_dir_realpath)
@@ -91,54 +288,89 @@ version_obj = env_version.SharedObject('$filename')
                 console.warning('"%s" is not under version control' % root_dir)
                 continue
 
+            signature = _svn_signature(root_dir)
+            cached = cache.get(root_dir)
+            if cached and cached[0] == signature:
+                new_cache[root_dir] = cached
+                continue
             p = subprocess.Popen('svn info %s' % svn_dir,
                                  env=lc_all_env,
                                  cwd='%s' % svn_working_dir,
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.PIPE,
                                  shell=True)
+            processes[root_dir] = (signature, p)
+
+        for root_dir, (signature, p) in processes.iteritems():
             std_out, std_err = p.communicate()
             if p.returncode:
                 console.warning('failed to get version control info in %s' % root_dir)
             else:
-                self.svn_info_map[root_dir] = std_out.replace('\n', '\\n\\\n')
+                new_cache[root_dir] = (signature, std_out)
 
-    def generate_version_file(self):
-        """Generate version information files. """
+        for root_dir, (signature, svn_info) in new_cache.iteritems():
+            self.svn_info_map[root_dir] = svn_info.replace('\n', '\\n\\\n')
+        if new_cache != cache:
+            save_cache_file(cache_file, new_cache)
+
+    def _write_version_file(self):
+        """Write the version information into version.cpp.
+
+        The file is not rewritten if nothing but the build time is
+        changed, so the version object and the binaries linking it are
+        not rebuilt, and kBuildTime is the time the version information
+        was changed.
+
+        """
         self._get_version_info()
         svn_info_len = len(self.svn_info_map)
 
         if not os.path.exists(self.build_dir):
             os.makedirs(self.build_dir)
-        version_cpp = open('%s/version.cpp' % self.build_dir, 'w')
-
-        print >>version_cpp, '/* This file was generated by blade */'
-        print >>version_cpp, 'extern "C" {'
-        print >>version_cpp, 'namespace binary_version {'
-        print >>version_cpp, 'extern const int kSvnInfoCount = %d;' % svn_info_len
 
         svn_info_array = '{'
+        svn_roots = sorted(self.svn_info_map.keys())
         for idx in range(svn_info_len):
-            key_with_idx = self.svn_info_map.keys()[idx]
+            key_with_idx = svn_roots[idx]
             svn_info_line = '"%s"' % self.svn_info_map[key_with_idx]
             svn_info_array += svn_info_line
             if idx != (svn_info_len - 1):
                 svn_info_array += ','
         svn_info_array += '}'
 
-        print >>version_cpp, 'extern const char* const kSvnInfo[%d] = %s;' % (
-                svn_info_len, svn_info_array)
-        print >>version_cpp, 'extern const char kBuildType[] = "%s";' % self.options.profile
-        print >>version_cpp, 'extern const char kBuildTime[] = "%s";' % time.asctime()
-        print >>version_cpp, 'extern const char kBuilderName[] = "%s";' % os.getenv('USER')
-        print >>version_cpp, (
-                'extern const char kHostName[] = "%s";' % socket.gethostname())
         compiler = 'GCC %s' % self.gcc_version
-        print >>version_cpp, 'extern const char kCompiler[] = "%s";' % compiler
-        print >>version_cpp, '}}'
-
+        build_time_line = 'extern const char kBuildTime[] = "%s";' % (
+                time.asctime())
+        lines = [
+            '/* This file was generated by blade */',
+            'extern "C" {',
+            'namespace binary_version {',
+            'extern const int kSvnInfoCount = %d;' % svn_info_len,
+            'extern const char* const kSvnInfo[%d] = %s;' % (
+                    svn_info_len, svn_info_array),
+            'extern const char kBuildType[] = "%s";' % self.options.profile,
+            build_time_line,
+            'extern const char kBuilderName[] = "%s";' % os.getenv('USER'),
+            'extern const char kHostName[] = "%s";' % socket.gethostname(),
+            'extern const char kCompiler[] = "%s";' % compiler,
+            '}}',
+        ]
+
+        content = '\n'.join(lines) + '\n'
+        version_cpp_path = '%s/version.cpp' % self.build_dir
+        if os.path.exists(version_cpp_path):
+            old_content = open(version_cpp_path).read()
+            if (old_content.replace(_get_build_time_line(old_content), '') ==
+                    content.replace(build_time_line, '')):
+                return
+
+        version_cpp = open(version_cpp_path, 'w')
+        version_cpp.write(content)
         version_cpp.close()
 
+    def generate_version_file(self):
+        """Generate version information files. """
+        self._write_version_file()
         self._add_rule('VariantDir("%s", ".", duplicate=0)' % self.build_dir)
         self._add_rule(self.version_cpp_compile_template.substitute(
             updateinfo='Updating version information',
@@ -178,6 +410,12 @@ from scons_helper import generate_resource_header
 
         if getattr(self.options, 'verbose', False):
             self._add_rule('scons_helper.option_verbose = True')
+        if self.action_timing_file:
+            self._add_rule('scons_helper.enable_action_timing("%s")' %
+                           self.action_timing_file)
+        if self.build_nodes_file:
+            self._add_rule('scons_helper.enable_build_nodes_recording("%s")' %
+                           self.build_nodes_file)
 
         self._add_rule((
                 """if not os.path.exists('%s'):
@@ -301,7 +539,10 @@ top_env.Append(
         protoc_php_plugin = proto_config['protoc_php_plugin']
         # Genreates common builders now
         builder_list = []
-        self._add_rule('time_value = Value("%s")' % time.asctime())
+        # Evaluated when scons reads SConstruct, so the gen_rule targets
+        # without srcs are always rebuilt, while their cached rules are
+        # reused
+        self._add_rule('time_value = Value(time.asctime())')
         self._add_rule(
             'proto_bld = Builder(action = MakeAction("%s --proto_path=. -I. %s'
             ' -I=`dirname $SOURCE` --cpp_out=%s $SOURCE", '
@@ -391,8 +632,11 @@ python_binary_bld = Builder(action = MakeAction(generate_python_binary,
         for builder in builder_list:
             self._add_rule('top_env.Append(%s)' % builder)
 
-    def generate_compliation_flags(self):
-        """Generates compliation flags. """
+    def _get_toolchain(self):
+        """Returns (cc, cxx, ld) prefixed by the compiling and linking
+        wrappers enabled, such as ccache and distcc.
+
+        """
         toolchain_dir = os.environ.get('TOOLCHAIN_DIR', '')
         if toolchain_dir and not toolchain_dir.endswith('/'):
             toolchain_dir += '/'
@@ -439,6 +683,14 @@ python_binary_bld = Builder(action = MakeAction(generate_python_binary,
                         building_var=ld_str,
                         condition=build_with_dccc)
 
+        return cc_str, cxx_str, ld_str
+
+    def generate_compliation_flags(self):
+        """Generates compliation flags. """
+        cc_str, cxx_str, ld_str = self._get_toolchain()
+        build_with_distcc = (self.distcc_enabled and
+                             self.build_environment.distcc_env_prepared)
+
         cc_env_str = 'CC="%s", CXX="%s"' % (cc_str, cxx_str)
         ld_env_str = 'LINK="%s"' % ld_str
 
@@ -461,6 +713,10 @@ python_binary_bld = Builder(action = MakeAction(generate_python_binary,
                         cc_config['cxxflags'],
                         ld_env_str, linkflags))
 
+        if cc_config['header_deps_from_depfile']:
+            self._add_rule('scons_helper.enable_depfile_deps(top_env, "%s")' %
+                           get_blade_cache_file(self.build_dir, 'depfile_deps'))
+
         self._setup_cache()
 
         if build_with_distcc:
@@ -535,16 +791,38 @@ class SconsRulesGenerator(object):
                 gcc_version,
                 python_inc,
                 self.blade.build_environment,
-                self.blade.svn_root_dirs)
+                self.blade.svn_root_dirs,
+                self.blade.get_blade_cache_file('action_timings'),
+                self.blade.get_blade_cache_file('build_nodes'))
         try:
             os.remove('blade-bin')
         except os.error:
             pass
         os.symlink(os.path.abspath(build_dir), 'blade-bin')
 
+    def _generate_implicit_cache_rules(self):
+        """Enable the implicit cache of scons, which is invalidated by the
+        key of the include paths of the cc config and the targets.
+
+        """
+        cc_config = configparse.blade_config.get_config('cc_config')
+        incs = [cc_config['extra_incs']]
+        targets = self.blade.get_build_targets()
+        for key in sorted(targets):
+            target_incs = (targets[key].data.get('incs', []),
+                           targets[key].data.get('export_incs', []))
+            if target_incs[0] or target_incs[1]:
+                incs.append((key, target_incs))
+        return ['scons_helper.enable_implicit_cache("%s", "%s")\n' % (
+                self.blade.get_blade_cache_file('implicit_cache_key'),
+                md5sum_str(repr(incs)))]
+
     def generate_scons_script(self):
         """Generates SConstruct script. """
         rules_buf = self.scons_file_header_generator.generate(self.blade_path)
+        if configparse.blade_config.get_config('global_config')[
+                'implicit_cache']:
+            rules_buf += self._generate_implicit_cache_rules()
         rules_buf += self.blade.gen_targets_rules()
 
         # Write to SConstruct
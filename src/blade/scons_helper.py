@@ -15,6 +15,7 @@
 """
 
 
+import atexit
 import os
 import shutil
 import signal
@@ -22,14 +23,24 @@ import string
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
 import SCons
 import SCons.Action
 import SCons.Builder
+import SCons.CacheDir
+import SCons.Executor
+import SCons.Node.FS
 import SCons.Scanner
 import SCons.Scanner.Prog
+import SCons.Script
+import SCons.Util
 
 import console
+from blade_util import load_cache_file
+from blade_util import md5sum_str
+from blade_util import save_cache_file
 
 
 # option_verbose to indicate print verbose or not
@@ -40,6 +51,26 @@ option_verbose = False
 linking_tmp_dir = ''
 
 
+# {target file : [first source file, seconds]} of the actions executed in
+# this build, see enable_action_timing
+_action_timings = {}
+_action_timings_lock = threading.Lock()
+
+
+# {source : (mtime, [header])} of the sources compiled with depfiles, see
+# enable_depfile_deps
+_depfile_deps = {}
+
+
+# The header suffixes of the generated files which may be included
+_HEADER_SUFFIXES = frozenset(['.h', '.hh', '.hpp', '.hxx', '.inc'])
+
+
+# The file nodes whose implicit dependencies are got in this build, the
+# ones scanned and the scans run, see enable_implicit_cache
+_implicit_deps_stats = {'nodes': 0, 'scanned': 0, 'scans': 0}
+
+
 def generate_python_binary(target, source, env):
     setup_file = ''
     if not str(source[0]).endswith('setup.py'):
@@ -410,3 +441,333 @@ def create_fast_link_builders(env):
 
     create_fast_link_sharelib_builder(env)
     create_fast_link_prog_builder(env)
+
+
+def _save_action_timings(timing_file):
+    """Merge the timings of this build into the timing file. """
+    if not _action_timings:
+        return
+    timings = load_cache_file(timing_file) or {}
+    for target_file, (source_file, seconds) in _action_timings.iteritems():
+        timings[target_file] = (source_file, seconds)
+    save_cache_file(timing_file, timings)
+
+
+def _get_action_argument(args, kwargs, name):
+    """Get the argument passed to SCons.Action._ActionAction.__call__
+    after target, source and env, by keyword or positionally. """
+    names = ('exitstatfunc', 'presub', 'show', 'execute', 'chdir', 'executor')
+    if name in kwargs:
+        return kwargs[name]
+    index = names.index(name)
+    if index < len(args):
+        return args[index]
+    return None
+
+
+def enable_action_timing(timing_file):
+    """Record the time spent by the actions building every target file.
+
+    The timings are merged into timing_file at exit, so it holds the
+    latest timing of every target file ever built, which is used by
+    blade query --critical-path.  Actions are executed in multiple threads
+    with -j, they are timed by wrapping the execution of SCons actions
+    because SPAWN doesn't know the targets.  The target files retrieved
+    from the CacheDir are not timed, their actions are not executed but
+    only shown, so the timing of the last real execution is kept.
+
+    """
+    action_class = getattr(SCons.Action, '_ActionAction', None)
+    if action_class is None:
+        return
+    execute_action = action_class.__call__
+    cache_actions = []
+    for name in ('CacheRetrieve', 'CacheRetrieveSilent', 'CachePush'):
+        cache_action = getattr(SCons.CacheDir, name, None)
+        if cache_action is not None:
+            cache_actions.append(cache_action)
+
+    def is_executed(action, args, kwargs):
+        for cache_action in cache_actions:
+            if action is cache_action:
+                return False
+        execute = _get_action_argument(args, kwargs, 'execute')
+        if execute is None or execute is SCons.Action._null:
+            execute = SCons.Action.execute_actions
+        return execute
+
+    def timed_execute_action(self, target, source, env, *args, **kwargs):
+        if not is_executed(self, args, kwargs):
+            return execute_action(self, target, source, env, *args, **kwargs)
+        start_time = time.time()
+        try:
+            return execute_action(self, target, source, env, *args, **kwargs)
+        finally:
+            # The executor passes empty lists and itself instead of the nodes
+            executor = _get_action_argument(args, kwargs, 'executor')
+            if not target and executor is not None:
+                target = executor.get_all_targets()
+                source = executor.get_all_sources()
+            # The actions may be called with a single node instead of a list
+            if target and not SCons.Util.is_List(target):
+                target = [target]
+            if source and not SCons.Util.is_List(source):
+                source = [source]
+            if target:
+                seconds = time.time() - start_time
+                target_file = str(target[0])
+                source_file = ''
+                if source:
+                    source_file = str(source[0])
+                _action_timings_lock.acquire()
+                try:
+                    # A target may be built by a list of actions
+                    timing = _action_timings.setdefault(target_file,
+                                                        [source_file, 0])
+                    timing[1] += seconds
+                finally:
+                    _action_timings_lock.release()
+
+    action_class.__call__ = timed_execute_action
+    atexit.register(_save_action_timings, timing_file)
+
+
+def _save_build_nodes(nodes_file):
+    """Save the paths of the file nodes scons knows, if the building
+    succeeded.  They are the generated files and the sources, including
+    the headers found by the scanners.  The source dirs under the top dir
+    are saved as sources too, a header created in them may shadow the one
+    found in another dir.  SConstruct is skipped, it is generated from the
+    BUILD files and removed after the building.
+
+    """
+    if SCons.Script.GetBuildFailures():
+        return
+    generated = []
+    sources = []
+    fs = SCons.Node.FS.get_default_fs()
+    scons_file = os.path.join(fs.Top.get_abspath(), 'SConstruct')
+    dirs = [fs.Dir('/')]
+    while dirs:
+        for name, node in dirs.pop().entries.iteritems():
+            if name in ('.', '..'):
+                continue
+            if isinstance(node, SCons.Node.FS.Dir):
+                dirs.append(node)
+                if (node is not fs.Top and node.is_under(fs.Top) and
+                        node.srcnode() is node):
+                    sources.append(node.get_abspath())
+            elif node.has_builder():
+                generated.append(node.get_abspath())
+            elif node.get_abspath() != scons_file:
+                sources.append(node.get_abspath())
+    save_cache_file(nodes_file, {'generated': generated,
+                                 'sources': sources})
+
+
+def enable_build_nodes_recording(nodes_file):
+    """Record the file nodes of the building into nodes_file at exit,
+    blade fingerprints them to skip the next building if none of them
+    is changed.
+
+    """
+    atexit.register(_save_build_nodes, nodes_file)
+
+
+def _real_source_file(node):
+    """The file compiled for the source node, which is in the source dir
+    if the node is in the variant dir and not generated.
+
+    """
+    if node.is_derived():
+        return node.get_abspath()
+    return node.srcnode().get_abspath()
+
+
+def _get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _parse_depfile(depfile):
+    """Returns the headers in the depfile written by gcc -MMD. """
+    content = open(depfile).read().replace('\\\n', ' ')
+    deps = content[content.find(':') + 1:].replace('\\ ', '\0').split()
+    # The first one is the source itself
+    return [dep.replace('\0', ' ') for dep in deps[1:]]
+
+
+class _DepfileScannerSelector(SCons.Scanner.Base):
+    """Selects the scanner of a source compiled.
+
+    The headers of the sources whose depfiles are up to date are read
+    from the depfile database, the others are scanned by the original
+    scanner of the object builder.
+
+    """
+    def __init__(self, scanner):
+        SCons.Scanner.Base.__init__(self, None,
+                                    name='DepfileScannerSelector')
+        self.scanner = scanner
+        self.depfile_scanner = SCons.Scanner.Base(
+                self._scan_depfile_deps, name='DepfileScanner')
+        self.top = SCons.Node.FS.get_default_fs().Top
+
+    def _scan_depfile_deps(self, node, env, path):
+        return [self.top.File(header)
+                for header in _depfile_deps[str(node)][1]]
+
+    def select(self, node):
+        entry = _depfile_deps.get(str(node))
+        if entry and entry[0] == _get_mtime(_real_source_file(node)):
+            return self.depfile_scanner
+        return self.scanner.select(node)
+
+
+def _save_depfile_deps(deps_file, object_builders):
+    """Update the depfile database with the depfiles of the objects built,
+    the headers are shared by the sources so they are pickled once.
+
+    """
+    headers = {}
+    for entry in _depfile_deps.itervalues():
+        for header in entry[1]:
+            headers.setdefault(header, header)
+
+    updated = False
+    fs = SCons.Node.FS.get_default_fs()
+    dirs = [fs.Dir('/')]
+    while dirs:
+        for name, node in dirs.pop().entries.iteritems():
+            if name in ('.', '..'):
+                continue
+            if isinstance(node, SCons.Node.FS.Dir):
+                dirs.append(node)
+                continue
+            if (id(node.builder) not in object_builders or
+                    node.get_state() != SCons.Node.executed or
+                    not node.sources):
+                continue
+            source = node.sources[0]
+            source_mtime = _get_mtime(_real_source_file(source))
+            depfile = node.get_abspath() + '.d'
+            depfile_mtime = _get_mtime(depfile)
+            # The object may be retrieved from the cache without the
+            # depfile, or the source may be modified after compiling
+            if (source_mtime is None or depfile_mtime is None or
+                    depfile_mtime < source_mtime):
+                continue
+            _depfile_deps[str(source)] = (
+                    source_mtime,
+                    [headers.setdefault(header, header)
+                     for header in _parse_depfile(depfile)])
+            updated = True
+    if updated:
+        save_cache_file(deps_file, _depfile_deps)
+
+
+def enable_depfile_deps(env, deps_file):
+    """Find the headers included by the c/c++ sources in the depfiles
+    written by the compiler instead of scanning the sources by scons.
+
+    The compiler writes the depfile of an object beside it, the depfiles
+    of the objects built are put into the database deps_file at exit, the
+    sources not compiled since they are changed are still scanned.
+
+    """
+    _depfile_deps.update(load_cache_file(deps_file) or {})
+    env.Append(CCFLAGS=['-MMD', '-MF', '${TARGET}.d'])
+    object_builders = set()
+    for name in ('StaticObject', 'SharedObject'):
+        builder = env['BUILDERS'][name]
+        # The nodes are built by the builder proxied
+        if isinstance(builder, SCons.Util.Proxy):
+            builder = builder.get()
+        builder.source_scanner = _DepfileScannerSelector(
+                builder.source_scanner)
+        object_builders.add(id(builder))
+    atexit.register(_save_depfile_deps, deps_file, object_builders)
+
+
+def _generated_headers():
+    """The headers generated by the builders known by scons. """
+    headers = []
+    fs = SCons.Node.FS.get_default_fs()
+    dirs = [fs.Dir('/')]
+    while dirs:
+        for name, node in dirs.pop().entries.iteritems():
+            if name in ('.', '..'):
+                continue
+            if isinstance(node, SCons.Node.FS.Dir):
+                dirs.append(node)
+            elif (node.has_builder() and
+                  os.path.splitext(name)[1] in _HEADER_SUFFIXES):
+                headers.append(node.get_abspath())
+    headers.sort()
+    return headers
+
+
+def _check_implicit_cache(key_file, incs_key):
+    """Returns the key of the implicit cache of this build, all of the
+    nodes are scanned again if it is changed since the last build.
+
+    """
+    key = md5sum_str(repr((incs_key, _generated_headers())))
+    if load_cache_file(key_file) != key:
+        console.info('include paths or generated headers are changed, '
+                     'rescan all of the implicit dependencies')
+        SCons.Node.implicit_deps_changed = 1
+    return key
+
+
+def _save_implicit_cache_key(key_file, implicit_cache):
+    """Save the key of the implicit cache if the building succeeded. """
+    stats = _implicit_deps_stats
+    if stats['nodes']:
+        console.info('%d of %d implicit dependency scans reused' % (
+                stats['nodes'] - stats['scanned'], stats['nodes']))
+    key = implicit_cache.get('key')
+    if (key and SCons.Node.implicit_deps_changed and
+            not SCons.Script.GetBuildFailures()):
+        save_cache_file(key_file, key)
+
+
+def enable_implicit_cache(key_file, incs_key):
+    """Enable the implicit cache of scons, which reuses the implicit
+    dependencies stored in .sconsign of the targets whose sources are not
+    changed, instead of scanning the sources again.
+
+    The cache doesn't know the headers added into the include paths, so
+    everything is scanned again if the key of the include paths, incs_key,
+    or the headers generated are changed since the last successful build.
+    The key is checked when the first node is scanned, after all of the
+    generated headers are known by scons.
+
+    """
+    SCons.Script.SetOption('implicit_cache', 1)
+    implicit_cache = {}
+    node_scan = SCons.Node.Node.scan
+    scan_sources = SCons.Executor.Executor.scan_sources
+
+    def counted_node_scan(self):
+        if (self.implicit is not None or not self.has_builder() or
+                not isinstance(self, SCons.Node.FS.File)):
+            return node_scan(self)
+        if 'key' not in implicit_cache:
+            implicit_cache['key'] = _check_implicit_cache(key_file, incs_key)
+        stats = _implicit_deps_stats
+        scans = stats['scans']
+        node_scan(self)
+        stats['nodes'] += 1
+        if stats['scans'] != scans:
+            stats['scanned'] += 1
+
+    def counted_scan_sources(self, scanner):
+        _implicit_deps_stats['scans'] += 1
+        return scan_sources(self, scanner)
+
+    SCons.Node.Node.scan = counted_node_scan
+    SCons.Executor.Executor.scan_sources = counted_scan_sources
+    atexit.register(_save_implicit_cache_key, key_file, implicit_cache)
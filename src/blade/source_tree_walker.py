@@ -0,0 +1,202 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the source tree walker module which finds the dirs containing
+ BUILD files for the target patterns like 'path/...'.
+
+"""
+
+
+import os
+import re
+import stat
+import string
+
+import configparse
+import console
+from blade_util import load_cache_file
+from blade_util import save_cache_file
+
+try:
+    # The scandir module is much faster than listdir and stat, use it
+    # when it is installed.
+    from scandir import scandir
+except ImportError:
+    scandir = None
+
+
+# The file under BLADE_ROOT to list dirs which should not be walked into
+IGNORE_FILE = '.bladeignore'
+
+
+def _compile_pattern(pattern):
+    """Compile the shell pattern of a path to a regex, '*' and '?' don't
+    match '/', so a pattern only matches the paths of the same depth.
+
+    """
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[' and pattern.find(']', i + 1) != -1:
+            end = pattern.find(']', i + 1)
+            chars = pattern[i:end]
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            regex += '[%s]' % chars.replace('\\', '\\\\')
+            i = end + 1
+        else:
+            regex += re.escape(c)
+    return re.compile(regex + r'\Z')
+
+
+def get_output_dirs():
+    """The output dirs of all of the build profiles. """
+    template = string.Template(configparse.blade_config.get_config(
+            'global_config')['build_path_template'])
+    output_dirs = set()
+    for m in ('32', '64'):
+        for profile in ('debug', 'release'):
+            output_dirs.add(os.path.normpath(template.safe_substitute(
+                    m=m, profile=profile)))
+    return output_dirs
+
+
+class SourceTreeWalker(object):
+    """SourceTreeWalker.
+
+    Walks the source tree to find the dirs containing BUILD files.  The
+    result of listing each dir is saved in an index file with the mtime
+    of the dir, when walking again, only the dirs whose mtime changed are
+    listed, the others are stated only.
+
+    Skipped dirs:
+        dirs whose name starts with '.', e.g., .svn
+        blade output dirs, e.g., build64_release
+        dirs matching the patterns in BLADE_ROOT/.bladeignore
+
+    """
+    def __init__(self, blade_root_dir, index_file):
+        self.blade_root_dir = blade_root_dir
+        self.index_file = index_file
+        # {dir : (mtime, has_build_file, [subdir, ...])}
+        self.index = load_cache_file(index_file) or {}
+        self.index_changed = False
+        self.output_dirs = get_output_dirs()
+        self.ignore_patterns = self._load_ignore_patterns()
+
+    def _load_ignore_patterns(self):
+        """Get the patterns of the dirs which should be skipped. """
+        patterns = []
+        ignore_file = os.path.join(self.blade_root_dir, IGNORE_FILE)
+        if os.path.isfile(ignore_file):
+            for line in open(ignore_file):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('//'):
+                    line = line[2:]
+                patterns.append(_compile_pattern(os.path.normpath(line)))
+        return patterns
+
+    def _is_ignored(self, path):
+        """Whether the dir should be skipped. """
+        if path in self.output_dirs:
+            return True
+        for pattern in self.ignore_patterns:
+            if pattern.match(path):
+                return True
+        return False
+
+    def _remove_dirs(self, path):
+        """Remove the dir and the dirs under it from the index. """
+        prefix = path + os.sep
+        for indexed_path in self.index.keys():
+            if indexed_path == path or indexed_path.startswith(prefix):
+                del self.index[indexed_path]
+                self.index_changed = True
+
+    @staticmethod
+    def _list_dir(path):
+        """Returns (has_build_file, sorted subdirs) of the dir. """
+        has_build_file = False
+        subdirs = []
+        if scandir is not None:
+            for entry in scandir(path):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name == 'BUILD' and entry.is_file():
+                    has_build_file = True
+        else:
+            for name in os.listdir(path):
+                if name.startswith('.'):
+                    continue
+                mode = os.lstat(os.path.join(path, name)).st_mode
+                if stat.S_ISDIR(mode):
+                    subdirs.append(name)
+                elif name == 'BUILD' and os.path.isfile(
+                        os.path.join(path, name)):
+                    has_build_file = True
+        subdirs.sort()
+        return has_build_file, subdirs
+
+    def find_build_dirs(self, source_dir):
+        """Returns the dirs under source_dir which contain BUILD files.
+
+        The dirs are returned in the pre-order of walking, source_dir
+        itself is always the first one if it contains a BUILD file.
+
+        """
+        build_dirs = []
+        stack = [os.path.normpath(source_dir)]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                # The dir is removed
+                self._remove_dirs(path)
+                continue
+            entry = self.index.get(path)
+            if entry and entry[0] == mtime:
+                has_build_file, subdirs = entry[1], entry[2]
+            else:
+                try:
+                    has_build_file, subdirs = self._list_dir(path)
+                except OSError, e:
+                    console.warning('failed to list dir %s: %s' % (path, e))
+                    self._remove_dirs(path)
+                    continue
+                if entry:
+                    for subdir in set(entry[2]).difference(subdirs):
+                        self._remove_dirs(os.path.normpath(
+                                os.path.join(path, subdir)))
+                self.index[path] = (mtime, has_build_file, subdirs)
+                self.index_changed = True
+            if has_build_file:
+                build_dirs.append(path)
+            for subdir in reversed(subdirs):
+                if path == '.':
+                    subdir_path = subdir
+                else:
+                    subdir_path = os.path.join(path, subdir)
+                if not self._is_ignored(subdir_path):
+                    stack.append(subdir_path)
+        return build_dirs
+
+    def save(self):
+        """Save the index if it is changed. """
+        if self.index_changed:
+            save_cache_file(self.index_file, self.index)
+            self.index_changed = False
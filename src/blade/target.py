@@ -16,6 +16,7 @@ import os
 import string
 
 import console
+from action_graph import Action
 from blade_util import var_to_list
 
 
@@ -59,6 +60,10 @@ class Target(object):
         self._check_deps_in_build_file(deps)
         self._init_target_deps(deps)
         self.scons_rule_buf = []
+        self.actions = []
+        # The (name, rules) of the env shared with the other targets, the
+        # rules defining it are written before the rules of all targets
+        self.shared_env = None
 
     def _clone_env(self):
         """Clone target's environment. """
@@ -329,7 +334,8 @@ class Target(object):
 
         Description
         -----------
-        Append the rule to the buffer at first.
+        Append the rule to the buffer at first, it is used by the scons
+        backend, the ninja backend uses the actions, see _add_action.
 
         """
         self.scons_rule_buf.append('%s\n' % rule)
@@ -342,6 +348,53 @@ class Target(object):
         """
         console.error_exit('%s: should be subclassing' % self.type)
 
+    def ninja_rules(self):
+        """ninja_rules.
+
+        This method should be implemented in the subclasses supported by
+        the ninja backend.
+
+        """
+        console.error_exit('//%s:%s: %s is not supported by the ninja '
+                           'backend yet, please use --backend=scons' % (
+                               self.path, self.name, self.type))
+
+    def _add_action(self, outputs, command, inputs=None,
+                    implicit_deps=None, order_only_deps=None,
+                    env=None, resource_class='generate'):
+        """_add_action.
+
+        Append an action of the target to the actions list, env is a list
+        of (name, value) pairs bound to the action.  The actions are only
+        generated by ninja_rules.
+
+        """
+        self.actions.append(Action('//' + self.fullname, outputs, command,
+                                   inputs, implicit_deps, order_only_deps,
+                                   env, resource_class))
+
+    def _ninja_deps_files(self, name):
+        """Returns the files of the deps set in data[name] when their ninja
+        rules are generated, such as their outputs or generated headers.
+
+        """
+        files = []
+        for dkey in self.expanded_deps:
+            for f in self.target_database[dkey].data.get(name, []):
+                if f not in files:
+                    files.append(f)
+        return files
+
+    def _ninja_source_path(self, src, generated_files):
+        """Returns the path of src in the build dir if it is generated by
+        the deps, such as gen_rule, otherwise in the source tree.
+
+        """
+        path = self._target_file_path(self.path, src)
+        if path in generated_files:
+            return path
+        return os.path.join(self.path, src)
+
     def get_rules(self):
         """get_rules.
 
@@ -356,6 +409,10 @@ class Target(object):
         """
         return self.scons_rule_buf
 
+    def get_actions(self):
+        """Returns the actions generated by ninja_rules. """
+        return self.actions
+
     def _convert_string_to_target_helper(self, target_string):
         """
         Converting a string like thirdparty/gtest:gtest to tuple
@@ -0,0 +1,131 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the toolchain probe module which runs the commands probing the
+ tools installed, such as `gcc --version`, in parallel, and caches their
+ outputs in the build dir, so they are not run again until PATH or the
+ tools are changed.
+
+"""
+
+
+import os
+import subprocess
+import time
+
+import console
+from blade_util import find_executable
+from blade_util import load_cache_file
+from blade_util import save_cache_file
+
+
+# Increase it when the format of the cache file changes
+_CACHE_VERSION = 1
+
+
+# {command : (fingerprint, result)} probed in advance by the blade server,
+# see preload_toolchain_probes
+_preloaded_results = {}
+
+
+def _command_fingerprint(command):
+    """The command, PATH and the path, size and mtime of the executable
+    run by the command.
+
+    """
+    fingerprint = [command, os.environ.get('PATH', '')]
+    executable = find_executable(command)
+    if executable:
+        executable = os.path.realpath(executable)
+        try:
+            st = os.stat(executable)
+            fingerprint += [executable, st.st_size, st.st_mtime]
+        except OSError:
+            pass
+    return tuple(fingerprint)
+
+
+class ToolchainProbe(object):
+    """ToolchainProbe.
+
+    Runs the probing commands by the shell and holds their results, a
+    result is (returncode, stdout, stderr).  The results are loaded from
+    cache_file on the first probing, and are reused if the fingerprints
+    of their commands are not changed.
+
+    """
+    def __init__(self, cache_file=''):
+        self.cache_file = cache_file
+        # {command : (fingerprint, result)}
+        self.results = None
+        # The commands whose results are checked or run by this process
+        self.checked_commands = set()
+
+    def _load_cache(self):
+        self.results = {}
+        if not self.cache_file:
+            return
+        data = load_cache_file(self.cache_file)
+        if data and data.get('version') == _CACHE_VERSION:
+            self.results = data['results']
+
+    def probe(self, commands):
+        """Run the commands whose results are not cached in parallel. """
+        if self.results is None:
+            self._load_cache()
+
+        start_time = time.time()
+        processes = {}
+        fingerprints = {}
+        for command in commands:
+            if command in self.checked_commands or command in processes:
+                continue
+            self.checked_commands.add(command)
+            fingerprint = _command_fingerprint(command)
+            cached = self.results.get(command)
+            if cached and cached[0] == fingerprint:
+                continue
+            cached = _preloaded_results.get(command)
+            if cached and cached[0] == fingerprint:
+                self.results[command] = cached
+                continue
+            fingerprints[command] = fingerprint
+            processes[command] = subprocess.Popen(
+                command,
+                env=os.environ,
+                stderr=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                shell=True,
+                universal_newlines=True)
+        if not processes:
+            return
+        for command, p in processes.iteritems():
+            (stdout, stderr) = p.communicate()
+            self.results[command] = (fingerprints[command],
+                                     (p.returncode, stdout, stderr))
+        console.info('%d toolchain probes run in %.2fs' % (
+                len(processes), time.time() - start_time))
+
+        if self.cache_file:
+            save_cache_file(self.cache_file, {'version': _CACHE_VERSION,
+                                              'results': self.results})
+
+    def get_result(self, command):
+        """Returns (returncode, stdout, stderr) of the command. """
+        self.probe([command])
+        return self.results[command][1]
+
+
+def preload_toolchain_probes(commands):
+    """Run the probing commands in advance, their results are reused by
+    the later probes in this process if the fingerprints of the commands
+    are not changed.
+
+    """
+    toolchain_probe = ToolchainProbe()
+    toolchain_probe.probe(commands)
+    _preloaded_results.update(toolchain_probe.results)
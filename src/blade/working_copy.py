@@ -0,0 +1,176 @@
+# Copyright (c) 2013 Tencent Inc.
+# All rights reserved.
+#
+# Author: Feng Chen <phongchen@tencent.com>
+
+
+"""
+ This is the working copy module which asks the version control system,
+ svn or git, for the revision and the changed files of the source tree.
+
+"""
+
+
+import os
+import subprocess
+
+
+class WorkingCopyStatus(object):
+    """WorkingCopyStatus.
+
+    revision: the revision of the working copy, the files which are not
+        changed have the same content as they are in this revision.
+    changed_files: the files which are modified, added, deleted, renamed,
+        unversioned or ignored, relative to BLADE_ROOT.
+    changed_dirs: the dirs which are unversioned or ignored as a whole.
+    versioned_build_files: the set of versioned BUILD files if the version
+        control system doesn't report the ignored files, otherwise None.
+
+    """
+    def __init__(self, revision, changed_files, changed_dirs,
+                 versioned_build_files=None):
+        self.revision = revision
+        self.changed_files = changed_files
+        self.changed_dirs = changed_dirs
+        self.versioned_build_files = versioned_build_files
+        # The dirs containing changed files
+        self.dirs_of_changed_files = set(os.path.dirname(f)
+                                         for f in changed_files)
+
+    def _in_changed_dir(self, path):
+        while path:
+            if path in self.changed_dirs:
+                return True
+            path = os.path.dirname(path)
+        return False
+
+    def is_dir_changed(self, path):
+        """Whether any file in the dir is changed, subdirs excluded. """
+        path = os.path.normpath(path)
+        if path == '.':
+            path = ''
+        return (path in self.dirs_of_changed_files or
+                self._in_changed_dir(path))
+
+    def is_build_file_unchanged(self, path):
+        """Whether the BUILD file is versioned and not changed. """
+        path = os.path.normpath(path)
+        if path in self.changed_files or self._in_changed_dir(path):
+            return False
+        if self.versioned_build_files is not None:
+            return path in self.versioned_build_files
+        return True
+
+
+def _run(cmd, cwd):
+    """Returns the stdout of the command, or None if it fails. """
+    try:
+        p = subprocess.Popen(cmd,
+                             cwd=cwd,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        (stdout, stderr) = p.communicate()
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+    return stdout
+
+
+# The line printed by svn status before the status of an external item
+_SVN_EXTERNAL_PREFIX = 'Performing status on external item at '
+
+
+def _add_changed_path(path, changed_files, changed_dirs):
+    if path.endswith('/'):
+        changed_dirs.add(os.path.normpath(path))
+    else:
+        changed_files.add(os.path.normpath(path))
+
+
+def _get_git_status(blade_root_dir):
+    output = _run(['git', 'rev-parse', 'HEAD', '--show-prefix'],
+                  blade_root_dir)
+    if output is None:
+        return None
+    lines = output.split('\n')
+    revision = lines[0]
+    prefix = lines[1] if len(lines) > 1 else ''
+
+    # The paths are relative to the top dir of the git repository
+    output = _run(['git', 'status', '--porcelain', '-z',
+                   '--untracked-files=normal', '--', '.'],
+                  blade_root_dir)
+    if output is None:
+        return None
+    changed_files = set()
+    changed_dirs = set()
+    entries = output.split('\0')
+    i = 0
+    while i < len(entries):
+        entry = entries[i]
+        i += 1
+        if not entry:
+            continue
+        paths = [entry[3:]]
+        if entry[0] in 'RC':
+            # The original path of renaming or copying follows
+            paths.append(entries[i])
+            i += 1
+        for path in paths:
+            if path.startswith(prefix):
+                _add_changed_path(path[len(prefix):],
+                                  changed_files, changed_dirs)
+
+    # git status doesn't report the ignored files, so only the versioned
+    # BUILD files are known to be unchanged
+    output = _run(['git', 'ls-files', '-z', '--', '*BUILD'], blade_root_dir)
+    if output is None:
+        return None
+    versioned_build_files = set(path for path in output.split('\0')
+                                if os.path.basename(path) == 'BUILD')
+    return WorkingCopyStatus(revision, changed_files, changed_dirs,
+                             versioned_build_files)
+
+
+def _get_svn_status(blade_root_dir):
+    revision = _run(['svnversion', '-n', '.'], blade_root_dir)
+    if revision is None or not revision[0].isdigit():
+        return None
+    # The externals are not covered by the revision of the working copy,
+    # they are treated as changed, including the ones not reported as 'X'
+    output = _run(['svn', 'status', '--no-ignore'], blade_root_dir)
+    if output is None:
+        return None
+    changed_files = set()
+    changed_dirs = set()
+    for line in output.splitlines():
+        if line.startswith(_SVN_EXTERNAL_PREFIX):
+            path = line[len(_SVN_EXTERNAL_PREFIX):].rstrip(':').strip('\'"')
+            _add_changed_path(path + '/', changed_files, changed_dirs)
+            continue
+        # The first 7 columns are the status, then a space and the path
+        if len(line) <= 8 or line[7] != ' ':
+            continue
+        if line[0] == ' ' and line[1] == ' ':
+            # Only locked or switched
+            continue
+        path = line[8:].strip()
+        if os.path.isdir(os.path.join(blade_root_dir, path)):
+            path += '/'
+        _add_changed_path(path, changed_files, changed_dirs)
+    return WorkingCopyStatus(revision, changed_files, changed_dirs)
+
+
+def get_working_copy_status(blade_root_dir):
+    """Returns the WorkingCopyStatus of BLADE_ROOT.
+
+    Returns None if BLADE_ROOT is not the root of a svn or git working
+    copy, or the version control system fails.
+
+    """
+    if os.path.isdir(os.path.join(blade_root_dir, '.svn')):
+        return _get_svn_status(blade_root_dir)
+    if os.path.exists(os.path.join(blade_root_dir, '.git')):
+        return _get_git_status(blade_root_dir)
+    return None
@@ -77,6 +77,10 @@ class TargetTest(unittest.TestCase):
             os.remove(self.scons_output_file)
         except OSError:
             pass
+        try:
+            os.remove('./build.ninja')
+        except OSError:
+            pass
 
         os.chdir(self.cur_dir)
 
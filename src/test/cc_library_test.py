@@ -12,6 +12,7 @@
 
 
 import blade_test
+import blade.configparse
 
 
 class TestCcLibrary(blade_test.TargetTest):
@@ -66,6 +67,51 @@ class TestCcLibrary(blade_test.TargetTest):
         self.assertTrue('liblowercase.so' in string_depends_libs)
         self.assertTrue('libuppercase.so' in string_depends_libs)
 
+    def testSharedEnv(self):
+        """Test that the libraries share the envs defined before use. """
+        self.all_targets = self.blade.analyze_targets()
+        rules = ''.join(self.blade.generate_build_rules())
+
+        lower = self.all_targets[(self.target_path, 'lowercase')]
+        string = self.all_targets[(self.target_path, 'blade_string')]
+        self.assertTrue(lower.shared_env)
+        self.assertTrue(string.shared_env)
+        self.assertNotEqual(lower.shared_env[0], string.shared_env[0])
+        env_name = string.shared_env[0]
+        self.assertEqual(rules.count('%s = env_no_warning.Clone()' % env_name),
+                         1)
+        self.assertTrue(rules.index('%s = env_no_warning.Clone()' % env_name) <
+                        rules.index('%s.SharedObject(' % env_name))
+        self.assertTrue("'-DBLADE_STR_DEF'" in rules)
+        self.assertFalse('env_v_test_cc_library_mAgIc_blade_string' in rules)
+
+    def testImplicitCache(self):
+        """Test that the implicit cache is enabled with the key of the
+        include paths.
+
+        """
+        self.all_targets = self.blade.analyze_targets()
+        rules = ''.join(self.blade.generate_build_rules())
+        self.assertFalse('enable_implicit_cache' in rules)
+
+        global_config = blade.configparse.blade_config.get_config(
+                'global_config')
+        global_config['implicit_cache'] = True
+        try:
+            rules = ''.join(self.blade.generate_build_rules())
+            self.assertTrue('scons_helper.enable_implicit_cache(' in rules)
+            self.assertTrue('.blade_cache/implicit_cache_key' in rules)
+            lower = self.all_targets[(self.target_path, 'lowercase')]
+            lower.data['export_incs'] = ['include']
+            new_rules = ''.join(self.blade.generate_build_rules())
+            self.assertNotEqual(
+                    [line for line in rules.splitlines()
+                     if 'enable_implicit_cache' in line],
+                    [line for line in new_rules.splitlines()
+                     if 'enable_implicit_cache' in line])
+        finally:
+            global_config['implicit_cache'] = False
+
 
 if __name__ == '__main__':
     blade_test.run(TestCcLibrary)
@@ -11,7 +11,12 @@
 """
 
 
+import os
+
 import blade_test
+import blade.blade
+from blade.action_graph import ActionGraph
+from blade.blade import Blade
 
 
 class TestGenRule(blade_test.TargetTest):
@@ -63,6 +68,113 @@ class TestGenRule(blade_test.TargetTest):
         self.assertTrue(gen_rule_index > lower_so_index)
         self.assertTrue(upper_so_index, gen_rule_index)
 
+    def testGenerateNinjaRules(self):
+        """Test that build.ninja is generated correctly. """
+        self.options.backend = 'ninja'
+        self.blade.generate_build_rules()
+        self.options.backend = 'scons'
+        build_ninja = open('build.ninja').read()
+
+        self.assertTrue('depfile = $out.d' in build_ninja)
+        self.assertTrue('restat = 1' in build_ninja)
+        self.assertTrue('pool = link_pool' in build_ninja)
+
+        lower_obj_line = ''
+        gen_rule_line = ''
+        upper_obj_line = ''
+        for line in build_ninja.splitlines():
+            if line.startswith('build %s/test_gen_rule/lowercase.objs' % (
+                    self.current_building_path)):
+                lower_obj_line = line
+            if line.startswith('build %s/test_gen_rule/process.tmp' % (
+                    self.current_building_path)):
+                gen_rule_line = line
+            if line.startswith('build %s/test_gen_rule/uppercase.objs' % (
+                    self.current_building_path)):
+                upper_obj_line = line
+
+        self.assertTrue(': cxx test_gen_rule/plowercase.cpp' in lower_obj_line)
+        # The gen_rule is run after its deps are built
+        self.assertTrue(': gen_rule |' in gen_rule_line)
+        self.assertTrue('liblowercase.a' in gen_rule_line)
+        # The objects are compiled after the files generated by the deps
+        self.assertTrue('|| %s/test_gen_rule/process.tmp' % (
+                self.current_building_path) in upper_obj_line)
+
+    def testNinjaActions(self):
+        """Test that the targets generate the actions of build.ninja. """
+        cache_file = self.blade.get_blade_cache_file('ninja_rules_fragments')
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        self.options.backend = 'ninja'
+        self.blade.generate_build_rules()
+        self.options.backend = 'scons'
+
+        lower = self.all_targets[(self.target_path, 'lowercase')]
+        gen_rule = self.all_targets[(self.target_path, 'process_media')]
+        self.assertEqual([action.resource_class
+                          for action in lower.get_actions()],
+                         ['compile', 'archive', 'link'])
+        self.assertEqual(len(gen_rule.get_actions()), 1)
+        action = gen_rule.get_actions()[0]
+        self.assertEqual(action.command, 'gen_rule')
+        self.assertEqual(action.outputs, ['%s/test_gen_rule/process.tmp' % (
+                self.current_building_path)])
+        self.assertTrue('%s/test_gen_rule/liblowercase.a' % (
+                self.current_building_path) in action.implicit_deps)
+
+        # The same action is kept once in the action graph
+        graph = ActionGraph()
+        graph.add_actions(gen_rule.get_actions() + gen_rule.get_actions())
+        self.assertEqual(graph.actions, [action])
+        self.assertEqual(graph.get_producer(action.outputs[0]), action)
+
+    def testNinjaActionsFromFragmentCache(self):
+        """Test that the actions are restored when the ninja rules are
+
+           reused from the fragment cache or generated in parallel.
+
+        """
+        self.options.backend = 'ninja'
+        self.blade.generate_build_rules()
+        lower_key = (self.target_path, 'lowercase')
+        actions = self.all_targets[lower_key].get_actions()
+        self.assertTrue(actions)
+        cache_file = self.blade.get_blade_cache_file('ninja_rules_fragments')
+        for generate_jobs in (1, 4):
+            if generate_jobs > 1:
+                os.remove(cache_file)
+            self.options.generate_jobs = generate_jobs
+            blade.blade.blade = Blade(self.targets,
+                                      self.blade_path,
+                                      self.working_dir,
+                                      self.current_building_path,
+                                      self.current_source_dir,
+                                      self.options,
+                                      self.command)
+            cached_blade = blade.blade.blade
+            cached_blade.load_targets()
+            cached_blade.analyze_targets()
+            cached_blade.generate_build_rules()
+            cached_lower = cached_blade.get_build_targets()[lower_key]
+            self.assertEqual(cached_lower.get_actions(), actions)
+        self.options.generate_jobs = 1
+        self.options.backend = 'scons'
+
+    def testNinjaCommandEscaping(self):
+        """Test that the '$' in the command are escaped for ninja. """
+        gen_rule = self.all_targets[(self.target_path, 'process_media')]
+        gen_rule.data['cmd'] = "awk '{print $1}' $HOME > $OUTS; echo $$"
+        self.options.backend = 'ninja'
+        self.blade.generate_build_rules()
+        self.options.backend = 'scons'
+
+        action = gen_rule.get_actions()[0]
+        self.assertEqual(action.env, [(
+                'cmd',
+                "awk '{print $$1}' $$HOME > %s/test_gen_rule/process.tmp; "
+                "echo $$$$" % self.current_building_path)])
+
 
 if __name__ == '__main__':
     blade_test.run(TestGenRule)
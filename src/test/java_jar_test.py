@@ -11,7 +11,10 @@
 """
 
 
+import blade.blade
 import blade_test
+from blade.blade import Blade
+from blade.rules_fragment_cache import RulesFragmentCache
 
 
 class TestJavaJar(blade_test.TargetTest):
@@ -141,6 +144,55 @@ class TestJavaJar(blade_test.TargetTest):
         self.assertTrue(jar_idx > java_com_idx)
         self.assertTrue(jar_idx > java_so_idx)
 
+    def testGenerateRulesInParallel(self):
+        """Test that the rules generated in parallel are the same as the
+
+           rules generated serially, the java_jar target depends on the
+           data generated by its swig_library and proto_library deps.
+
+        """
+        rules_buf = self.blade.gen_targets_rules()
+        self.options.generate_jobs = 4
+        blade.blade.blade = Blade(self.targets,
+                                  self.blade_path,
+                                  self.working_dir,
+                                  self.current_building_path,
+                                  self.current_source_dir,
+                                  self.options,
+                                  self.command)
+        parallel_blade = blade.blade.blade
+        parallel_blade.load_targets()
+        parallel_blade.analyze_targets()
+        self.assertEqual(parallel_blade.gen_targets_rules(), rules_buf)
+        self.options.generate_jobs = 1
+
+    def testGenerateRulesFromFragmentCache(self):
+        """Test that the rules reused from the fragment cache are the same
+
+           as the generated rules, and the data set by generating rules
+           are restored for the targets depending on them.
+
+        """
+        rules_buf = self.blade.gen_targets_rules()
+        proto_library = (self.upper_target_path, 'rpc_option_proto')
+        data = self.all_targets[proto_library].data
+        blade.blade.blade = Blade(self.targets,
+                                  self.blade_path,
+                                  self.working_dir,
+                                  self.current_building_path,
+                                  self.current_source_dir,
+                                  self.options,
+                                  self.command)
+        cached_blade = blade.blade.blade
+        cached_blade.load_targets()
+        cached_targets = cached_blade.analyze_targets()
+        fragment_cache = RulesFragmentCache(
+                cached_blade.get_blade_cache_file('rules_fragments'),
+                cached_blade)
+        self.assertTrue(proto_library in fragment_cache.entries)
+        self.assertEqual(cached_blade.gen_targets_rules(), rules_buf)
+        self.assertEqual(cached_targets[proto_library].data, data)
+
 
 if __name__ == '__main__':
     blade_test.run(TestJavaJar)
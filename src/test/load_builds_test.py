@@ -12,7 +12,12 @@
 """
 
 
+import os
+
+import blade.blade
+import blade.build_file_cache
 import blade_test
+from blade.blade import Blade
 
 
 class TestLoadBuilds(blade_test.TargetTest):
@@ -62,5 +67,101 @@ class TestLoadBuilds(blade_test.TargetTest):
 
         self.assertEqual(target_count, 10)
 
+    def testLoadFromBuildFileCache(self):
+        """Test that the targets replayed from the BUILD file cache are
+
+           the same as the targets loaded by executing BUILD files.
+
+        """
+        cache_file = self.blade.get_blade_cache_file('build_files')
+        self.assertTrue(os.path.isfile(cache_file))
+
+        blade.blade.blade = Blade(self.targets,
+                                  self.blade_path,
+                                  self.working_dir,
+                                  self.current_building_path,
+                                  self.current_source_dir,
+                                  self.options,
+                                  self.command)
+        cached_blade = blade.blade.blade
+        (direct_targets,
+         all_command_targets) = cached_blade.load_targets()
+        self.assertEqual(sorted(all_command_targets),
+                         sorted(self.all_command_targets))
+        cached_blade.analyze_targets()
+        for key in self.blade.get_target_database():
+            target = self.blade.get_target_database()[key]
+            cached_target = cached_blade.get_target_database()[key]
+            self.assertEqual(target.type, cached_target.type)
+            self.assertEqual(target.srcs, cached_target.srcs)
+            self.assertEqual(target.deps, cached_target.deps)
+            self.assertEqual(target.expanded_deps, cached_target.expanded_deps)
+
+    def testLoadTrustedBuildFiles(self):
+        """Test that the trusted BUILD files are loaded from the cache. """
+        build_file_cache = blade.build_file_cache
+        entries = self.blade.get_build_file_cache().entries
+        self.assertTrue(entries)
+        try:
+            for build_file, entry in entries.iteritems():
+                build_file_cache.trust_build_file(build_file, entry['md5'])
+            blade.blade.blade = Blade(self.targets,
+                                      self.blade_path,
+                                      self.working_dir,
+                                      self.current_building_path,
+                                      self.current_source_dir,
+                                      self.options,
+                                      self.command)
+            trusted_blade = blade.blade.blade
+            trusted_blade.load_targets()
+            self.assertEqual(sorted(trusted_blade.get_target_database()),
+                             sorted(self.blade.get_target_database()))
+        finally:
+            build_file_cache.untrust_build_files()
+
+    def testNonHermeticBuildFiles(self):
+        """Test that the BUILD files reading other inputs are not replayed. """
+        is_hermetic = blade.build_file_cache.is_hermetic
+        build_names = ['cc_library', 'enable_if', 'build_target']
+        for content, hermetic in [
+                ('srcs = sorted(["a.cpp"])\n'
+                 'cc_library(name="a", srcs=srcs, deps=enable_if(\n'
+                 '    build_target.bits == 64, ["b"]))\n', True),
+                ('import glob\ncc_library(name="a", srcs=glob.glob("*"))\n',
+                 False),
+                ('def srcs():\n    return open("SRCS").read().split()\n'
+                 'cc_library(name="a", srcs=srcs())\n', False),
+                ('cc_library(name=__import__("os").environ["NAME"])\n',
+                 False)]:
+            code = compile(content, 'BUILD', 'exec')
+            self.assertEqual(is_hermetic(code, build_names), hermetic)
+
+    def testLazyConstruction(self):
+        """Test that only the targets required by the command targets
+
+           are constructed, unless strict loading is enabled.
+
+        """
+        target = (self.target_path, 'poppy')
+        unrequired_target = (self.target_path, 'echoserver')
+        for strict_load in (False, True):
+            self.options.strict_load = strict_load
+            blade.blade.blade = Blade(['%s:poppy' % self.target_path],
+                                      self.blade_path,
+                                      self.working_dir,
+                                      self.current_building_path,
+                                      self.current_source_dir,
+                                      self.options,
+                                      self.command)
+            lazy_blade = blade.blade.blade
+            lazy_blade.load_targets()
+            self.assertTrue(unrequired_target in
+                            lazy_blade.get_target_descriptors())
+            self.assertTrue(target in lazy_blade.get_target_database())
+            self.assertEqual(unrequired_target in
+                             lazy_blade.get_target_database(), strict_load)
+        self.options.strict_load = False
+
+
 if __name__ == '__main__':
     blade_test.run(TestLoadBuilds)
@@ -11,7 +11,17 @@
 """
 
 
+import json
+from cStringIO import StringIO
+
 import blade_test
+from blade.blade_util import save_cache_file
+from blade.critical_path import CriticalPath
+from blade.critical_path import load_target_timings
+from blade.load_build_files import find_depended_targets
+from blade.query_engine import QueryExpression
+from blade.query_output import BINARY_MAGIC
+from blade.query_output import write_query_result
 
 
 class TestQuery(blade_test.TargetTest):
@@ -46,6 +56,147 @@ class TestQuery(blade_test.TargetTest):
         self.assertTrue(depended_one_key in depended_by)
         self.assertTrue(depended_second_key in depended_by)
 
+    def testReverseDepsIndex(self):
+        """Test the reverse dependency index of blade manager. """
+        query_key = ('test_query', 'poppy')
+        depended_by = self.blade.get_depended_by(query_key)
+        for key in self.all_targets:
+            self.assertEqual(
+                    query_key in self.all_targets[key].expanded_deps,
+                    key in depended_by)
+        self.assertEqual(self.blade.get_depended_by(query_key, ['cc_test']),
+                         [('test_query', 'rpc_channel_test')])
+        self.assertTrue(('test_query', 'poppy_client') in
+                        self.blade.get_dir_depended_by('test_query'))
+
+    def testFindDependedTargets(self):
+        """Test finding the dependers by the on-disk reverse deps index. """
+        query_key = ('test_query', 'poppy')
+        dependers = find_depended_targets([query_key], '.', self.blade)
+        self.assertEqual(sorted(dependers),
+                         sorted(self.blade.get_depended_by(query_key)))
+        # The second time is served by the index file
+        self.assertEqual(find_depended_targets([query_key], '.', self.blade),
+                         dependers)
+
+    def testQueryExpression(self):
+        """Test evaluating query expressions over the dependency graph. """
+        direct_deps = self.blade.get_direct_deps()
+
+        def query(expression):
+            return QueryExpression(expression, '.').evaluate(self.all_targets,
+                                                             direct_deps)
+
+        poppy = ('test_query', 'poppy')
+        self.assertEqual(query('deps(//test_query:poppy) - test_query:poppy'),
+                         sorted(self.all_targets[poppy].expanded_deps))
+        self.assertEqual(
+                query('rdeps(//..., test_query:poppy) except test_query:poppy'),
+                sorted(self.blade.get_depended_by(poppy)))
+        self.assertEqual(
+                query('kind(cc_test, rdeps(//test_query/..., test_query:poppy))'),
+                [('test_query', 'rpc_channel_test')])
+        self.assertEqual(
+                query('somepath(test_query:poppy_mock, '
+                      'test_query:rpc_option_proto)'),
+                [poppy,
+                 ('test_query', 'poppy_mock'),
+                 ('test_query', 'rpc_option_proto')])
+        self.assertEqual(
+                query('allpaths(test_query:poppy_mock, '
+                      'test_query:rpc_option_proto)'),
+                [poppy,
+                 ('test_query', 'poppy_mock'),
+                 ('test_query', 'rpc_meta_info_proto'),
+                 ('test_query', 'rpc_option_proto')])
+        self.assertEqual(query('deps(test_query:poppy, 1) ^ //test_query:*'),
+                         [poppy,
+                          ('test_query', 'rpc_meta_info_proto'),
+                          ('test_query', 'rpc_option_proto'),
+                          ('test_query', 'static_resource')])
+        self.assertEqual(
+                QueryExpression('deps(:poppy) + //test_query/... - x:y',
+                                'test_query').target_patterns(),
+                ['test_query:poppy', 'test_query/...', 'test_query/x:y'])
+
+    def testCriticalPath(self):
+        """Test finding the critical path by the recorded action timings. """
+        build_path = self.blade.get_build_path()
+        timing_file = self.blade.get_blade_cache_file('action_timings')
+        objs_dir = '%s/test_query/poppy.objs' % build_path
+        save_cache_file(timing_file, {
+            objs_dir + '/rpc_channel.cc.o': ('test_query/rpc_channel.cc', 3.0),
+            objs_dir + '/rpc_server.cc.o': ('test_query/rpc_server.cc', 5.0),
+            '%s/test_query/libpoppy.a' % build_path: (
+                objs_dir + '/rpc_channel.cc.o', 1.0),
+            '%s/test_query/rpc_meta_info.pb.cc' % build_path: (
+                'test_query/rpc_meta_info.proto', 2.0),
+            '%s/test_query/_poppy_client.so' % build_path: (
+                '%s/test_query/poppy_client_pywrap.cxx' % build_path, 4.0),
+        })
+        target_timings = load_target_timings(timing_file,
+                                             self.all_targets,
+                                             build_path)
+        poppy = ('test_query', 'poppy')
+        # The objects are compiled in parallel, then linked
+        self.assertEqual(target_timings[poppy].latency, 6.0)
+        self.assertEqual(target_timings[poppy].cost, 9.0)
+
+        client = ('test_query', 'poppy_client')
+        keys = [client] + self.all_targets[client].expanded_deps
+        critical_path = CriticalPath(keys,
+                                     self.blade.get_target_levels().levels,
+                                     self.blade.get_direct_deps(),
+                                     target_timings)
+        self.assertEqual(critical_path.wall_time, 12.0)
+        self.assertEqual(critical_path.chain,
+                         [('test_query', 'rpc_meta_info_proto'),
+                          poppy, client])
+        self.assertEqual(critical_path.get_speed_up_suggestions()[0],
+                         (6.0, poppy))
+
+    def testQueryOutput(self):
+        """Test writing query results in the machine readable formats. """
+        direct_deps = self.blade.get_direct_deps()
+        keys = QueryExpression('deps(test_query:poppy)', '.').evaluate(
+                self.all_targets, direct_deps)
+        poppy = ('test_query', 'poppy')
+
+        output = StringIO()
+        write_query_result(output, 'jsonl', keys, self.all_targets,
+                           direct_deps)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([row['target'] for row in rows],
+                         ['//%s:%s' % key for key in keys])
+        poppy_row = rows[keys.index(poppy)]
+        self.assertEqual(poppy_row['type'], 'cc_library')
+        self.assertTrue('//test_query:rpc_option_proto' in poppy_row['deps'])
+
+        output = StringIO()
+        write_query_result(output, 'jsonl', keys, self.all_targets,
+                           direct_deps, transitive_reduction=True)
+        rows = [json.loads(line) for line in output.getvalue().splitlines()]
+        # poppy -> rpc_option_proto is implied by rpc_meta_info_proto
+        self.assertEqual(rows[keys.index(poppy)]['deps'],
+                         ['//test_query:rpc_meta_info_proto',
+                          '//test_query:static_resource'])
+
+        output = StringIO()
+        write_query_result(output, 'binary', keys, self.all_targets,
+                           direct_deps)
+        self.assertTrue(output.getvalue().startswith(BINARY_MAGIC))
+        self.assertEqual(ord(output.getvalue()[len(BINARY_MAGIC)]),
+                         len(keys))
+
+        output = StringIO()
+        write_query_result(output, 'dot', keys, self.all_targets,
+                           direct_deps)
+        dot = output.getvalue()
+        self.assertEqual(dot.count('subgraph cluster_'),
+                         len(set(key[0] for key in keys)))
+        self.assertTrue('"//test_query:poppy" -> '
+                        '"//test_query:static_resource";' in dot)
+
 
 if __name__ == '__main__':
     blade_test.run(TestQuery)
@@ -14,6 +14,8 @@
 
 import os
 import blade_test
+import blade.blade
+from blade.blade import Blade
 
 
 class TestDepsAnalyzing(blade_test.TargetTest):
@@ -77,6 +79,61 @@ class TestDepsAnalyzing(blade_test.TargetTest):
         self.assertTrue(java_jar_prebuild in java_jar_deps)
         self.assertTrue(cc_library_poppy not in java_jar_deps)
 
+        self.assertTrue(self.all_targets[proto_lib_meta].data['generate_java'])
+        self.assertTrue(self.all_targets[proto_lib_meta].data['generate_php'])
+
+    def testExpandedDepsOrder(self):
+        """Test that every target comes before the targets it depends on
+
+        in the expanded deps, which is required by linking.
+
+        """
+        for key in self.all_targets:
+            deps = self.all_targets[key].expanded_deps
+            self.assertEqual(len(deps), len(set(deps)))
+            for i, dep in enumerate(deps):
+                for dep_dep in self.all_targets[dep].expanded_deps:
+                    self.assertTrue(dep_dep in deps[i + 1:])
+
+    def testTargetLevels(self):
+        """Test the topological levels of the targets. """
+        target_levels = self.blade.get_target_levels()
+        levels = target_levels.levels
+        self.assertEqual(sorted(sum(levels, [])), sorted(self.all_targets))
+        for level, keys in enumerate(levels):
+            for key in keys:
+                self.assertEqual(target_levels.height[key], level)
+                for dep in self.all_targets[key].expanded_deps:
+                    self.assertTrue(target_levels.height[dep] < level)
+                    self.assertTrue(target_levels.depth[dep] >
+                                    target_levels.depth[key])
+        self.assertEqual(target_levels.height[('#', 'pthread')], 0)
+
+    def testDepsClosureCache(self):
+        """Test that the expanded deps restored from the closure cache are
+        the same as the expanded deps computed by analyzing.
+
+        """
+        cache_file = self.blade.get_blade_cache_file('deps_closures')
+        self.assertTrue(os.path.isfile(cache_file))
+
+        blade.blade.blade = Blade(self.targets,
+                                  self.blade_path,
+                                  self.working_dir,
+                                  self.current_building_path,
+                                  self.current_source_dir,
+                                  self.options,
+                                  self.command)
+        cached_blade = blade.blade.blade
+        cached_blade.load_targets()
+        cached_targets = cached_blade.analyze_targets()
+        self.assertEqual(sorted(cached_targets), sorted(self.all_targets))
+        for key in self.all_targets:
+            target = self.all_targets[key]
+            cached_target = cached_targets[key]
+            self.assertEqual(target.expanded_deps, cached_target.expanded_deps)
+            self.assertEqual(target.data, cached_target.data)
+
 
 if __name__ == '__main__':
     blade_test.run(TestDepsAnalyzing)